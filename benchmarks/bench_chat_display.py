@@ -0,0 +1,51 @@
+"""Benchmarks the per-message UI cost of MainWindow.update_chat_display against session length.
+
+Compares appending one message with a full transcript reset and with the incremental update,
+including the layout and paint work Qt does before the next frame. Runs on the offscreen Qt platform.
+
+Usage: python benchmarks/bench_chat_display.py [--lengths 100,1000,5000] [--samples N] [--json]
+"""
+import argparse
+import sys
+import tempfile
+
+from common import load_app_module, patch_message_boxes, timed, summarize, print_results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--lengths", default="100,1000,5000", help="comma separated session lengths")
+    parser.add_argument("--samples", type=int, default=20, help="messages appended per measurement")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    app_module = load_app_module(tempfile.mkdtemp(prefix="mychat-bench-"))
+    patch_message_boxes(app_module)
+    app = app_module.QApplication(sys.argv)
+    window = app_module.MainWindow()
+    window.show()
+
+    def update_and_paint(full):
+        window.update_chat_display(full=full)
+        app.processEvents()
+        window.chat_display.viewport().grab()
+    manager = window.chat_session_manager
+    results = {}
+    for length in [int(value) for value in args.lengths.split(",")]:
+        for mode in ["full reset", "incremental"]:
+            window.new_session()
+            session_id = window.current_session_id
+            for i in range(length):
+                manager.add_message(session_id, "You" if i % 2 == 0 else "AI", f"Message *{i}* with some text.", "[bench]", "bench")
+            update_and_paint(True)
+            samples = []
+            for i in range(args.samples):
+                manager.add_message(session_id, "AI", f"New message {i}", "[bench]", "bench")
+                elapsed, _ = timed(update_and_paint, mode == "full reset")
+                samples.append(elapsed)
+            results[f"{length} messages, {mode}"] = summarize(samples)
+            manager.delete_session(session_id)
+    print_results(results, args.json)
+    app.quit()
+
+if __name__ == "__main__":
+    main()
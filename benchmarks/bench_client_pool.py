@@ -0,0 +1,51 @@
+"""Benchmarks per-message latency with a fresh client per request versus the shared ClientPool.
+
+Usage: python benchmarks/bench_client_pool.py [--messages N] [--json]
+"""
+import argparse
+import tempfile
+import time
+
+from common import load_app_module, summarize, print_results
+from stub_server import start_stub_server
+
+def run_messages(app, provider, provider_config, count, pooled):
+    """Streams `count` answers through the provider's adapter and returns the per-message durations."""
+    history = app.MessageLog([{"role": "user", "content": "Hello"}]).snapshot()
+    adapter = app.get_adapter(provider)
+    converted_history = adapter.format(history, "You are a helpful assistant.")
+    prompt_cache = {"window_start": None, "gemini": None, "input_tokens": 0, "cached_tokens": 0}
+    samples = []
+    for _ in range(count):
+        if not pooled:
+            app.client_pool.invalidate(provider)
+        attempt = app.ProviderAttempt(None, provider, provider_config, history, converted_history, prompt_cache, None)
+        attempt.begin()
+        start = time.perf_counter()
+        "".join(adapter.stream(attempt, provider_config, converted_history))
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    app = load_app_module(tempfile.mkdtemp(prefix="mychat-bench-"))
+    server, base_url = start_stub_server()
+    results = {}
+    try:
+        for provider, provider_config in [
+            ("OpenAI Compatible", {"api_key": "bench", "base_url": base_url + "/v1", "model": "stub"}),
+            ("xAI Grok", {"api_key": "bench", "base_url": base_url + "/v1", "model": "stub"}),
+            ("Ollama", {"api_key": "", "base_url": base_url, "ollama_model": "stub:latest"}),
+        ]:
+            results[f"{provider} fresh client"] = summarize(run_messages(app, provider, provider_config, args.messages, False))
+            results[f"{provider} pooled client"] = summarize(run_messages(app, provider, provider_config, args.messages, True))
+    finally:
+        server.shutdown()
+    print_results(results, args.json)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Benchmarks session storage, history conversion and rendering against synthetic chat_logs corpora.
+
+For each corpus shape (see corpus.py) it measures ChatSessionManager.load_sessions, load_session, add_message,
+save_session and compact_session, convert_conversation_history per provider (full and incremental),
+MessageManager.format_message, and MainWindow.update_chat_display/update_session_list with the paint that follows,
+on the offscreen Qt platform. Mutating steps work on a scratch copy of the largest session, so a corpus kept with
+--workdir stays the same from run to run and results can be compared across versions. MainWindow startup includes
+indexing the corpus for search the first time a corpus is opened.
+
+Usage: python benchmarks/bench_sessions.py [--shapes many,long,attachments] [--scale F] [--store json|sqlite]
+                                           [--samples N] [--workdir DIR] [--json]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+from common import load_app_module, patch_message_boxes, timed, summarize, print_results
+from corpus import CORPUS_SHAPES, scaled_shape, generate_corpus
+
+PROVIDERS = ["OpenAI", "Anthropic Claude", "Google Gemini", "Ollama"]
+FORMAT_BATCH = 1000  # messages formatted per format_message sample
+SCRATCH_SESSION = "Session_bench_scratch"
+
+def largest_session(manager):
+    return max(manager.sessions, key=lambda session_id: manager.sessions[session_id]["message_count"])
+
+def copy_session(manager, session_id, copy_id):
+    """Stores a copy of a session under another id and reloads the index so the manager sees it."""
+    manager.load_session(session_id)
+    snapshot = dict(manager.session_snapshot(session_id), session_name="Benchmark scratch")
+    manager.store.write_snapshot(copy_id, snapshot)
+    manager.store.update_index(copy_id, dict(manager.session_metadata(session_id), session_name="Benchmark scratch"))
+    manager.unload_session(session_id)
+    manager.load_sessions()
+
+def bench_storage(app, manager, samples, rng):
+    """Measures loading the index and session bodies, and adding and saving messages."""
+    results = {}
+    results["load_sessions"] = summarize([timed(manager.load_sessions)[0] for _ in range(samples)])
+
+    session_ids = list(manager.sessions)
+    load_times = []
+    for session_id in [rng.choice(session_ids) for _ in range(samples)]:
+        manager.unload_session(session_id)
+        load_times.append(timed(manager.load_session, session_id)[0])
+        manager.unload_session(session_id)
+    results["load_session"] = summarize(load_times)
+
+    copy_session(manager, largest_session(manager), SCRATCH_SESSION)
+    manager.load_session(SCRATCH_SESSION)
+    add_times, save_times = [], []
+    for number in range(samples):
+        add_times.append(timed(manager.add_message, SCRATCH_SESSION, "You", f"Benchmark message {number}",
+                               "[bench]", "bench")[0])
+        save_times.append(timed(manager.save_session, SCRATCH_SESSION)[0])
+    results["add_message"] = summarize(add_times)
+    results["save_session"] = summarize(save_times)
+    results["compact_session"] = summarize([timed(manager.compact_session, SCRATCH_SESSION)[0] for _ in range(samples)])
+    return results
+
+def bench_history(app, manager, samples):
+    """Measures converting the scratch session's history for each provider, from scratch and after one new
+    message (reusing the earlier conversions)."""
+    results = {}
+    system_prompt = "You are a helpful assistant."
+    for provider in PROVIDERS:
+        history = manager.get_conversation_history(SCRATCH_SESSION).snapshot()
+        results[f"convert_conversation_history {provider} full"] = summarize([
+            timed(manager.convert_conversation_history, history, provider, system_prompt)[0] for _ in range(samples)])
+        manager.convert_conversation_history(history, provider, system_prompt, SCRATCH_SESSION)
+        incremental = []
+        for number in range(samples):
+            manager.add_message(SCRATCH_SESSION, "You", f"Follow-up {number}", "[bench]", provider)
+            history = manager.get_conversation_history(SCRATCH_SESSION).snapshot()
+            incremental.append(timed(manager.convert_conversation_history, history, provider, system_prompt,
+                                     SCRATCH_SESSION)[0])
+        results[f"convert_conversation_history {provider} incremental"] = summarize(incremental)
+    manager.forget_request_state(SCRATCH_SESSION)
+    manager.save_session(SCRATCH_SESSION)
+    return results
+
+def bench_format_message(app, manager, samples, rng):
+    """Measures MessageManager.format_message over batches of the scratch session's messages."""
+    message_manager = app.MessageManager()
+    messages = [message for _, message, _ in manager.get_session_messages(SCRATCH_SESSION)]
+    batch_times = []
+    for _ in range(samples):
+        batch = [rng.choice(messages) for _ in range(FORMAT_BATCH)]
+        elapsed, _ = timed(lambda: [message_manager.format_message(message) for message in batch])
+        batch_times.append(elapsed)
+    return {f"format_message x{FORMAT_BATCH}": summarize(batch_times)}
+
+def bench_window(app, qt_app, samples, rng):
+    """Measures MainWindow rendering of the scratch session and of the session list, including the paint."""
+    results = {}
+    startup, window = timed(app.MainWindow)
+    results["MainWindow startup"] = summarize([startup])
+    window.show()
+    manager = window.chat_session_manager
+
+    def update_chat_display(full):
+        window.update_chat_display(full=full)
+        qt_app.processEvents()
+        window.chat_display.viewport().grab()
+
+    def update_session_list():
+        window.update_session_list()
+        qt_app.processEvents()
+        window.session_list_widget.viewport().grab()
+
+    window.current_session_id = SCRATCH_SESSION
+    update_chat_display(True)
+    results["update_chat_display full"] = summarize([timed(update_chat_display, True)[0] for _ in range(samples)])
+    incremental = []
+    for number in range(samples):
+        manager.add_message(SCRATCH_SESSION, "AI", f"Benchmark answer {number}", "[bench]", "bench")
+        incremental.append(timed(update_chat_display, False)[0])
+    results["update_chat_display incremental"] = summarize(incremental)
+
+    session_ids = list(manager.sessions)
+    session_list = []
+    for _ in range(samples):
+        window.current_session_id = rng.choice(session_ids)
+        session_list.append(timed(update_session_list)[0])
+    results["update_session_list"] = summarize(session_list)
+
+    manager.delete_session(SCRATCH_SESSION)
+    window.current_session_id = None
+    window.close()
+    qt_app.processEvents()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--shapes", default="many,long,attachments", help="comma separated corpus shapes")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the session and message counts")
+    parser.add_argument("--store", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--samples", type=int, default=20, help="measurements per operation")
+    parser.add_argument("--workdir", help="keep the corpora in this directory and reuse them on later runs")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="mychat-bench-")
+    app = load_app_module(root)
+    patch_message_boxes(app)
+    qt_app = app.QApplication(sys.argv)
+    results = {}
+    try:
+        for name in args.shapes.split(","):
+            shape = scaled_shape(CORPUS_SHAPES[name], args.scale)
+            label = f"{name} ({shape['sessions']}x{shape['messages']}, {args.store})"
+            workdir = os.path.join(root, f"{name}-{shape['sessions']}x{shape['messages']}-{args.store}")
+            os.makedirs(workdir, exist_ok=True)
+            generate_corpus(app, workdir, shape, args.store)
+            os.chdir(workdir)  # MainWindow and the stores' default paths are relative to the working directory
+
+            rng = random.Random(0)
+            store = app.create_session_store({"session_store": args.store})
+            manager = app.ChatSessionManager(store, app.BlobStore(os.path.join("chat_logs", "blobs")))
+            measured = bench_storage(app, manager, args.samples, rng)
+            measured.update(bench_history(app, manager, args.samples))
+            measured.update(bench_format_message(app, manager, args.samples, rng))
+            if args.store == "sqlite":
+                store.connection.close()
+            measured.update(bench_window(app, qt_app, args.samples, rng))
+            results.update({f"{label} {operation}": stats for operation, stats in measured.items()})
+    finally:
+        os.chdir(root)
+        if not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+    print_results(results, args.json)
+    qt_app.quit()
+
+if __name__ == "__main__":
+    main()
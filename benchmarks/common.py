@@ -0,0 +1,61 @@
+"""Shared helpers for the MyChat benchmark scripts."""
+import os
+import sys
+import json
+import time
+import importlib.util
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_app_module(workdir=None):
+    """Imports mychat-pyqt-updated.py as a module, running it from `workdir` (chat_logs, config.yaml, mychat.log)."""
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    if workdir:
+        os.makedirs(workdir, exist_ok=True)
+        os.chdir(workdir)
+    spec = importlib.util.spec_from_file_location("mychat_pyqt_updated", os.path.join(REPO_DIR, "mychat-pyqt-updated.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def patch_message_boxes(module):
+    """Makes the app's modal message boxes no-ops so windows can be driven headless."""
+    for name in ["information", "warning", "critical"]:
+        setattr(module.QMessageBox, name, staticmethod(lambda *args, **kwargs: None))
+
+def timed(func, *args, **kwargs):
+    """Runs func once and returns (elapsed seconds, result)."""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def summarize(samples):
+    """Returns mean/p50/p95/min/max (in milliseconds) for a list of durations in seconds."""
+    millis = [sample * 1000 for sample in samples]
+    return {
+        "n": len(millis),
+        "mean_ms": sum(millis) / len(millis) if millis else 0.0,
+        "p50_ms": percentile(millis, 0.50),
+        "p95_ms": percentile(millis, 0.95),
+        "min_ms": min(millis) if millis else 0.0,
+        "max_ms": max(millis) if millis else 0.0,
+    }
+
+def print_results(results, as_json=False):
+    """Prints benchmark results either as JSON or as an aligned table."""
+    if as_json:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return
+    width = max((len(name) for name in results), default=0)
+    for name, stats in results.items():
+        print(f"{name:{width}s} n={stats['n']:<6d} mean={stats['mean_ms']:9.3f}ms "
+              f"p50={stats['p50_ms']:9.3f}ms p95={stats['p95_ms']:9.3f}ms")
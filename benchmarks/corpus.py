@@ -0,0 +1,132 @@
+"""Generates synthetic chat_logs corpora for the benchmarks.
+
+Sessions are written through the app's own session and blob stores, so a corpus is exactly what the app would
+have saved: JSON snapshots plus the metadata index, or the SQLite database, and attachments in the blob store.
+
+Usage: python benchmarks/corpus.py DIR [--shape many|long|attachments] [--scale F] [--store json|sqlite]
+       python benchmarks/corpus.py DIR --sessions N --messages N [--attachments N --attachment-kb N]
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from common import load_app_module
+
+# Named corpus shapes: sessions x messages per session, plus attachments per session of attachment_kb each
+CORPUS_SHAPES = {
+    "many": {"sessions": 10000, "messages": 200, "attachments": 0, "attachment_kb": 0},
+    "long": {"sessions": 1, "messages": 50000, "attachments": 0, "attachment_kb": 0},
+    "attachments": {"sessions": 20, "messages": 50, "attachments": 2, "attachment_kb": 4096},
+}
+
+WORDS = ("the a model answer request session message provider token cache window stream latency python qt "
+         "function value list index error result config history context prompt file data time").split()
+
+def scaled_shape(shape, scale):
+    """Returns a shape with its session and message counts multiplied by scale (at least one of each)."""
+    return dict(shape, sessions=max(1, int(shape["sessions"] * scale)), messages=max(1, int(shape["messages"] * scale)))
+
+def random_text(rng, words):
+    """Returns a message of about `words` words with the markup MessageManager.format_message handles."""
+    parts = [rng.choice(WORDS) for _ in range(words)]
+    for marker in "*_~":
+        if words > 8 and rng.random() < 0.3:
+            position = rng.randrange(words - 1)
+            parts[position] = f"{marker}{parts[position]}{marker}"
+    text = " ".join(parts)
+    if words > 40 and rng.random() < 0.3:
+        text += "\n```\ndef example(value):\n    return value * 2\n```"
+    return text
+
+def session_snapshot(rng, index, shape, blob_store, start_time):
+    """Returns the snapshot of one synthetic session: alternating user and AI messages, then its attachments."""
+    chat_log, history = [], []
+    for number in range(shape["messages"]):
+        timestamp = time.strftime("[%Y-%m-%d %H:%M:%S]", time.localtime(start_time + number * 30))
+        if number % 2 == 0:
+            sender, role, message = "You", "user", random_text(rng, rng.randint(5, 60))
+        else:
+            sender, role, message = "AI", "assistant", random_text(rng, rng.randint(30, 300))
+        chat_log.append((sender, message, timestamp))
+        history.append({"role": role, "content": message})
+    attached_files = {}
+    for number in range(shape["attachments"]):
+        file_name = f"attachment_{index}_{number}.bin"
+        attached_files[file_name] = blob_store.put_bytes(rng.randbytes(shape["attachment_kb"] * 1024), file_name)
+        chat_log.append(("System", f"File attached: {file_name}", chat_log[-1][2] if chat_log else ""))
+    return {
+        "session_name": f"Benchmark session {index}",
+        "chat_log": chat_log,
+        "conversation_history": history,
+        "attached_files": attached_files,
+    }
+
+def generate_corpus(app, workdir, shape, store="json", seed=0):
+    """Writes a corpus of the given shape to workdir/chat_logs (with a config.yaml selecting the store), unless
+    one of that shape is already there. Returns the number of seconds spent generating it."""
+    log_dir = os.path.join(workdir, "chat_logs")
+    marker_path = os.path.join(workdir, "corpus.json")
+    description = dict(shape, store=store, seed=seed)
+    if os.path.exists(marker_path):
+        with open(marker_path, "r", encoding="utf-8") as file:
+            if json.load(file) == description:
+                return 0.0
+        raise ValueError(f"{workdir} holds a corpus of another shape; use an empty directory")
+    os.makedirs(log_dir, exist_ok=True)
+    with open(os.path.join(workdir, "config.yaml"), "w", encoding="utf-8") as file:
+        file.write(f"session_store: {store}\n")
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    blob_store = app.BlobStore(os.path.join(log_dir, "blobs"))
+    if store == "sqlite":
+        session_store = app.SQLiteSessionStore(os.path.join(log_dir, "sessions.db"))
+    else:
+        session_store = app.JournalSessionStore(log_dir)
+    start_time = time.time() - shape["sessions"] * 3600
+    index = {}
+    for number in range(shape["sessions"]):
+        session_id = f"Session_bench_{number:06d}"
+        snapshot = session_snapshot(rng, number, shape, blob_store, start_time + number * 3600)
+        snapshot["conversation_history"] = app.MessageLog(snapshot["conversation_history"]).to_list()
+        last_activity = start_time + number * 3600 + shape["messages"] * 30
+        session_store.write_snapshot(session_id, snapshot, last_activity=last_activity)
+        index[session_id] = {
+            "session_name": snapshot["session_name"],
+            "last_activity": last_activity,
+            "message_count": len(snapshot["chat_log"]),
+            "byte_size": sum(len(message.encode("utf-8")) for _, message, _ in snapshot["chat_log"]),
+        }
+    if store == "json":
+        session_store.write_index(index)
+    else:
+        session_store.connection.close()
+    with open(marker_path, "w", encoding="utf-8") as file:
+        json.dump(description, file)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("workdir", help="directory to create chat_logs and config.yaml in")
+    parser.add_argument("--shape", choices=sorted(CORPUS_SHAPES), default="many")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplies the session and message counts")
+    parser.add_argument("--sessions", type=int, help="overrides the shape's session count")
+    parser.add_argument("--messages", type=int, help="overrides the shape's messages per session")
+    parser.add_argument("--attachments", type=int, help="overrides the shape's attachments per session")
+    parser.add_argument("--attachment-kb", type=int, help="overrides the shape's attachment size")
+    parser.add_argument("--store", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    shape = scaled_shape(CORPUS_SHAPES[args.shape], args.scale)
+    for field in ["sessions", "messages", "attachments", "attachment_kb"]:
+        if getattr(args, field) is not None:
+            shape[field] = getattr(args, field)
+    workdir = os.path.abspath(args.workdir)
+    app = load_app_module(workdir)
+    elapsed = generate_corpus(app, workdir, shape, args.store, args.seed)
+    print(f"{shape['sessions']} sessions x {shape['messages']} messages ({args.store}) in {workdir}: {elapsed:.1f}s")
+
+if __name__ == "__main__":
+    main()
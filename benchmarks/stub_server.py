@@ -0,0 +1,99 @@
+"""A local stub of the provider HTTP APIs, used by the benchmarks.
+
+Serves an OpenAI compatible `/v1/chat/completions` (also `/chat/completions`), streaming SSE when
+`stream` is true and a plain JSON completion otherwise, plus the Ollama `/api/chat` (NDJSON) and
+`/api/tags` endpoints. With `stream_options.include_usage` the stream ends with a usage event that
+reports everything before the last message as cached once a `prompt_cache_key` has been seen.
+"""
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every chat request with a fixed reply split into word chunks."""
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled clients can reuse the connection
+    disable_nagle_algorithm = True
+    reply = "This is a stubbed answer from the local benchmark server."
+    delay = 0.0
+    cache_keys = set()
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        request = self.read_json()
+        if self.delay:
+            time.sleep(self.delay)
+        if self.path.rstrip("/").endswith("/chat/completions"):
+            self.handle_chat_completions(request)
+        elif self.path == "/api/chat":
+            self.handle_ollama_chat(request)
+        else:
+            self.send_error(404)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            models = {"models": [{"name": "stub:latest"}]}
+            self.send_body(json.dumps(models).encode("utf-8"), "application/json")
+        else:
+            self.send_error(404)
+
+    def handle_chat_completions(self, request):
+        words = [word + " " for word in self.reply.split()]
+        if request.get("stream"):
+            events = [{"choices": [{"index": 0, "delta": {"content": word}}]} for word in words]
+            if (request.get("stream_options") or {}).get("include_usage"):
+                events.append({"choices": [], "usage": self.usage(request)})
+            body = "".join(f"data: {json.dumps(event)}\n\n" for event in events) + "data: [DONE]\n\n"
+            self.send_body(body.encode("utf-8"), "text/event-stream")
+        else:
+            completion = {"choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)}}]}
+            self.send_body(json.dumps(completion).encode("utf-8"), "application/json")
+
+    def usage(self, request):
+        tokens = [len(str(message.get("content", ""))) // 4 + 4 for message in request.get("messages", [])]
+        key = request.get("prompt_cache_key")
+        cached = sum(tokens[:-1]) if key in self.cache_keys else 0
+        if key:
+            self.cache_keys.add(key)
+        return {"prompt_tokens": sum(tokens), "completion_tokens": len(self.reply.split()),
+                "prompt_tokens_details": {"cached_tokens": cached}}
+
+    def handle_ollama_chat(self, request):
+        if not request.get("messages"):
+            body = json.dumps({"error": "messages are required"}) + "\n"
+            self.send_body(body.encode("utf-8"), "application/x-ndjson")
+            return
+        words = [word + " " for word in self.reply.split()]
+        model = request.get("model", "")
+        lines = [{"model": model, "message": {"role": "assistant", "content": word}, "done": False} for word in words]
+        lines.append({"model": model, "message": {"role": "assistant", "content": ""}, "done": True})
+        body = "".join(json.dumps(line) + "\n" for line in lines)
+        self.send_body(body.encode("utf-8"), "application/x-ndjson")
+
+def start_stub_server(host="127.0.0.1", port=0):
+    """Starts the stub server on a background thread and returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    server, base_url = start_stub_server(port=8765)
+    print(f"Stub provider server listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -3,18 +3,40 @@ import os
 import json
 import yaml
 import logging
-from datetime import datetime
+import time
+import io
+import base64
+import sqlite3
+import hashlib
+import tempfile
+import bisect
+import mimetypes
+import re
+import random
+import math
+import email.utils
+import socket
+import queue
+from collections import OrderedDict, deque
+import threading
+import asyncio
+import concurrent.futures
+import functools
+from datetime import datetime, timedelta
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QListWidget, QPushButton,
-    QTextEdit, QTextBrowser, QFileDialog, QDialog, QGridLayout, QMessageBox, QLineEdit, QComboBox, QFrame, QListWidgetItem
+    QTextEdit, QFileDialog, QDialog, QGridLayout, QMessageBox, QLineEdit, QComboBox, QFrame, QListWidgetItem,
+    QInputDialog, QListView, QStyledItemDelegate, QStyle, QAbstractItemView, QShortcut, QCheckBox, QTableWidget,
+    QTableWidgetItem
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
-from PyQt5.QtGui import QFont, QKeySequence, QTextCursor
+from PyQt5.QtCore import Qt, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal, QAbstractListModel, QModelIndex, QSize, QRectF, QUrl
+from PyQt5.QtGui import QFont, QKeySequence, QTextDocument, QColor, QPen, QDesktopServices
 import google.generativeai as genai
-from openai import OpenAI
+from google.generativeai import caching
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient, APIConnectionError
 import anthropic
 import requests
-import subprocess
+from requests.adapters import HTTPAdapter
 
 # Configure logging
 logging.basicConfig(filename='mychat.log', level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -23,10 +45,259 @@ logging.basicConfig(filename='mychat.log', level=logging.ERROR, format='%(asctim
 if not os.path.exists("chat_logs"):
     os.makedirs("chat_logs")
 
+class Span:
+    """A timed section of code, recorded by the Tracer when it ends."""
+    __slots__ = ("tracer", "name", "category", "args", "start")
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.tracer.record(self.name, self.category, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+    def set(self, **args):
+        """Adds arguments shown with the span, e.g. sizes known only once it has run."""
+        self.args = dict(self.args or {}, **args)
+
+class NullSpan:
+    """The span returned while tracing is off; does nothing."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def set(self, **args):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class Tracer:
+    """Records spans as Chrome trace events, to open in chrome://tracing or Perfetto.
+
+    Spans are always compiled in: while tracing is off, span() returns a shared no-op span and traced functions
+    call straight through, so the cost is one attribute check. Tracing is started from the Settings menu or, for a
+    whole run, by setting MYCHAT_TRACE to the file the trace is written to on exit.
+    """
+    def __init__(self, max_events=1000000):
+        self.enabled = False
+        self.path = None  # where to write the trace on exit
+        self.events = deque(maxlen=max_events)
+        self.thread_names = {}  # {thread id: name}
+        self.pid = os.getpid()
+
+    def start(self, path=None):
+        self.events.clear()
+        self.path = path
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def span(self, name, category="app", **args):
+        """Returns a context manager timing the code it wraps."""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, args)
+
+    def traced(self, name=None, category="app"):
+        """Decorates a function or coroutine function so every call is a span."""
+        def decorate(function):
+            span_name = name or function.__qualname__
+            if asyncio.iscoroutinefunction(function):
+                @functools.wraps(function)
+                async def async_wrapper(*args, **kwargs):
+                    if not self.enabled:
+                        return await function(*args, **kwargs)
+                    with Span(self, span_name, category, None):
+                        return await function(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with Span(self, span_name, category, None):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def instant(self, name, category="app", **args):
+        """Records a point in time, e.g. a first token."""
+        if self.enabled:
+            self.append({"name": name, "cat": category, "ph": "i", "s": "t", "ts": time.perf_counter_ns() / 1000,
+                         "args": args})
+
+    def record(self, name, category, start, end, args):
+        event = {"name": name, "cat": category, "ph": "X", "ts": start / 1000, "dur": (end - start) / 1000}
+        if args:
+            event["args"] = args
+        self.append(event)
+
+    def append(self, event):
+        thread_id = threading.get_ident()
+        if thread_id not in self.thread_names:
+            self.thread_names[thread_id] = threading.current_thread().name
+        event["pid"] = self.pid
+        event["tid"] = thread_id
+        self.events.append(event)  # deque appends are thread-safe
+
+    def export(self, path):
+        """Writes the recorded events as Chrome trace-event JSON."""
+        metadata = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": thread_id, "args": {"name": name}}
+                    for thread_id, name in list(self.thread_names.items())]
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump({"traceEvents": list(self.events) + metadata, "displayTimeUnit": "ms"}, file)
+
+tracer = Tracer()
+if os.environ.get("MYCHAT_TRACE"):
+    tracer.start(os.environ["MYCHAT_TRACE"])
+
+class ClientPool:
+    """Process-wide registry of provider clients keyed by (provider, api_key, base_url).
+
+    Clients keep their HTTP keep-alive connection pools warm and are shared by every worker thread.
+    """
+    def __init__(self, pool_maxsize=10):
+        self.pool_maxsize = pool_maxsize
+        self.clients = {}  # {(provider, api_key, base_url): client}
+        self.gemini_api_key = None
+        self.lock = threading.Lock()
+
+    def get_client(self, provider, provider_config):
+        """Returns the shared client for a provider configuration, creating it on first use."""
+        key = (provider, provider_config.get("api_key", ""), provider_config.get("base_url", ""))
+        with self.lock:
+            client = self.clients.get(key)
+            if client is None:
+                client = self.create_client(*key)
+                self.clients[key] = client
+            return client
+
+    def get_gemini_model(self, provider_config):
+        """Returns a cached Gemini model, configuring the SDK only when the API key changes."""
+        models = self.get_client("Google Gemini", provider_config)
+        model_name = provider_config.get("model", "gemini-pro")
+        system_prompt = provider_config.get("system_prompt") or None
+        with self.lock:
+            self.configure_gemini(provider_config)
+            if (model_name, system_prompt) not in models:
+                models[(model_name, system_prompt)] = genai.GenerativeModel(model_name, system_instruction=system_prompt)
+            return models[(model_name, system_prompt)]
+
+    def configure_gemini(self, provider_config):
+        if self.gemini_api_key != provider_config.get("api_key", ""):
+            # genai keeps a single global client, so switching keys needs a reconfigure
+            genai.configure(api_key=provider_config.get("api_key", ""))
+            self.gemini_api_key = provider_config.get("api_key", "")
+
+    def create_gemini_cache(self, provider_config, contents, ttl):
+        """Stores a conversation prefix (with the system prompt) as Gemini cached content.
+
+        Returns the CachedContent and a model that reads from it.
+        """
+        with self.lock:
+            self.configure_gemini(provider_config)
+        cached_content = caching.CachedContent.create(
+            model=provider_config.get("model", "gemini-pro"),
+            system_instruction=provider_config.get("system_prompt") or None,
+            contents=contents,
+            ttl=timedelta(seconds=ttl))
+        return cached_content, genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+
+    def create_client(self, provider, api_key, base_url):
+        """Creates a new client for the given provider settings."""
+        return get_adapter(provider).create_client(api_key, base_url, self.pool_maxsize)
+
+    def invalidate(self, provider):
+        """Closes and forgets every client built for a provider."""
+        with self.lock:
+            for key in [key for key in self.clients if key[0] == provider]:
+                client = self.clients.pop(key)
+                close = getattr(client, "close", None)
+                if close:
+                    try:
+                        close()
+                    except Exception as e:
+                        logging.error(f"Error closing {provider} client: {e}")
+            if provider == "Google Gemini":
+                self.gemini_api_key = None
+
+client_pool = ClientPool()
+
+class AsyncEngine:
+    """Runs provider requests as coroutines on one dedicated asyncio event-loop thread.
+
+    Streams wait on sockets instead of blocking a thread each, so any number of concurrent requests share the loop
+    thread. The async clients belong to the loop and are pooled by (provider, api_key, base_url) like ClientPool's.
+    """
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.clients = {}  # {(provider, api_key, base_url): async client}, only touched on the loop thread
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name="AsyncEngine", daemon=True)
+                self.thread.start()
+
+    def submit(self, coroutine):
+        """Schedules a coroutine on the loop thread and returns its concurrent.futures.Future."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def get_client(self, provider, provider_config):
+        """Returns the shared async client for a provider configuration; call from coroutines on the loop."""
+        key = (provider, provider_config.get("api_key", ""), provider_config.get("base_url", ""))
+        client = self.clients.get(key)
+        if client is None:
+            client = self.create_client(*key)
+            self.clients[key] = client
+        return client
+
+    def create_client(self, provider, api_key, base_url):
+        return get_adapter(provider).create_async_client(api_key, base_url)
+
+    def invalidate(self, provider):
+        """Closes and forgets every async client built for a provider."""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.close_clients, provider)
+
+    def close_clients(self, provider):
+        for key in [key for key in self.clients if key[0] == provider]:
+            client = self.clients.pop(key)
+            close = getattr(client, "aclose", None) or getattr(client, "close", None)
+            self.loop.create_task(close())
+
+async_engine = AsyncEngine()
+
+OLLAMA_DEFAULT_URL = "http://127.0.0.1:11434"
+
+# Context window sizes in tokens, by model name prefix (the longest matching prefix wins); a provider's
+# `context_window` setting overrides them. The history of other models is sent untrimmed.
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000, "gpt-4-turbo": 128000, "gpt-4": 8192, "gpt-3.5-turbo": 16385, "o1": 200000, "o3": 200000,
+    "claude": 200000, "gemini": 1048576, "grok": 131072, "llama3": 8192, "granite3.1": 128000,
+}
+
 class APIConfigManager:
     """Manages API configurations."""
     def __init__(self):
         self.config = self.load_config()
+        self.saved_connection_settings = self.connection_settings()
 
     def load_config(self):
         """Loads configuration from config.yaml."""
@@ -39,255 +310,2901 @@ class APIConfigManager:
             logging.error(f"Error loading config.yaml file: {e}")
             return {}
 
-    def save_config(self):
-        """Saves configuration to config.yaml."""
+    def save_config(self):
+        """Saves configuration to config.yaml and drops pooled clients whose settings changed."""
+        try:
+            with open("config.yaml", "w") as file:
+                yaml.dump(self.config, file)
+        except Exception as e:
+            logging.error(f"Error saving to config.yaml file: {e}")
+        connection_settings = self.connection_settings()
+        for provider in set(connection_settings) | set(self.saved_connection_settings):
+            if connection_settings.get(provider) != self.saved_connection_settings.get(provider):
+                client_pool.invalidate(provider)
+                async_engine.invalidate(provider)
+        self.saved_connection_settings = connection_settings
+
+    def connection_settings(self):
+        """Returns the settings pooled clients depend on, per provider."""
+        return {
+            provider: (provider_config.get("api_key", ""), provider_config.get("base_url", ""))
+            for provider, provider_config in self.config.items()
+            if isinstance(provider_config, dict)
+        }
+
+    def get_active_provider(self):
+        """Returns the active API provider."""
+        return self.config.get("active_provider", "")
+
+    def get_provider_config(self, provider):
+        """Returns the configuration for a specific provider."""
+        return self.config.get(provider, {})
+
+    def get_fallback_providers(self, session_id=None):
+        """Returns the providers to fail over to, in order: the session's own chain if it has one, else the
+        global one."""
+        fallback = self.config.get("fallback") or {}
+        sessions = fallback.get("sessions") or {}
+        if session_id in sessions:
+            return list(sessions[session_id])
+        return list(fallback.get("providers") or [])
+
+    def set_fallback_providers(self, providers, session_id=None):
+        """Saves the global fallback chain, or a session's own; providers=None drops the session's chain."""
+        fallback = self.config.setdefault("fallback", {})
+        if session_id is None:
+            fallback["providers"] = list(providers)
+        elif providers is None:
+            if session_id not in (fallback.get("sessions") or {}):
+                return
+            fallback["sessions"].pop(session_id)
+        else:
+            fallback.setdefault("sessions", {})[session_id] = list(providers)
+        self.save_config()
+
+    def provider_chain(self, session_id=None):
+        """Returns the active provider followed by the configured fallback providers that can be used."""
+        active = self.get_active_provider()
+        chain = [active] if active in PROVIDER_ADAPTERS else []
+        for provider in self.get_fallback_providers(session_id):
+            if provider in chain or provider not in PROVIDER_ADAPTERS or provider not in self.config:
+                continue
+            if PROVIDER_ADAPTERS[provider].validate(self.get_provider_config(provider)) is None:
+                chain.append(provider)
+        return chain
+
+class BlobStore:
+    """Content-addressed attachment storage: each distinct file is kept once under its SHA-256 digest."""
+    def __init__(self, root=os.path.join("chat_logs", "blobs"), chunk_size=1024 * 1024):
+        self.root = root
+        self.chunk_size = chunk_size
+        os.makedirs(self.root, exist_ok=True)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def put_file(self, file_path):
+        """Copies a file into the store in chunks while hashing it, and returns its attachment reference."""
+        with open(file_path, "rb") as source:
+            return self.put_stream(source, os.path.basename(file_path))
+
+    def put_bytes(self, data, file_name):
+        """Stores in-memory content and returns its attachment reference."""
+        return self.put_stream(io.BytesIO(data), file_name)
+
+    def put_stream(self, source, file_name):
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as target:
+                for chunk in iter(lambda: source.read(self.chunk_size), b""):
+                    digest.update(chunk)
+                    target.write(chunk)
+                    size += len(chunk)
+            sha256 = digest.hexdigest()
+            blob_path = self.blob_path(sha256)
+            if os.path.exists(blob_path):
+                os.remove(temp_path)  # identical content is already stored
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                os.replace(temp_path, blob_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return {
+            "sha256": sha256,
+            "name": file_name,
+            "size": size,
+            "mime": mimetypes.guess_type(file_name)[0] or "application/octet-stream",
+        }
+
+class JournalSessionStore:
+    """Persists each session as a JSON snapshot plus an append-only JSONL journal of later changes.
+
+    Writing a message costs one appended line; the snapshot is only rewritten when the journal is compacted.
+    """
+    def __init__(self, log_dir="chat_logs", compact_every=200):
+        self.log_dir = log_dir
+        self.compact_every = compact_every
+        self.journal_lengths = {}  # {session_id: number of records in the journal}
+
+    def snapshot_path(self, session_id):
+        return os.path.join(self.log_dir, f"{session_id}.json")
+
+    @property
+    def index_path(self):
+        return os.path.join(self.log_dir, "index.jsonl")
+
+    def journal_path(self, session_id):
+        return os.path.join(self.log_dir, f"{session_id}.journal.jsonl")
+
+    def load_all(self):
+        """Yields (session_id, snapshot, journal records) for every stored session."""
+        for filename in os.listdir(self.log_dir):
+            if filename.endswith(".json"):
+                session_id = filename[:-5]
+                try:
+                    with open(os.path.join(self.log_dir, filename), "r") as file:
+                        snapshot = json.load(file)
+                except json.JSONDecodeError:
+                    logging.error(f"Invalid JSON in file: {filename}")
+                    continue
+                except Exception as e:
+                    logging.error(f"Error loading session file {filename}: {e}")
+                    continue
+                yield session_id, snapshot, self.read_journal(session_id)
+
+    @tracer.traced(category="storage")
+    def load_session(self, session_id):
+        """Returns (snapshot, journal records) for one session, or None if it cannot be read."""
+        try:
+            with open(self.snapshot_path(session_id), "r") as file:
+                snapshot = json.load(file)
+        except json.JSONDecodeError:
+            logging.error(f"Invalid JSON in file: {session_id}.json")
+            return None
+        except Exception as e:
+            logging.error(f"Error loading session file {session_id}.json: {e}")
+            return None
+        return snapshot, self.read_journal(session_id)
+
+    def load_index(self):
+        """Reads the session metadata index in one pass, then brings it up to date with the session files: sessions
+        written since they were indexed (e.g. by the Tk frontend) or missing from it are read once, and sessions
+        whose files are gone are dropped. Without an index every session is read and a new one written."""
+        index = {}
+        lines = 0
+        exists = os.path.exists(self.index_path)
+        if exists:
+            with open(self.index_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    lines += 1
+                    session_id = entry.pop("session_id")
+                    if entry.get("deleted"):
+                        index.pop(session_id, None)
+                    else:
+                        index[session_id] = entry
+        changes = self.reconcile_index(index)
+        if not exists or lines + len(changes) > 2 * len(index) + 100:
+            self.write_index(index)
+        else:
+            for session_id, entry in changes.items():
+                self.update_index(session_id, entry)
+        return index
+
+    def reconcile_index(self, index):
+        """Updates index entries from the snapshot and journal times of one directory scan; returns the changed
+        entries ({"deleted": True} for dropped sessions)."""
+        written, snapshots = {}, set()
+        with os.scandir(self.log_dir) as entries:
+            for entry in entries:
+                if entry.name.endswith(".journal.jsonl"):
+                    session_id = entry.name[:-len(".journal.jsonl")]
+                elif entry.name.endswith(".json"):
+                    session_id = entry.name[:-len(".json")]
+                    snapshots.add(session_id)
+                else:
+                    continue
+                written[session_id] = max(written.get(session_id, 0), entry.stat().st_mtime)
+        changes = {}
+        for session_id in index.keys() - snapshots:
+            del index[session_id]
+            changes[session_id] = {"deleted": True}
+        for session_id in snapshots:
+            entry = index.get(session_id)
+            if entry is not None and written[session_id] <= entry.get("synced", entry["last_activity"]):
+                continue
+            loaded = self.load_session(session_id)
+            if loaded is None:
+                continue
+            index[session_id] = changes[session_id] = self.index_entry(session_id, *loaded, written[session_id])
+        return changes
+
+    def index_entry(self, session_id, snapshot, records, last_activity):
+        """Returns the index entry of a session read from its files."""
+        session_name = snapshot.get("session_name", session_id)
+        chat_log = [(entry[0], entry[1]) for entry in snapshot.get("chat_log", [])]
+        for record in records:
+            if record["type"] == "message":
+                chat_log.append((record["sender"], record["message"]))
+            elif record["type"] == "rename":
+                session_name = record["session_name"]
+        return {
+            "session_name": session_name,
+            "last_activity": last_activity,
+            "message_count": len(chat_log),
+            "byte_size": sum(len(message.encode("utf-8")) for _, message in chat_log),
+            "synced": last_activity,
+        }
+
+    def write_index(self, index):
+        """Atomically rewrites the index with one line per session."""
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            for session_id, metadata in index.items():
+                file.write(json.dumps(dict(metadata, session_id=session_id), separators=(",", ":")) + "\n")
+        os.replace(temp_path, self.index_path)
+
+    def update_index(self, session_id, metadata):
+        """Appends the latest metadata of a session to the index; the last line for a session wins.
+
+        Entries record when the session files were last written as of the update ("synced"), so load_index can tell
+        which sessions were changed without going through the index.
+        """
+        entry = dict(metadata, session_id=session_id)
+        if not entry.get("deleted"):
+            entry.setdefault("synced", self.last_activity(session_id))
+        with open(self.index_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+    def read_journal(self, session_id):
+        """Returns the records appended since the last snapshot, skipping a torn final line."""
+        self.recover(session_id)
+        records = self.read_records(session_id)
+        self.journal_lengths[session_id] = len(records)
+        return records
+
+    def read_records(self, session_id):
+        """Returns the records in a session's journal file as it is, without recovering an interrupted snapshot."""
+        records = []
+        journal_path = self.journal_path(session_id)
+        if os.path.exists(journal_path):
+            with open(journal_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        logging.error(f"Skipping corrupt journal record for session {session_id}")
+        return records
+
+    def has_snapshot(self, session_id):
+        return os.path.exists(self.snapshot_path(session_id))
+
+    @tracer.traced(category="storage")
+    def append(self, session_id, records):
+        """Appends records to the session journal."""
+        with open(self.journal_path(session_id), "a", encoding="utf-8") as file:
+            for record in records:
+                file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.journal_lengths[session_id] = self.journal_lengths.get(session_id, 0) + len(records)
+
+    def needs_compaction(self, session_id):
+        return self.journal_lengths.get(session_id, 0) >= self.compact_every
+
+    def message_meta(self):
+        """Yields the metadata of every stored message that has any.
+
+        It only reads the files (no recovery, no journal bookkeeping), so it can run on a worker thread; a session
+        compacted meanwhile may be counted as of either version.
+        """
+        for filename in os.listdir(self.log_dir):
+            if not filename.endswith(".json"):
+                continue
+            session_id = filename[:-5]
+            try:
+                with open(os.path.join(self.log_dir, filename), "r") as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError) as e:
+                logging.error(f"Error loading session file {filename}: {e}")
+                continue
+            yield from snapshot.get("message_meta", {}).values()
+            for record in self.read_records(session_id):
+                if record.get("type") == "message" and record.get("meta"):
+                    yield record["meta"]
+
+    @tracer.traced(category="storage")
+    def write_snapshot(self, session_id, snapshot, last_activity=None):
+        """Atomically replaces the snapshot and truncates the journal it now contains.
+
+        The journal is set aside while the snapshot is replaced and removed after, so recover can tell after a
+        crash whether the snapshot on disk already contains it.
+        """
+        snapshot_path = self.snapshot_path(session_id)
+        temp_path = snapshot_path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump(snapshot, file, separators=(",", ":"))
+        if os.path.exists(self.journal_path(session_id)):
+            os.replace(self.journal_path(session_id), self.aside_path(session_id))
+        os.replace(temp_path, snapshot_path)
+        if last_activity:
+            os.utime(snapshot_path, (last_activity, last_activity))
+        if os.path.exists(self.aside_path(session_id)):
+            os.remove(self.aside_path(session_id))
+        self.journal_lengths[session_id] = 0
+
+    def aside_path(self, session_id):
+        return self.journal_path(session_id) + ".old"
+
+    def recover(self, session_id):
+        """Finishes a write_snapshot interrupted by a crash: a journal set aside goes back if the new snapshot never
+        replaced the old one (its temporary file is still there), and is dropped if it did."""
+        aside_path = self.aside_path(session_id)
+        if not os.path.exists(aside_path):
+            return
+        temp_path = self.snapshot_path(session_id) + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+            os.replace(aside_path, self.journal_path(session_id))
+        else:
+            os.remove(aside_path)
+
+    def delete(self, session_id):
+        """Removes the snapshot and journal of a session."""
+        for path in [self.snapshot_path(session_id), self.journal_path(session_id), self.aside_path(session_id)]:
+            if os.path.exists(path):
+                os.remove(path)
+        self.journal_lengths.pop(session_id, None)
+        self.update_index(session_id, {"deleted": True})
+
+    def last_activity(self, session_id):
+        """Returns the time the session was last written."""
+        paths = [path for path in [self.snapshot_path(session_id), self.journal_path(session_id)] if os.path.exists(path)]
+        return max((os.path.getmtime(path) for path in paths), default=0)
+
+class SQLiteSessionStore:
+    """Persists sessions in a SQLite database with sessions, messages and attachments tables.
+
+    Each message is inserted in its own transaction. Startup reads only the sessions table (the metadata index);
+    the session list is ordered and paged in memory by ChatSessionManager, as for the JSON store.
+    """
+    def __init__(self, db_path=os.path.join("chat_logs", "sessions.db")):
+        self.db_path = db_path
+        self.created = not os.path.exists(db_path)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    session_name TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_activity REAL NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0,
+                    byte_size INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                    seq INTEGER NOT NULL,
+                    sender TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    provider TEXT
+                );
+                CREATE TABLE IF NOT EXISTS attachments (
+                    session_id TEXT NOT NULL REFERENCES sessions(session_id) ON DELETE CASCADE,
+                    file_name TEXT NOT NULL,
+                    content BLOB,
+                    sha256 TEXT,
+                    size INTEGER,
+                    mime TEXT,
+                    PRIMARY KEY (session_id, file_name)
+                );
+                CREATE INDEX IF NOT EXISTS idx_sessions_last_activity ON sessions(last_activity DESC);
+                CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, seq);
+            """)
+            # Attachments used to be stored inline; blob references were added later
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(attachments)")]
+            for column, column_type in [("sha256", "TEXT"), ("size", "INTEGER"), ("mime", "TEXT")]:
+                if column not in columns:
+                    self.connection.execute(f"ALTER TABLE attachments ADD COLUMN {column} {column_type}")
+            # Per-message metadata (JSON) was added later too
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(messages)")]
+            if "meta" not in columns:
+                self.connection.execute("ALTER TABLE messages ADD COLUMN meta TEXT")
+
+    def load_all(self):
+        """Yields (session_id, snapshot, message records) for every stored session."""
+        with self.lock:
+            sessions = self.connection.execute("SELECT session_id, session_name FROM sessions").fetchall()
+        for session_id, session_name in sessions:
+            yield session_id, self.read_snapshot(session_id, session_name), self.read_messages(session_id)
+
+    def load_index(self):
+        """Returns the metadata of every session from the sessions table, most recently active first (read through
+        the last-activity index, so building the recency order does not need to reorder them)."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT session_id, session_name, last_activity, message_count, byte_size FROM sessions "
+                "ORDER BY last_activity DESC").fetchall()
+        return {
+            session_id: {"session_name": session_name, "last_activity": last_activity,
+                         "message_count": message_count, "byte_size": byte_size}
+            for session_id, session_name, last_activity, message_count, byte_size in rows
+        }
+
+    @tracer.traced(category="storage")
+    def load_session(self, session_id):
+        """Returns (snapshot, message records) for one session, or None if it does not exist."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT session_name FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        return self.read_snapshot(session_id, row[0]), self.read_messages(session_id)
+
+    def update_index(self, session_id, metadata):
+        """The sessions table is updated together with every write, so there is nothing to do."""
+
+    def read_snapshot(self, session_id, session_name):
+        """Returns the session metadata and attachments in snapshot form."""
+        with self.lock:
+            attachments = self.connection.execute(
+                "SELECT file_name, content, sha256, size, mime FROM attachments WHERE session_id = ?", (session_id,)).fetchall()
+        return {
+            "session_name": session_name,
+            "chat_log": [],
+            "conversation_history": [],
+            "attached_files": {
+                # Rows written before the blob store hold the file content inline
+                file_name: {"sha256": sha256, "name": file_name, "size": size, "mime": mime} if sha256
+                else base64.b64encode(content).decode("ascii")
+                for file_name, content, sha256, size, mime in attachments
+            }
+        }
+
+    def read_messages(self, session_id):
+        """Returns the session messages as journal records, in order."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT sender, content, timestamp, provider, meta FROM messages WHERE session_id = ? ORDER BY seq",
+                (session_id,)).fetchall()
+        return [{"type": "message", "sender": sender, "message": content, "timestamp": timestamp, "provider": provider,
+                 "meta": json.loads(meta) if meta else None}
+                for sender, content, timestamp, provider, meta in rows]
+
+    def has_snapshot(self, session_id):
+        with self.lock:
+            return self.connection.execute(
+                "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is not None
+
+    @tracer.traced(category="storage")
+    def append(self, session_id, records):
+        """Writes each record in its own transaction."""
+        for record in records:
+            with self.lock, self.connection:
+                self.write_record(session_id, record)
+
+    def write_record(self, session_id, record):
+        if record["type"] == "message":
+            self.connection.execute(
+                "INSERT INTO messages (session_id, seq, sender, content, timestamp, provider, meta) "
+                "SELECT ?, message_count, ?, ?, ?, ?, ? FROM sessions WHERE session_id = ?",
+                (session_id, record["sender"], record["message"], record["timestamp"], record.get("provider"),
+                 json.dumps(record["meta"]) if record.get("meta") else None, session_id))
+            self.connection.execute(
+                "UPDATE sessions SET message_count = message_count + 1, byte_size = byte_size + ?, last_activity = ? "
+                "WHERE session_id = ?", (len(record["message"].encode("utf-8")), time.time(), session_id))
+        elif record["type"] == "attachment":
+            ref = record["ref"]
+            self.connection.execute(
+                "INSERT OR REPLACE INTO attachments (session_id, file_name, sha256, size, mime) VALUES (?, ?, ?, ?, ?)",
+                (session_id, record["file_name"], ref["sha256"], ref["size"], ref["mime"]))
+            self.connection.execute(
+                "UPDATE sessions SET last_activity = ? WHERE session_id = ?", (time.time(), session_id))
+        elif record["type"] == "rename":
+            self.connection.execute(
+                "UPDATE sessions SET session_name = ? WHERE session_id = ?", (record["session_name"], session_id))
+
+    def needs_compaction(self, session_id):
+        return False
+
+    def message_meta(self):
+        """Returns the metadata of every stored message that has any."""
+        with self.lock:
+            rows = self.connection.execute("SELECT meta FROM messages WHERE meta IS NOT NULL").fetchall()
+        return [json.loads(meta) for meta, in rows]
+
+    @tracer.traced(category="storage")
+    def write_snapshot(self, session_id, snapshot, last_activity=None):
+        """Replaces everything stored for a session with the given snapshot."""
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO sessions (session_id, session_name, created_at, last_activity) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET session_name = excluded.session_name, "
+                "last_activity = excluded.last_activity, message_count = 0, byte_size = 0",
+                (session_id, snapshot["session_name"], now, last_activity or now))
+            self.connection.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self.connection.execute("DELETE FROM attachments WHERE session_id = ?", (session_id,))
+            message_meta = snapshot.get("message_meta", {})
+            for index, (sender, message, timestamp) in enumerate(snapshot["chat_log"]):
+                self.write_record(session_id, {"type": "message", "sender": sender, "message": message,
+                                               "timestamp": timestamp, "meta": message_meta.get(str(index))})
+            for file_name, ref in snapshot["attached_files"].items():
+                self.write_record(session_id, {"type": "attachment", "file_name": file_name, "ref": ref})
+            if last_activity:
+                self.connection.execute(
+                    "UPDATE sessions SET last_activity = ? WHERE session_id = ?", (last_activity, session_id))
+
+    def delete(self, session_id):
+        """Removes a session with its messages and attachments."""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def last_activity(self, session_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT last_activity FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else 0
+
+def create_session_store(config):
+    """Returns the session store selected by the `session_store` setting (json or sqlite)."""
+    if config.get("session_store", "json") == "sqlite":
+        store = SQLiteSessionStore()
+        if store.created:
+            # One-shot import of the sessions kept as chat_logs/*.json before the switch
+            ChatSessionManager(JournalSessionStore()).export_sessions(store)
+        return store
+    return JournalSessionStore()
+
+class SearchIndex:
+    """Full-text index (SQLite FTS5) over message text, session names and attachment names.
+
+    Documents are added as messages arrive, so searching never reads the session files.
+    """
+    def __init__(self, db_path=os.path.join("chat_logs", "search.db"), rank_window=10000):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.rank_window = rank_window
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    message_index INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS idx_documents_session ON documents(session_id, kind);
+                CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(content, tokenize='unicode61', prefix='2 3');
+                CREATE TABLE IF NOT EXISTS indexed_sessions (
+                    session_id TEXT PRIMARY KEY,
+                    session_name TEXT NOT NULL,
+                    message_count INTEGER NOT NULL DEFAULT 0
+                );
+            """)
+
+    def add_document(self, session_id, kind, content, message_index=None):
+        cursor = self.connection.execute(
+            "INSERT INTO documents (session_id, kind, message_index) VALUES (?, ?, ?)", (session_id, kind, message_index))
+        self.connection.execute("INSERT INTO documents_fts (rowid, content) VALUES (?, ?)", (cursor.lastrowid, content))
+
+    def delete_documents(self, session_id, kind=None):
+        condition, params = ("session_id = ?", (session_id,)) if kind is None else \
+            ("session_id = ? AND kind = ?", (session_id, kind))
+        self.connection.execute(f"DELETE FROM documents_fts WHERE rowid IN (SELECT id FROM documents WHERE {condition})", params)
+        self.connection.execute(f"DELETE FROM documents WHERE {condition}", params)
+
+    def add_messages(self, session_id, first_index, messages):
+        """Indexes messages (sender, text, timestamp) numbered from first_index."""
+        with self.lock, self.connection:
+            for message_index, (sender, message, timestamp) in enumerate(messages, first_index):
+                self.add_document(session_id, "message", message, message_index)
+            self.connection.execute(
+                "UPDATE indexed_sessions SET message_count = ? WHERE session_id = ?", (first_index + len(messages), session_id))
+
+    def add_attachment(self, session_id, file_name):
+        with self.lock, self.connection:
+            self.add_document(session_id, "attachment", file_name)
+
+    def set_session_name(self, session_id, session_name):
+        """Adds a session to the index, or updates its indexed name."""
+        with self.lock, self.connection:
+            self.delete_documents(session_id, "name")
+            self.add_document(session_id, "name", session_name)
+            self.connection.execute(
+                "INSERT INTO indexed_sessions (session_id, session_name) VALUES (?, ?) "
+                "ON CONFLICT(session_id) DO UPDATE SET session_name = excluded.session_name", (session_id, session_name))
+
+    def delete_session(self, session_id):
+        with self.lock, self.connection:
+            self.delete_documents(session_id)
+            self.connection.execute("DELETE FROM indexed_sessions WHERE session_id = ?", (session_id,))
+
+    def indexed_sessions(self):
+        """Returns {session_id: (session_name, message_count)} for every indexed session."""
+        with self.lock:
+            rows = self.connection.execute("SELECT session_id, session_name, message_count FROM indexed_sessions").fetchall()
+        return {session_id: (session_name, message_count) for session_id, session_name, message_count in rows}
+
+    def match_expression(self, query):
+        """Turns a search box query into an FTS5 expression.
+
+        Words must all match, "quoted text" matches as a phrase and a trailing * matches a prefix.
+        """
+        terms = []
+        for phrase, word in re.findall(r'"([^"]*)"|(\S+)', query):
+            text = phrase or word.rstrip("*")
+            if not text.strip():
+                continue
+            term = '"' + text.replace('"', '""') + '"'
+            terms.append(term + "*" if word.endswith("*") and not phrase else term)
+        return " ".join(terms)
+
+    def search(self, query, limit=50):
+        """Returns the best matches as (session_id, kind, message_index, snippet) tuples, best first, and whether
+        older matches were left out of the ranking.
+
+        Every match is ranked unless there are more than rank_window of them (a falsy rank_window ranks them all);
+        then only the newest rank_window are, which keeps broad queries (short prefixes, common words) fast on
+        large histories.
+        """
+        expression = self.match_expression(query)
+        if not expression:
+            return [], False
+        with self.lock:
+            oldest, truncated = 0, False
+            if self.rank_window:
+                # Rowids grow with insertion, so walking them backwards finds the oldest document in the window and
+                # whether any match is older still
+                rows = self.connection.execute(
+                    "SELECT rowid FROM documents_fts WHERE documents_fts MATCH ? ORDER BY rowid DESC LIMIT 2 OFFSET ?",
+                    (expression, self.rank_window - 1)).fetchall()
+                if len(rows) == 2:
+                    oldest, truncated = rows[0][0], True
+            matches = self.connection.execute(
+                "SELECT documents.session_id, documents.kind, documents.message_index, "
+                "snippet(documents_fts, 0, '[', ']', '...', 12) FROM documents_fts "
+                "JOIN documents ON documents.id = documents_fts.rowid "
+                "WHERE documents_fts MATCH ? AND documents_fts.rowid >= ? ORDER BY rank LIMIT ?",
+                (expression, oldest, limit)).fetchall()
+        return matches, truncated
+
+def create_search_index(config):
+    """Returns the search index, ranking at most `search: {rank_window}` matches per query (0 ranks them all)."""
+    return SearchIndex(rank_window=config.get("search", {}).get("rank_window", 10000))
+
+class ResponseCache:
+    """On-disk cache of complete responses for identical requests, with an in-memory LRU in front.
+
+    Entries expire after `ttl` seconds, and the least recently used ones are evicted once the cached responses
+    exceed `max_bytes`.
+    """
+    def __init__(self, db_path=os.path.join("chat_logs", "response_cache.db"), ttl=7 * 24 * 3600,
+                 max_bytes=100 * 1024 * 1024, memory_entries=256, force=False):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.force = force  # cache responses even when the temperature is above zero
+        self.memory = OrderedDict()  # {key: (response, created_at)}, least recently used first
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses(last_used);
+                CREATE INDEX IF NOT EXISTS idx_responses_created_at ON responses(created_at);
+            """)
+
+    def key(self, provider, model, temperature, system_prompt, converted_history):
+        """Returns the cache key of a request."""
+        request = [provider, model, temperature, system_prompt, converted_history]
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def applies(self, temperature, mode="default"):
+        """Tells whether a request may use the cache: mode is "default", "bypass" or "force"."""
+        if mode == "bypass":
+            return False
+        return mode == "force" or self.force or not temperature
+
+    def get(self, key):
+        """Returns the cached response for a key, or None."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry and entry[1] + self.ttl > now:
+                self.memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                self.connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                self.connection.commit()
+                return entry[0]
+            self.memory.pop(key, None)
+            row = self.connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ? AND created_at > ?", (key, now - self.ttl)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            with self.connection:
+                self.connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.stats["disk_hits"] += 1
+            self.remember(key, row[0], row[1])
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now))
+            self.stats["stores"] += 1
+            self.remember(key, response, now)
+            self.evict(now)
+
+    def remember(self, key, response, created_at):
+        self.memory[key] = (response, created_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def evict(self, now):
+        """Deletes expired entries, then the least recently used ones until the cache fits in max_bytes."""
+        keys = [key for (key,) in self.connection.execute("SELECT key FROM responses WHERE created_at <= ?", (now - self.ttl,))]
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses WHERE created_at > ?",
+                                        (now - self.ttl,)).fetchone()[0]
+        if total > self.max_bytes:
+            for key, size in self.connection.execute(
+                    "SELECT key, size FROM responses WHERE created_at > ? ORDER BY last_used", (now - self.ttl,)):
+                keys.append(key)
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        self.connection.executemany("DELETE FROM responses WHERE key = ?", [(key,) for key in keys])
+        for key in keys:
+            self.memory.pop(key, None)
+        self.stats["evictions"] += len(keys)
+
+    def clear(self):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM responses")
+            self.memory.clear()
+
+    def statistics(self):
+        """Returns the hit/miss counters with the number and total size of cached responses."""
+        with self.lock:
+            count, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            stats = dict(self.stats, entries=count, bytes=size)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+def create_response_cache(config):
+    """Returns the response cache configured under `response_cache`, or None unless it is enabled."""
+    settings = config.get("response_cache") or {}
+    if not settings.get("enabled"):
+        return None
+    return ResponseCache(ttl=settings.get("ttl", 7 * 24 * 3600), max_bytes=settings.get("max_bytes", 100 * 1024 * 1024),
+                         memory_entries=settings.get("memory_entries", 256), force=settings.get("force", False))
+
+class RecencyIndex:
+    """Session ids ordered by last activity (most recent first), kept sorted as activity changes."""
+    def __init__(self, last_activity=None):
+        self.last_activity = dict(last_activity or {})  # {session_id: last activity time}
+        self.keys = sorted((-activity, session_id) for session_id, activity in self.last_activity.items())
+
+    def __len__(self):
+        return len(self.keys)
+
+    def session_at(self, row):
+        return self.keys[row][1]
+
+    def row(self, session_id):
+        """Returns the row of a session, or None if it is not indexed."""
+        if session_id not in self.last_activity:
+            return None
+        return bisect.bisect_left(self.keys, (-self.last_activity[session_id], session_id))
+
+    def insertion_row(self, session_id, last_activity):
+        """Returns the row a session would have with the given activity, once removed from its current row."""
+        row = bisect.bisect_left(self.keys, (-last_activity, session_id))
+        old_row = self.row(session_id)
+        return row - 1 if old_row is not None and old_row < row else row
+
+    def update(self, session_id, last_activity):
+        old_row = self.row(session_id)
+        if old_row is not None:
+            del self.keys[old_row]
+        self.last_activity[session_id] = last_activity
+        bisect.insort(self.keys, (-last_activity, session_id))
+
+    def remove(self, session_id):
+        del self.keys[self.row(session_id)]
+        del self.last_activity[session_id]
+
+    def page(self, limit=None, offset=0):
+        end = None if limit is None else offset + limit
+        return [session_id for _, session_id in self.keys[offset:end]]
+
+class ConversationSnapshot:
+    """Immutable view of messages start to stop of a MessageLog, with their token prefix sums."""
+    __slots__ = ("messages", "prefix_sums", "start", "stop")
+
+    def __init__(self, messages, prefix_sums, start, stop):
+        self.messages = messages
+        self.prefix_sums = prefix_sums
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __iter__(self):
+        for index in range(self.start, self.stop):
+            yield self.messages[index]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.messages[self.start + i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("snapshot index out of range")
+        return self.messages[self.start + index]
+
+    def suffix(self, start):
+        """Returns the snapshot of messages start onwards, in O(1)."""
+        return ConversationSnapshot(self.messages, self.prefix_sums, self.start + start, self.stop)
+
+    def tokens(self, start=0, stop=None):
+        """Returns the estimated tokens of messages start to stop (exclusive) of the snapshot."""
+        stop = len(self) if stop is None else stop
+        return self.prefix_sums[self.start + stop] - self.prefix_sums[self.start + start]
+
+class MessageLog:
+    """A session's conversation history: an append-only message list with token prefix sums.
+
+    Only the UI thread changes it. Appended messages are never modified, so a snapshot is the shared lists plus a
+    length (O(1)) and stays valid while the log grows; anything other than an append builds new lists
+    (copy-on-write), leaving existing snapshots untouched.
+    """
+    def __init__(self, messages=()):
+        """Adopts a list of messages (a freshly loaded history) rather than copying it; the caller must not change
+        it afterwards. Messages without a cached token count are the only ones rebuilt."""
+        self.messages = messages if isinstance(messages, list) else list(messages)
+        self.prefix_sums = [0] * (len(self.messages) + 1)
+        for index, message in enumerate(self.messages):
+            if "tokens" not in message:
+                message = self.messages[index] = self.with_tokens(message)
+            self.prefix_sums[index + 1] = self.prefix_sums[index] + message["tokens"]
+
+    @staticmethod
+    def with_tokens(message):
+        return dict(message, tokens=ContextWindow.count_tokens(message["content"]) + ContextWindow.message_overhead)
+
+    def append(self, message):
+        """Appends a message, estimating its tokens once (cached on the message as "tokens")."""
+        if "tokens" not in message:
+            message = self.with_tokens(message)
+        self.messages.append(message)
+        self.prefix_sums.append(self.prefix_sums[-1] + message["tokens"])
+
+    def snapshot(self):
+        return ConversationSnapshot(self.messages, self.prefix_sums, 0, len(self.messages))
+
+    def to_list(self):
+        return list(self.messages)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def __getitem__(self, index):
+        return self.messages[index]
+
+class ContextWindow:
+    """Picks the most recent messages of a conversation that fit a token budget.
+
+    Token counts are estimated once per message by MessageLog, which keeps their prefix sums, so the longest
+    suffix within a budget is found by binary search.
+    """
+    message_overhead = 4  # role and separator tokens per message
+
+    @staticmethod
+    def count_tokens(text):
+        """Estimates the tokens in a text (about four bytes per token)."""
+        return (len(text.encode("utf-8")) + 3) // 4
+
+    @staticmethod
+    def fit(history, budget, previous_start=None, slack=0.0):
+        """Returns the index of the first message of the longest suffix of a ConversationSnapshot that fits in
+        budget tokens, or 0 (the whole history) when the budget is None.
+
+        The previous start is kept while the suffix from it still fits, so the request prefix stays the same from
+        turn to turn (and provider prompt caches stay valid). When it no longer fits, the history is trimmed to the
+        budget, less a `slack` fraction of it: freeing that much more lets the new start hold for the following
+        turns, at the cost of sending less history.
+        """
+        count = len(history)
+        if count == 0 or budget is None:
+            return 0
+        prefix_sums, offset = history.prefix_sums, history.start
+        total = history.tokens()
+        start = bisect.bisect_left(prefix_sums, prefix_sums[offset] + total - budget, offset, offset + count) - offset
+        if previous_start is not None and start <= previous_start < count:
+            start = previous_start
+        elif start > 0 and slack:
+            trimmed_budget = int(budget * (1 - slack))
+            start = bisect.bisect_left(prefix_sums, prefix_sums[offset] + total - trimmed_budget, offset, offset + count) - offset
+        # The latest message is always sent, even if it alone exceeds the budget
+        start = min(start, count - 1)
+        # Providers expect the conversation to open with a user turn
+        while start < count - 1 and history[start]["role"] != "user":
+            start += 1
+        return start
+
+class ChatSessionManager:
+    """Manages chat sessions.
+
+    Only the metadata index is read at startup; message bodies and attachments are loaded on demand by load_session.
+    """
+    metadata_fields = ["session_name", "last_activity", "message_count", "byte_size"]
+
+    def __init__(self, store=None, blob_store=None, search_index=None):
+        # {session_id: {"session_name": "", "last_activity": 0.0, "message_count": 0, "byte_size": 0}}, plus
+        # "chat_log", "conversation_history" and "attached_files" once the session body is loaded
+        self.sessions = {}
+        self.store = store or JournalSessionStore()
+        self.blob_store = blob_store or BlobStore()
+        self.search_index = search_index  # optional SearchIndex kept up to date with the sessions
+        self.pending_records = {}  # {session_id: [journal records not yet written]}
+        self.recency = RecencyIndex()
+        # {session_id: {"window_start": first history message sent last time, "gemini": cached content state,
+        #               "input_tokens"/"cached_tokens": totals reported by the provider}}
+        self.prompt_caches = {}
+        # Each listener is a (before, after) pair of callables taking (change, old_row, new_row), where change is
+        # "insert", "move", "remove", "update" or "reset"; they are called around every change of self.recency
+        self.listeners = []
+        self.load_sessions()
+
+    def add_listener(self, before, after):
+        """Registers callbacks notified before and after the session order changes."""
+        self.listeners.append((before, after))
+
+    def change_recency(self, change, session_id, last_activity=None):
+        """Applies a change to the recency index, notifying listeners with the affected rows."""
+        old_row = self.recency.row(session_id) if change != "reset" else None
+        new_row = self.recency.insertion_row(session_id, last_activity) if change in ["insert", "move"] else old_row
+        if change == "move" and old_row == new_row:
+            change = "update"
+        for before, _ in self.listeners:
+            before(change, old_row, new_row)
+        if change in ["insert", "move", "update"] and last_activity is not None:
+            self.recency.update(session_id, last_activity)
+        elif change == "remove":
+            self.recency.remove(session_id)
+        elif change == "reset":
+            self.recency = RecencyIndex({session_id: session["last_activity"] for session_id, session in self.sessions.items()})
+        for _, after in self.listeners:
+            after(change, old_row, new_row)
+
+    def touch_session(self, session_id):
+        """Records activity on a session, moving it to the top of the recency order."""
+        self.sessions[session_id]["last_activity"] = time.time()
+        self.change_recency("move", session_id, self.sessions[session_id]["last_activity"])
+
+    @tracer.traced(category="storage")
+    def load_sessions(self):
+        """Loads the session metadata index."""
+        self.sessions = self.store.load_index()
+        self.pending_records = {}
+        self.change_recency("reset", None)
+        if self.search_index:
+            self.sync_search_index()
+
+    def sync_search_index(self):
+        """Indexes the sessions and messages the search index is missing, e.g. after an import or an interrupted save."""
+        indexed = self.search_index.indexed_sessions()
+        for session_id in indexed.keys() - self.sessions.keys():
+            self.search_index.delete_session(session_id)
+        for session_id, session in self.sessions.items():
+            session_name, message_count = indexed.get(session_id, (None, 0))
+            if session_name != session["session_name"]:
+                self.search_index.set_session_name(session_id, session["session_name"])
+            if message_count == session["message_count"]:
+                continue
+            was_loaded = "chat_log" in session
+            self.load_session(session_id)
+            if message_count > len(session["chat_log"]):
+                self.search_index.delete_session(session_id)
+                self.search_index.set_session_name(session_id, session["session_name"])
+                message_count = 0
+            self.search_index.add_messages(session_id, message_count, session["chat_log"][message_count:])
+            if message_count == 0:
+                for file_name in session["attached_files"]:
+                    self.search_index.add_attachment(session_id, file_name)
+            if not was_loaded:
+                self.unload_session(session_id)
+
+    def search(self, query, limit=50):
+        """Returns (session_id, kind, message_index, snippet) matches for a query, best first, and whether only
+        the newest matches were ranked."""
+        if not self.search_index:
+            return [], False
+        matches, truncated = self.search_index.search(query, limit)
+        return [match for match in matches if match[0] in self.sessions], truncated
+
+    @tracer.traced(category="storage")
+    def load_session(self, session_id):
+        """Returns a session with its messages and attachments, loading them from the store on first access."""
+        session = self.sessions.get(session_id)
+        if session is None or "chat_log" in session:
+            return session
+        loaded = self.store.load_session(session_id)
+        snapshot, records = loaded if loaded else ({}, [])
+        # Validate session data
+        if not self.validate_session_data(snapshot):
+            logging.error(f"Invalid session data for session: {session_id}")
+            snapshot, records = {"chat_log": [], "conversation_history": [], "attached_files": {}}, []
+        session["chat_log"] = snapshot["chat_log"]
+        history = snapshot["conversation_history"]
+        if history and "content" not in history[0]:
+            # The Tk frontend saves the history in its provider's format; rebuild it from the transcript
+            history = [{"role": "user" if sender == "You" else "assistant", "content": message}
+                       for sender, message, _ in snapshot["chat_log"] if sender in ["You", "AI"]]
+        session["conversation_history"] = MessageLog(history)
+        session["message_meta"] = {int(index): meta for index, meta in snapshot.get("message_meta", {}).items()}
+        session["attached_files"] = {}
+        for key, value in snapshot["attached_files"].items():
+            # The Tk frontend keys attachments by number, with the file name in the value
+            file_name = value.get("file_name", key) if isinstance(value, dict) else key
+            ref = self.attachment_ref(file_name, value)
+            if ref:
+                session["attached_files"][file_name] = ref
+        for record in records:
+            self.apply_record(session_id, record)
+        return session
+
+    def unload_session(self, session_id):
+        """Drops a saved session body from memory, keeping its metadata."""
+        self.save_session(session_id)
+        for field in ["chat_log", "conversation_history", "message_meta", "attached_files"]:
+            self.sessions.get(session_id, {}).pop(field, None)
+        self.forget_request_state(session_id)
+
+    def validate_session_data(self, session_data):
+        """Validates session data to ensure required fields exist."""
+        required_fields = ["chat_log", "conversation_history", "attached_files"]  # the index holds the name
+        return all(field in session_data for field in required_fields)
+
+    def apply_record(self, session_id, record):
+        """Applies a single journal record to the in-memory session."""
+        if record["type"] == "message":
+            self.add_message(session_id, record["sender"], record["message"], record["timestamp"], record.get("provider"),
+                             journal=False, meta=record.get("meta"))
+        elif record["type"] == "attachment":
+            # Records hold a blob reference, legacy inline content or, from the Tk frontend, the file's path
+            ref = self.attachment_ref(record["file_name"], record.get("ref") or record.get("content") or record)
+            if ref:
+                self.sessions[session_id]["attached_files"][record["file_name"]] = ref
+        elif record["type"] == "rename":
+            pass  # the metadata index already holds the latest name
+
+    def attachment_ref(self, file_name, value):
+        """Returns an attachment reference, moving legacy inline (base64) content and files the Tk frontend
+        attached by path ({"file_path": ...}) into the blob store; None if the file is gone."""
+        if isinstance(value, dict) and "sha256" in value:
+            return value
+        if isinstance(value, dict):
+            try:
+                with open(value["file_path"], "rb") as source:
+                    return self.blob_store.put_stream(source, file_name)
+            except (KeyError, OSError) as e:
+                logging.error(f"Skipping attachment {file_name}: {e}")
+                return None
+        return self.blob_store.put_bytes(base64.b64decode(value), file_name)
+
+    def queue_record(self, session_id, record):
+        """Queues a journal record to be written by the next save_session."""
+        self.pending_records.setdefault(session_id, []).append(record)
+
+    @tracer.traced(category="history")
+    def convert_conversation_history(self, conversation_history, provider, system_prompt, session_id=None):
+        """Converts conversation history to the format required by the selected provider; given a session id,
+        only the messages added since the session's last request are converted."""
+        return get_adapter(provider).format(conversation_history, system_prompt, session_id)
+
+    def context_budget(self, provider, provider_config, system_prompt):
+        """Returns the tokens available for conversation history: the model's context window minus the response
+        reserve (max_tokens, at most a quarter of the window) and the system prompt; None if the window is unknown."""
+        context_window = provider_config.get("context_window")
+        if not context_window:
+            model = provider_config.get("ollama_model") or provider_config.get("model", "")
+            prefixes = [prefix for prefix in MODEL_CONTEXT_WINDOWS if model.startswith(prefix)]
+            if not prefixes:
+                return None
+            context_window = MODEL_CONTEXT_WINDOWS[max(prefixes, key=len)]
+        adapter = PROVIDER_ADAPTERS.get(provider, ProviderAdapter)
+        response_tokens = min(provider_config.get("max_tokens", adapter.default_max_tokens), context_window // 4)
+        system_tokens = ContextWindow.count_tokens(system_prompt) + ContextWindow.message_overhead
+        return max(context_window - response_tokens - system_tokens, 0)
+
+    @tracer.traced(category="history")
+    def get_context_history(self, session_id, provider, provider_config, system_prompt, keep_window=True):
+        """Returns a snapshot of the most recent messages that fit the provider's context budget, and how many
+        were left out. Called on the UI thread when a request starts; the snapshot is safe to hand to a worker.
+
+        With keep_window, the window start is remembered so the next request keeps the same prefix (for prompt
+        caching); fallback providers fit their own window without moving it. A provider's `context_trim_slack`
+        setting (a fraction of the budget, 0 by default) trims that much further whenever the window moves, so it
+        moves less often.
+        """
+        history = self.get_conversation_history(session_id).snapshot()
+        prompt_cache = self.prompt_cache(session_id)
+        start = ContextWindow.fit(history, self.context_budget(provider, provider_config, system_prompt),
+                                  prompt_cache["window_start"] if keep_window else None,
+                                  provider_config.get("context_trim_slack", 0.0))
+        if keep_window:
+            prompt_cache["window_start"] = start
+        return history.suffix(start), start
+
+    def prompt_cache(self, session_id):
+        """Returns the provider prompt-cache state of a session."""
+        return self.prompt_caches.setdefault(session_id, {
+            "window_start": None, "gemini": None, "input_tokens": 0, "cached_tokens": 0})
+
+    def forget_request_state(self, session_id):
+        """Drops the prompt-cache state and converted messages kept for a session's requests."""
+        self.prompt_caches.pop(session_id, None)
+        for adapter in PROVIDER_ADAPTERS.values():
+            adapter.forget(session_id)
+
+    def record_cache_usage(self, session_id, input_tokens, cached_tokens):
+        """Adds a response's input and cache-hit token counts to the session totals."""
+        prompt_cache = self.prompt_cache(session_id)
+        prompt_cache["input_tokens"] += input_tokens
+        prompt_cache["cached_tokens"] += cached_tokens
+
+    def new_session(self):
+        """Creates a new chat session."""
+        timestamp = datetime.now()
+        session_id = timestamp.strftime("Session_%Y%m%d_%H%M%S")
+        session_name = timestamp.strftime("Session %Y-%m-%d %H:%M:%S")
+        self.sessions[session_id] = {
+            "session_name": session_name,
+            "last_activity": time.time(),
+            "message_count": 0,
+            "byte_size": 0,
+            "chat_log": [],
+            "conversation_history": MessageLog(),
+            "message_meta": {},
+            "attached_files": {}
+        }
+        # Ids have one-second resolution, so a session created within the same second replaces the previous one
+        change = "move" if self.recency.row(session_id) is not None else "insert"
+        self.change_recency(change, session_id, self.sessions[session_id]["last_activity"])
+        if self.search_index:
+            if change == "move":
+                self.search_index.delete_session(session_id)
+            self.search_index.set_session_name(session_id, session_name)
+        return session_id, session_name
+
+    def delete_session(self, session_id):
+        """Deletes a chat session."""
+        if session_id in self.sessions:
+            try:
+                self.store.delete(session_id)
+                self.pending_records.pop(session_id, None)
+                self.change_recency("remove", session_id)
+                del self.sessions[session_id]
+                self.forget_request_state(session_id)
+                if self.search_index:
+                    self.search_index.delete_session(session_id)
+            except Exception as e:
+                logging.error(f"Error deleting session {session_id} and it's log file: {e}")
+
+    def rename_session(self, session_id, session_name):
+        """Renames a chat session."""
+        if session_id in self.sessions:
+            self.sessions[session_id]["session_name"] = session_name
+            self.change_recency("update", session_id)
+            if self.search_index:
+                self.search_index.set_session_name(session_id, session_name)
+            self.queue_record(session_id, {"type": "rename", "session_name": session_name})
+
+    def add_message(self, session_id, sender, message, timestamp, api_provider, journal=True, meta=None):
+        """Adds a message to a chat session, with optional metadata such as {"truncated": True}."""
+        session = self.load_session(session_id)
+        if session is not None:
+            session["chat_log"].append((sender, message, timestamp))
+            if meta:
+                session["message_meta"][len(session["chat_log"]) - 1] = meta
+            if sender == "You":
+                session["conversation_history"].append({"role": "user", "content": message})
+            elif sender == "AI":
+                session["conversation_history"].append({"role": "assistant", "content": message})
+            if journal:
+                self.touch_session(session_id)
+                session["message_count"] += 1
+                session["byte_size"] += len(message.encode("utf-8"))
+                record = {"type": "message", "sender": sender, "message": message, "timestamp": timestamp,
+                          "provider": api_provider}
+                if meta:
+                    record["meta"] = meta
+                self.queue_record(session_id, record)
+                if self.search_index:
+                    self.search_index.add_messages(session_id, len(session["chat_log"]) - 1, [session["chat_log"][-1]])
+
+    def get_session_messages(self, session_id):
+        """Returns the messages for a specific session."""
+        session = self.load_session(session_id)
+        return session["chat_log"] if session else []
+
+    def get_message_meta(self, session_id):
+        """Returns the metadata of a session's messages, {chat_log index: meta}, for the messages that have any."""
+        session = self.load_session(session_id)
+        return session["message_meta"] if session else {}
+
+    def request_metrics(self, session_id=None):
+        """Returns the metadata of the responses that have request metrics, for one session or, from the store,
+        every saved session. Reading every session is a scan of the store, which MetricsLoader runs off the UI
+        thread."""
+        metas = self.get_message_meta(session_id).values() if session_id is not None else self.store.message_meta()
+        return [meta for meta in metas if meta.get("metrics")]
+
+    def get_conversation_history(self, session_id):
+        """Returns the provider-neutral conversation history (a MessageLog) of a session."""
+        session = self.load_session(session_id)
+        return session["conversation_history"] if session else MessageLog()
+
+    def attach_file(self, session_id, file_path):
+        """Attaches a file to a chat session."""
+        if self.load_session(session_id) is not None:
+            file_name = os.path.basename(file_path)
+            try:
+               ref = self.blob_store.put_file(file_path)
+               self.sessions[session_id]["attached_files"][file_name] = ref
+               self.touch_session(session_id)
+               self.queue_record(session_id, {"type": "attachment", "file_name": file_name, "ref": ref})
+               if self.search_index:
+                   self.search_index.add_attachment(session_id, file_name)
+               return file_name
+            except Exception as e:
+              logging.error(f"Failed to attach file {file_path}: {e}")
+              raise
+
+    def get_attached_files(self, session_id):
+        """Returns the attachment references ({file_name: {"sha256", "name", "size", "mime"}}) of a session."""
+        session = self.load_session(session_id)
+        return session["attached_files"] if session else {}
+
+    def get_attachment_path(self, session_id, file_name):
+        """Returns the path of an attached file's content in the blob store."""
+        return self.blob_store.blob_path(self.get_attached_files(session_id)[file_name]["sha256"])
+
+    @tracer.traced(category="storage")
+    def save_session(self, session_id):
+        """Appends the session's pending changes to its journal, compacting it into a new snapshot when it grows long."""
+        if session_id in self.sessions:
+            try:
+                records = self.pending_records.pop(session_id, [])
+                if not self.store.has_snapshot(session_id) or self.store.needs_compaction(session_id):
+                    self.load_session(session_id)
+                    self.compact_session(session_id)
+                elif records:
+                    self.store.append(session_id, records)
+                else:
+                    return
+                self.store.update_index(session_id, self.session_metadata(session_id))
+            except Exception as e:
+                 logging.error(f"Error saving session {session_id}: {e}")
+
+    def session_metadata(self, session_id):
+        """Returns the index entry of a session."""
+        return {field: self.sessions[session_id][field] for field in self.metadata_fields}
+
+    def session_last_activity(self, session_id):
+        """Returns the last-activity time of a session."""
+        return self.sessions[session_id]["last_activity"]
+
+    def list_sessions(self, limit=None, offset=0):
+        """Returns a page of (session_id, session_name) pairs, most recently active first."""
+        return [(session_id, self.sessions[session_id]["session_name"]) for session_id in self.recency.page(limit, offset)]
+
+    def export_sessions(self, target_store):
+        """Copies every session into another store, keeping its last-activity time."""
+        for session_id, session in self.sessions.items():
+            was_loaded = "chat_log" in session
+            self.load_session(session_id)
+            self.save_session(session_id)
+            target_store.write_snapshot(session_id, self.session_snapshot(session_id),
+                                        last_activity=session["last_activity"])
+            if not was_loaded:
+                self.unload_session(session_id)
+        return len(self.sessions)
+
+    def compact_session(self, session_id):
+        """Writes a full snapshot of the session, replacing its journal."""
+        self.store.write_snapshot(session_id, self.session_snapshot(session_id))
+
+    def session_snapshot(self, session_id):
+        """Returns the serialisable form of a session."""
+        session = self.sessions[session_id]
+        return {
+            "session_name": session["session_name"],
+            "chat_log": session["chat_log"],
+            "conversation_history": session["conversation_history"].to_list(),
+            "message_meta": {str(index): meta for index, meta in session["message_meta"].items()},
+            "attached_files": session["attached_files"]
+        }
+
+class MessageManager:
+    """Manages message formatting."""
+    def message_html(self, sender, message, timestamp, meta=None):
+        """Returns the HTML for one message, followed by notes from its metadata."""
+        html = f"<b>{timestamp} {sender}:</b> {self.format_message(message)}"
+        if meta and meta.get("fallback_from"):
+            html += f" <i>[answered by {meta['provider']}]</i>"
+        if meta and meta.get("truncated"):
+            html += " <i>[stopped]</i>"
+        return html
+
+    def format_message(self, message):
+        """Formats the message with bold, italic, underline, and code block."""
+        formatted_text = message.replace("*", "<b>").replace("*", "</b>")
+        formatted_text = formatted_text.replace("_", "<i>").replace("_", "</i>")
+        formatted_text = formatted_text.replace("~", "<u>").replace("~", "</u>")
+        formatted_text = formatted_text.replace("``````", "</pre>")
+        return formatted_text
+
+class TranscriptModel(QAbstractListModel):
+    """List model over a window of the newest messages of a session.
+
+    Older messages are prepended a page at a time by fetch_older, and a response that is still streaming is
+    shown as an extra last row.
+    """
+    SenderRole = Qt.UserRole + 1
+    TimestampRole = Qt.UserRole + 2
+    MessageIndexRole = Qt.UserRole + 3
+    ExpandedRole = Qt.UserRole + 4
+    MetaRole = Qt.UserRole + 5
+
+    def __init__(self, page_size=200, parent=None):
+        super().__init__(parent)
+        self.page_size = page_size
+        self.messages = []  # the session chat_log; only messages[first:first + count] are exposed
+        self.meta = {}  # the session message_meta
+        self.first = 0
+        self.count = 0
+        self.streaming = None  # (sender, text, timestamp) of a response being received
+        self.expanded = set()  # indexes of large messages the user expanded
+
+    def set_messages(self, messages, meta=None):
+        """Shows a new session, starting with its newest page of messages."""
+        self.beginResetModel()
+        self.messages = messages
+        self.meta = {} if meta is None else meta
+        self.first = max(0, len(messages) - self.page_size)
+        self.count = len(messages) - self.first
+        self.streaming = None
+        self.expanded = set()
+        self.endResetModel()
+
+    def sync(self):
+        """Exposes messages appended to the session since the last call."""
+        new_count = len(self.messages) - self.first
+        if new_count < self.count:
+            self.set_messages(self.messages, self.meta)
+        elif new_count > self.count:
+            self.beginInsertRows(QModelIndex(), self.count, new_count - 1)
+            self.count = new_count
+            self.endInsertRows()
+
+    def fetch_older(self):
+        """Prepends the previous page of messages and returns how many rows were added."""
+        added = min(self.page_size, self.first)
+        if added:
+            self.beginInsertRows(QModelIndex(), 0, added - 1)
+            self.first -= added
+            self.count += added
+            self.endInsertRows()
+        return added
+
+    def ensure_loaded(self, message_index):
+        """Fetches older pages until a message is in the window and returns its row."""
+        while message_index < self.first and self.fetch_older():
+            pass
+        return message_index - self.first
+
+    def update_message(self, message_index):
+        """Signals that a message in the window changed."""
+        if self.first <= message_index < self.first + self.count:
+            row = message_index - self.first
+            self.dataChanged.emit(self.index(row), self.index(row))
+
+    def set_streaming(self, sender, text, timestamp):
+        """Adds or updates the row of a response that is still being received."""
+        if self.streaming is None:
+            self.beginInsertRows(QModelIndex(), self.count, self.count)
+            self.streaming = (sender, text, timestamp)
+            self.endInsertRows()
+        else:
+            self.streaming = (sender, text, timestamp)
+            self.dataChanged.emit(self.index(self.count), self.index(self.count))
+
+    def clear_streaming(self):
+        """Removes the streaming row."""
+        if self.streaming is not None:
+            self.beginRemoveRows(QModelIndex(), self.count, self.count)
+            self.streaming = None
+            self.endRemoveRows()
+
+    def toggle_expanded(self, row):
+        message_index = self.first + row
+        self.expanded.symmetric_difference_update({message_index})
+        self.dataChanged.emit(self.index(row), self.index(row))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.count + (self.streaming is not None)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if row < self.count:
+            sender, message, timestamp = self.messages[self.first + row]
+            message_index = self.first + row
+        else:
+            sender, message, timestamp = self.streaming
+            message_index = -1
+        if role == Qt.DisplayRole:
+            return message
+        elif role == self.SenderRole:
+            return sender
+        elif role == self.TimestampRole:
+            return timestamp
+        elif role == self.MessageIndexRole:
+            return message_index
+        elif role == self.ExpandedRole:
+            return message_index in self.expanded
+        elif role == self.MetaRole:
+            return self.meta.get(message_index)
+        return None
+
+class SessionListModel(QAbstractListModel):
+    """List model over ChatSessionManager's recency index.
+
+    Changes arrive as row insert/move/remove notifications from the manager, so refreshing never rebuilds the
+    list or touches the filesystem.
+    """
+    def __init__(self, chat_session_manager, parent=None):
+        super().__init__(parent)
+        self.chat_session_manager = chat_session_manager
+        chat_session_manager.add_listener(self.before_change, self.after_change)
+        self.in_flight = set()  # sessions with requests running or queued
+
+    def set_in_flight(self, session_id, busy):
+        """Marks whether a session has requests in flight."""
+        if busy:
+            self.in_flight.add(session_id)
+        else:
+            self.in_flight.discard(session_id)
+        row = self.row_of(session_id)
+        if row is not None:
+            self.dataChanged.emit(self.index(row), self.index(row))
+
+    def before_change(self, change, old_row, new_row):
+        if change == "insert":
+            self.beginInsertRows(QModelIndex(), new_row, new_row)
+        elif change == "move":
+            # Qt expects the destination as the row the item is inserted before, counted before the move
+            self.beginMoveRows(QModelIndex(), old_row, old_row, QModelIndex(), new_row if new_row < old_row else new_row + 1)
+        elif change == "remove":
+            self.beginRemoveRows(QModelIndex(), old_row, old_row)
+        elif change == "reset":
+            self.beginResetModel()
+
+    def after_change(self, change, old_row, new_row):
+        if change == "insert":
+            self.endInsertRows()
+        elif change == "move":
+            self.endMoveRows()
+        elif change == "remove":
+            self.endRemoveRows()
+        elif change == "reset":
+            self.endResetModel()
+        elif change == "update" and old_row is not None:
+            self.dataChanged.emit(self.index(old_row), self.index(old_row))
+
+    def row_of(self, session_id):
+        return self.chat_session_manager.recency.row(session_id)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.chat_session_manager.recency)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        session_id = self.chat_session_manager.recency.session_at(index.row())
+        if role == Qt.DisplayRole:
+            session_name = self.chat_session_manager.sessions[session_id]["session_name"]
+            return f"⏳ {session_name}" if session_id in self.in_flight else session_name
+        elif role == Qt.UserRole:
+            return session_id
+        return None
+
+class MessageDelegate(QStyledItemDelegate):
+    """Paints transcript rows as rich text; only rows in view are laid out and painted.
+
+    Messages longer than `collapse_chars` are shown collapsed until expanded.
+    """
+    padding = 6
+    collapse_chars = 4000
+
+    def __init__(self, message_manager, colors, parent=None):
+        super().__init__(parent)
+        self.message_manager = message_manager
+        self.colors = colors  # {"You": color, "AI": color, "System": color, "text": color, "highlight": color}
+        self.documents = OrderedDict()  # {(message_index, text length, width, expanded): QTextDocument}
+        self.max_cached_documents = 512
+
+    def document(self, index, width):
+        """Returns the laid-out document of a row, cached for rows of committed messages."""
+        message = index.data(Qt.DisplayRole)
+        message_index = index.data(TranscriptModel.MessageIndexRole)
+        expanded = index.data(TranscriptModel.ExpandedRole)
+        key = (message_index, len(message), width, expanded)
+        document = self.documents.get(key) if message_index >= 0 else None
+        if document is not None:
+            self.documents.move_to_end(key)
+            return document
+        if len(message) > self.collapse_chars and not expanded:
+            hidden = len(message) - self.collapse_chars
+            message = message[:self.collapse_chars] + f" … [{hidden} more characters, double-click to expand]"
+        document = QTextDocument()
+        document.setDefaultFont(self.parent().font() if self.parent() else QFont())
+        document.setHtml(self.message_manager.message_html(index.data(TranscriptModel.SenderRole), message,
+                                                            index.data(TranscriptModel.TimestampRole),
+                                                            index.data(TranscriptModel.MetaRole)))
+        document.setTextWidth(max(50, width - 2 * self.padding))
+        if message_index >= 0:
+            self.documents[key] = document
+            if len(self.documents) > self.max_cached_documents:
+                self.documents.popitem(last=False)
+        return document
+
+    def forget(self, message_index):
+        """Drops cached layouts of a message that changed."""
+        for key in [key for key in self.documents if key[0] == message_index]:
+            del self.documents[key]
+
+    def clear(self):
+        self.documents.clear()
+
+    def sizeHint(self, option, index):
+        document = self.document(index, option.rect.width())
+        return QSize(option.rect.width(), int(document.size().height()) + 2 * self.padding + 4)
+
+    def paint(self, painter, option, index):
+        painter.save()
+        rect = option.rect.adjusted(2, 2, -2, -2)
+        painter.setRenderHint(painter.Antialiasing)
+        painter.setBrush(QColor(self.colors.get(index.data(TranscriptModel.SenderRole), self.colors["AI"])))
+        if option.state & QStyle.State_Selected:
+            painter.setPen(QPen(QColor(self.colors["highlight"]), 2))
+        else:
+            painter.setPen(Qt.NoPen)
+        painter.drawRoundedRect(QRectF(rect), 5, 5)
+        document = self.document(index, option.rect.width())
+        painter.translate(rect.left() + self.padding - 2, rect.top() + self.padding - 2)
+        document.drawContents(painter, QRectF(0, 0, rect.width(), rect.height()))
+        painter.restore()
+
+class ProviderError(Exception):
+    """An unsuccessful provider response, with its HTTP status and response headers."""
+    def __init__(self, message, status_code=None, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+def parse_duration(value):
+    """Parses a rate-limit reset duration such as "1s", "250ms" or "6m0s" into seconds."""
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+def retry_after_seconds(headers, status_code):
+    """Returns how long a provider asked the client to wait, from its Retry-After or rate-limit headers.
+
+    The rate-limit headers describe the client's quotas rather than this error, so they are read only for a 429
+    without Retry-After, and only for the buckets that are exhausted.
+    """
+    headers = {key.lower(): value for key, value in (headers or {}).items()}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            if value.replace(".", "", 1).isdigit():
+                return float(value)
+            return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        if status_code != 429:
+            return None
+        resets = []
+        for key, value in headers.items():
+            if key.startswith("x-ratelimit-remaining-"):
+                # OpenAI and xAI report how long until a request or token budget resets
+                reset = headers.get(key.replace("-remaining-", "-reset-"))
+                if reset and float(value) <= 0:
+                    resets.append(parse_duration(reset))
+            elif key.startswith("anthropic-ratelimit-") and key.endswith("-remaining"):
+                # Anthropic reports the reset time as a timestamp
+                reset = headers.get(key[:-len("remaining")] + "reset")
+                if reset and float(value) <= 0:
+                    resets.append(max(datetime.fromisoformat(reset.replace("Z", "+00:00")).timestamp() - time.time(),
+                                      0.0))
+        return max(resets) if resets else None
+    except (ValueError, TypeError):
+        return None
+
+def classify_error(error):
+    """Returns (retryable, retry_after) for an exception raised by a provider call.
+
+    Rate limits, overload, server errors and dropped connections are retryable; authentication, bad requests and
+    anything unrecognised are not.
+    """
+    if isinstance(error, CircuitOpenError):
+        return False, None
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status_code is None and isinstance(getattr(error, "code", None), int):
+        status_code = error.code  # google.api_core errors carry the HTTP status as `code`
+    if status_code is not None:
+        headers = getattr(error, "headers", None) or getattr(response, "headers", None)
+        retryable = status_code in RETRYABLE_STATUS_CODES
+        return retryable, retry_after_seconds(headers, status_code) if retryable else None
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                          requests.exceptions.ChunkedEncodingError, APIConnectionError,
+                          anthropic.APIConnectionError, ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True, None
+    # httpx (behind the AsyncEngine's HTTP client) raises subclasses of its TransportError
+    if any(cls.__name__ == "TransportError" for cls in type(error).__mro__):
+        return True, None
+    return False, None
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, from the `retry` section of config.yaml.
+
+    A provider's Retry-After is honoured as the minimum wait; a request is not retried if that would exceed
+    `max_retry_after` seconds.
+    """
+    def __init__(self, config=None):
+        config = config or {}
+        self.max_retries = config.get("max_retries", 3)
+        self.base_delay = config.get("base_delay", 1.0)
+        self.max_delay = config.get("max_delay", 30.0)
+        self.max_retry_after = config.get("max_retry_after", 60.0)
+
+    def delay(self, attempt, retry_after=None):
+        """Returns the seconds to wait before retry number attempt + 1, or None if it should not be retried."""
+        if attempt >= self.max_retries - 1:
+            return None
+        if retry_after is not None and retry_after > self.max_retry_after:
+            return None
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(backoff, retry_after or 0)
+
+class CircuitBreaker:
+    """Fails requests to a provider fast after `failure_threshold` consecutive retryable failures.
+
+    The breaker stays open for `reset_timeout` seconds, then lets one trial request through (half-open); its
+    success closes the breaker and its failure opens it again. Every request that was let through reports back:
+    record_success for a response (including a non-retryable error, which shows the provider is up),
+    record_failure for a retryable error, and release_trial when it was cancelled.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Returns True if a request may be sent now."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            # Half-open: one trial at a time; a trial that never reported back is replaced after a timeout
+            if self.trial_started is None or now - self.trial_started >= self.reset_timeout:
+                self.trial_started = now
+                return True
+            return False
+
+    def remaining(self):
+        """Returns the seconds until the breaker lets a trial request through."""
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_started = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_started is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.trial_started = None
+
+    def release_trial(self):
+        """Ends the trial of a request cancelled before it had an outcome, so the next request can be the trial."""
+        with self.lock:
+            self.trial_started = None
+
+class CircuitBreakers:
+    """Process-wide circuit breakers, one per provider."""
+    def __init__(self):
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def get(self, provider, config=None):
+        """Returns a provider's breaker, created with the thresholds of the `retry` config section."""
+        with self.lock:
+            breaker = self.breakers.get(provider)
+            if breaker is None:
+                config = config or {}
+                breaker = CircuitBreaker(config.get("breaker_threshold", 5), config.get("breaker_reset", 30.0))
+                self.breakers[provider] = breaker
+            return breaker
+
+circuit_breakers = CircuitBreakers()
+
+def percentile(values, p):
+    """Returns the p-th percentile (nearest rank) of a list of numbers, or None if it is empty."""
+    values = sorted(values)
+    if not values:
+        return None
+    return values[max(math.ceil(len(values) * p / 100) - 1, 0)]
+
+class LatencyTracker:
+    """Keeps each provider's recent times to first token, to tell when a request is slower than usual."""
+    def __init__(self, window=200):
+        self.window = window
+        self.samples = {}  # {provider: deque of seconds}
+        self.lock = threading.Lock()
+
+    def record(self, provider, seconds):
+        with self.lock:
+            self.samples.setdefault(provider, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, provider, p, min_samples=5):
+        """Returns the provider's time to first token at a percentile, or None until min_samples are recorded."""
+        with self.lock:
+            samples = list(self.samples.get(provider, ()))
+        if len(samples) < min_samples:
+            return None
+        return percentile(samples, p)
+
+first_token_latency = LatencyTracker()
+
+class TokenBucket:
+    """Refills `rate` units per second up to `capacity`.
+
+    Reservations may overdraw the bucket: each caller takes its share at once and waits until the bucket is back to
+    zero, so callers are served in the order they reserved and each knows its wait up front.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """Takes amount (at most a full bucket); returns the seconds until the bucket has covered it."""
+        self.refill(now)
+        self.level -= min(amount, self.capacity)
+        return max(-self.level / self.rate, 0.0)
+
+    def adjust(self, amount, now):
+        """Takes amount more, or gives it back when negative."""
+        self.refill(now)
+        self.level = min(self.capacity, self.level - amount)
+
+    def hold(self, seconds, now):
+        """Empties the bucket for at least the given seconds, e.g. after the provider asked to retry later."""
+        self.refill(now)
+        self.level = min(self.level, -seconds * self.rate)
+
+class RateLimiter:
+    """A provider model's request and token quotas, shared by every session using the same key."""
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.settings = (requests_per_minute, tokens_per_minute)
+        self.buckets = {}  # {"requests" or "tokens": TokenBucket}
+        if requests_per_minute:
+            self.buckets["requests"] = TokenBucket(requests_per_minute / 60, requests_per_minute)
+        if tokens_per_minute:
+            self.buckets["tokens"] = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens):
+        """Reserves a request of about `tokens` input tokens; returns the seconds to wait before sending it."""
+        amounts = {"requests": 1, "tokens": tokens}
+        now = time.monotonic()
+        with self.lock:
+            return max([bucket.reserve(amounts[name], now) for name, bucket in self.buckets.items()] + [0.0])
+
+    def release(self, tokens):
+        """Gives back the reservation of a request that was cancelled before it was sent."""
+        self.adjust(-1, -tokens)
+
+    def adjust(self, requests=0, tokens=0):
+        """Corrects the reserved amounts, e.g. by the response tokens once they are known."""
+        amounts = {"requests": requests, "tokens": tokens}
+        now = time.monotonic()
+        with self.lock:
+            for name, bucket in self.buckets.items():
+                bucket.adjust(amounts[name], now)
+
+    def hold(self, seconds):
+        """Makes every request wait at least the given seconds; used when the provider answers 429 with a
+        Retry-After, so the other sessions sharing the key wait instead of adding to the burst."""
+        now = time.monotonic()
+        with self.lock:
+            for bucket in self.buckets.values():
+                bucket.hold(seconds, now)
+
+class RateLimiters:
+    """Process-wide rate limiters, one per provider and model with limits in the `rate_limits` config section.
+
+    Limits are set per provider (requests_per_minute, tokens_per_minute) and can be overridden per model under
+    `models`; each model gets buckets of its own.
+    """
+    def __init__(self):
+        self.limiters = {}  # {(provider, model): RateLimiter}
+        self.lock = threading.Lock()
+
+    def get(self, provider, model, config=None):
+        """Returns the limiter of a provider model, or None if it has no limits."""
+        limits = dict((config or {}).get(provider) or {})
+        limits.update((limits.pop("models", None) or {}).get(model) or {})
+        settings = (limits.get("requests_per_minute"), limits.get("tokens_per_minute"))
+        if not any(settings):
+            return None
+        with self.lock:
+            limiter = self.limiters.get((provider, model))
+            if limiter is None or limiter.settings != settings:
+                limiter = RateLimiter(*settings)
+                self.limiters[(provider, model)] = limiter
+            return limiter
+
+rate_limiters = RateLimiters()
+
+class ProviderAdapter:
+    """A provider integration: formats conversation history, creates clients, streams responses and counts tokens.
+
+    Adapters are registered by provider name in PROVIDER_ADAPTERS. Each keeps the messages it has already converted
+    per session and converts only the ones appended since, so preparing a request is O(new messages).
+    """
+    default_max_tokens = 1024  # tokens reserved for the response when the provider has no `max_tokens` setting
+
+    def __init__(self, name):
+        self.name = name
+        self.conversions = {}  # {session_id: (MessageLog message list, [converted message])}
+
+    def count_tokens(self, text):
+        return ContextWindow.count_tokens(text)
+
+    def format_message(self, message):
+        return {"role": message["role"], "content": message["content"]}
+
+    def system_messages(self, system_prompt):
+        return [{"role": "system", "content": system_prompt}]
+
+    def format(self, history, system_prompt, session_id=None):
+        """Converts a ConversationSnapshot to the provider's message list, reusing the session's earlier
+        conversions; called on the UI thread."""
+        if session_id is None:
+            return self.system_messages(system_prompt) + [self.format_message(message) for message in history]
+        messages, converted = self.conversions.get(session_id, (None, None))
+        if messages is not history.messages:
+            # A replaced history (copy-on-write) starts over
+            converted = []
+            self.conversions[session_id] = (history.messages, converted)
+        for message in history.messages[len(converted):history.stop]:
+            converted.append(self.format_message(message))
+        return self.system_messages(system_prompt) + converted[history.start:history.stop]
+
+    def forget(self, session_id):
+        self.conversions.pop(session_id, None)
+
+    def validate(self, provider_config):
+        """Returns an error message if the settings cannot work, otherwise None."""
+        return None
+
+    def warm(self, provider_config):
+        """Creates the pooled client ahead of the first request."""
+        client_pool.get_client(self.name, provider_config)
+
+    def create_client(self, api_key, base_url, pool_maxsize):
+        raise NotImplementedError
+
+    def create_async_client(self, api_key, base_url):
+        raise NotImplementedError
+
+    def stream(self, request, provider_config, converted_history):
+        """Yields the response text of an ApiWorker request as it arrives; sets request.usage and
+        request.completion_tokens when reported.
+
+        Adapters register a way to close the open stream with request.add_closer once the response is open, so
+        cancelling is immediate; that also marks the request connected.
+        """
+        raise NotImplementedError
+
+    def astream(self, request, provider_config, converted_history):
+        """Async counterpart of stream, using the AsyncEngine's clients; calls request.mark_connected() once the
+        response is open."""
+        raise NotImplementedError
+
+    @staticmethod
+    def close_sdk_stream(stream):
+        """Closes an SDK response stream from another thread; closing it alone does not wake a read blocked on the
+        socket, so the socket is shut down first."""
+        network_stream = stream.response.extensions.get("network_stream")
+        sock = network_stream.get_extra_info("socket") if network_stream else None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        stream.close()
+
+    def send(self, request, provider_config, converted_history):
+        """Returns the whole response text."""
+        return "".join(self.stream(request, provider_config, converted_history))
+
+class GeminiAdapter(ProviderAdapter):
+    default_max_tokens = 8192
+
+    def format_message(self, message):
+        role = "user" if message["role"] == "user" else "model"
+        return {"role": role, "parts": [{"text": message["content"]}]}
+
+    def system_messages(self, system_prompt):
+        return []  # sent as the model's system instruction
+
+    def warm(self, provider_config):
+        client_pool.get_gemini_model(provider_config)
+
+    def create_client(self, api_key, base_url, pool_maxsize):
+        return {}  # {(model_name, system_prompt): GenerativeModel}, filled by get_gemini_model
+
+    def stream(self, request, provider_config, converted_history):
+        """Streams a Google Gemini response, reading long stable conversation prefixes from cached content."""
+        model, contents = self.cached_model(request, provider_config, converted_history)
+        response = model.generate_content(
+            contents, generation_config={"temperature": provider_config.get("temperature", 0.7)}, stream=True)
+        # The SDK exposes no close; cancelling its underlying gRPC/REST stream ends the blocked read
+        cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+        if cancel:
+            request.add_closer(cancel)
+        request.mark_connected()
+        for part in response:
+            yield part.text
+        self.read_usage(request, response)
+
+    async def astream(self, request, provider_config, converted_history):
+        # Creating cached content is a blocking SDK call, so it runs on the loop's executor
+        model, contents = await asyncio.get_running_loop().run_in_executor(
+            None, self.cached_model, request, provider_config, converted_history)
+        response = await model.generate_content_async(
+            contents, generation_config={"temperature": provider_config.get("temperature", 0.7)}, stream=True)
+        request.mark_connected()
+        async for part in response:
+            yield part.text
+        self.read_usage(request, response)
+
+    def read_usage(self, request, response):
+        usage = response.usage_metadata
+        if usage:
+            request.usage = (usage.prompt_token_count, usage.cached_content_token_count)
+            request.completion_tokens = usage.candidates_token_count
+
+    def cached_model(self, request, provider_config, converted_history):
+        """Returns the model and contents to send, using Gemini cached content for the conversation prefix.
+
+        The prefix (everything before the new message) is cached once it reaches `cache_min_tokens`, and cached
+        again when the uncached tail grows that large; the cache is reused while the context window start is
+        unchanged.
+        """
+        model = client_pool.get_gemini_model(provider_config)
+        prompt_cache = request.prompt_cache
+        window_start = request.history.start
+        min_tokens = provider_config.get("cache_min_tokens", 32768)
+        cached = prompt_cache["gemini"]
+        if cached and (cached["model"] != provider_config.get("model") or cached["window_start"] != window_start
+                       or cached["system_prompt"] != provider_config.get("system_prompt")
+                       or cached["end"] >= len(converted_history) or cached["expires"] <= time.time()):
+            cached = None
+        cached_end = cached["end"] if cached else 0
+        prefix_end = len(converted_history) - 1
+        uncached_tokens = request.history.tokens(cached_end, prefix_end)
+        if uncached_tokens >= min_tokens:
+            ttl = provider_config.get("cache_ttl", 3600)
+            try:
+                cached_content, cached_model = client_pool.create_gemini_cache(
+                    provider_config, converted_history[:prefix_end], ttl)
+                if cached:
+                    try:
+                        cached["cached_content"].delete()
+                    except Exception as e:
+                        logging.error(f"Failed to delete Gemini cached content: {e}")
+                cached = {"cached_content": cached_content, "model_instance": cached_model,
+                          "model": provider_config.get("model"), "system_prompt": provider_config.get("system_prompt"),
+                          "window_start": window_start, "end": prefix_end, "expires": time.time() + ttl}
+            except Exception as e:
+                logging.error(f"Failed to create Gemini cached content: {e}")
+        prompt_cache["gemini"] = cached
+        if cached:
+            return cached["model_instance"], converted_history[cached["end"]:]
+        return model, converted_history
+
+class OpenAIAdapter(ProviderAdapter):
+    """OpenAI and OpenAI compatible chat completions, streamed over SSE.
+
+    The system prompt and history always come first and in order, so OpenAI's automatic prefix caching can reuse
+    them; the session id is passed as the cache key to keep a session's requests on the same cache.
+    """
+    default_max_tokens = 10000
+
+    def __init__(self, name, prompt_cache_options=False):
+        super().__init__(name)
+        # Compatible servers may not accept OpenAI's cache and usage options
+        self.prompt_cache_options = prompt_cache_options
+
+    def create_client(self, api_key, base_url, pool_maxsize):
+        # Retries are left to ApiWorker's RetryPolicy and the provider's circuit breaker
+        return OpenAI(api_key=api_key, base_url=base_url or None, max_retries=0)
+
+    def create_async_client(self, api_key, base_url):
+        return AsyncOpenAI(api_key=api_key, base_url=base_url or None, max_retries=0)
+
+    def request_options(self, request, provider_config, converted_history):
+        options = {"prompt_cache_key": request.session_id, "stream_options": {"include_usage": True}} \
+            if self.prompt_cache_options else {}
+        return dict(
+            model=provider_config.get("model", "gpt-4"),
+            messages=converted_history,
+            temperature=provider_config.get("temperature", 0.7),
+            max_tokens=provider_config.get("max_tokens", self.default_max_tokens),
+            stream=True,
+            **options
+        )
+
+    def read_event(self, request, event):
+        if event.usage:
+            details = event.usage.prompt_tokens_details
+            request.usage = (event.usage.prompt_tokens, (details.cached_tokens or 0) if details else 0)
+            request.completion_tokens = event.usage.completion_tokens
+        if event.choices and event.choices[0].delta.content:
+            return event.choices[0].delta.content
+
+    def stream(self, request, provider_config, converted_history):
+        client = client_pool.get_client(self.name, provider_config)
+        stream = client.chat.completions.create(**self.request_options(request, provider_config, converted_history))
+        request.add_closer(lambda: self.close_sdk_stream(stream))
+        for event in stream:
+            text = self.read_event(request, event)
+            if text:
+                yield text
+
+    async def astream(self, request, provider_config, converted_history):
+        client = async_engine.get_client(self.name, provider_config)
+        stream = await client.chat.completions.create(**self.request_options(request, provider_config, converted_history))
+        request.mark_connected()
+        async for event in stream:
+            text = self.read_event(request, event)
+            if text:
+                yield text
+
+class AnthropicAdapter(ProviderAdapter):
+    """Anthropic Claude messages, streamed from the message stream events.
+
+    Cache breakpoints are set on the system prompt and on the newest message, so the next turn reads the whole
+    conversation up to it from the prompt cache.
+    """
+    default_max_tokens = 1000
+
+    def create_client(self, api_key, base_url, pool_maxsize):
+        return anthropic.Anthropic(api_key=api_key, base_url=base_url or None, max_retries=0)
+
+    def create_async_client(self, api_key, base_url):
+        return anthropic.AsyncAnthropic(api_key=api_key, base_url=base_url or None, max_retries=0)
+
+    def request_options(self, provider_config, converted_history):
+        # The Messages API takes the system prompt as a separate parameter
+        system_prompt = "\n".join(m["content"] for m in converted_history if m["role"] == "system")
+        messages = [m for m in converted_history if m["role"] != "system"]
+        if messages:
+            messages[-1] = {"role": messages[-1]["role"], "content": [
+                {"type": "text", "text": messages[-1]["content"], "cache_control": {"type": "ephemeral"}}]}
+        system = [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}] if system_prompt \
+            else anthropic.NOT_GIVEN
+        return dict(
+            model=provider_config.get("model", "claude-3-sonnet-20240229"),
+            system=system,
+            messages=messages,
+            temperature=provider_config.get("temperature", 0.7),
+            max_tokens=provider_config.get("max_tokens", self.default_max_tokens)
+        )
+
+    def read_usage(self, request, message):
+        usage = message.usage
+        cached_tokens = usage.cache_read_input_tokens or 0
+        request.usage = (usage.input_tokens + cached_tokens + (usage.cache_creation_input_tokens or 0), cached_tokens)
+        request.completion_tokens = usage.output_tokens
+
+    def stream(self, request, provider_config, converted_history):
+        client = client_pool.get_client(self.name, provider_config)
+        with client.messages.stream(**self.request_options(provider_config, converted_history)) as stream:
+            request.add_closer(lambda: self.close_sdk_stream(stream))
+            for text in stream.text_stream:
+                yield text
+            self.read_usage(request, stream.get_final_message())
+
+    async def astream(self, request, provider_config, converted_history):
+        client = async_engine.get_client(self.name, provider_config)
+        async with client.messages.stream(**self.request_options(provider_config, converted_history)) as stream:
+            request.mark_connected()
+            async for text in stream.text_stream:
+                yield text
+            self.read_usage(request, await stream.get_final_message())
+
+class HTTPProviderAdapter(ProviderAdapter):
+    """A provider called over plain HTTP: a pooled requests session, or an async httpx client on the AsyncEngine."""
+    def create_client(self, api_key, base_url, pool_maxsize):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if api_key:
+            session.headers["Authorization"] = f"Bearer {api_key}"
+        return session
+
+    def create_async_client(self, api_key, base_url):
+        # The SDKs' async HTTP client, with their long streaming timeouts
+        return DefaultAsyncHttpxClient(headers={"Authorization": f"Bearer {api_key}"} if api_key else None)
+
+    @staticmethod
+    def close_response(response):
+        """Closes a streaming response from another thread; shutting the socket down wakes the blocked read."""
+        sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        response.close()
+
+    def endpoint(self, provider_config):
+        raise NotImplementedError
+
+    def payload(self, provider_config, converted_history):
+        raise NotImplementedError
+
+    def parse_line(self, request, line):
+        """Reads one line of the response body; returns (text or None, whether the response is complete)."""
+        raise NotImplementedError
+
+    def stream(self, request, provider_config, converted_history):
+        session = client_pool.get_client(self.name, provider_config)
+        data = self.payload(provider_config, converted_history)
+        with session.post(self.endpoint(provider_config), json=data, stream=True) as response:
+            # For Ollama, dropping the connection also stops the model generating
+            request.add_closer(lambda: self.close_response(response))
+            if response.status_code != 200:
+                logging.error(f"{self.name} API Error: {response.text}")
+                raise ProviderError(f"API Error: {response.text}", response.status_code, response.headers)
+            for line in response.iter_lines(decode_unicode=True):
+                text, done = self.parse_line(request, line)
+                if text:
+                    yield text
+                if done:
+                    return
+
+    async def astream(self, request, provider_config, converted_history):
+        client = async_engine.get_client(self.name, provider_config)
+        data = self.payload(provider_config, converted_history)
+        async with client.stream("POST", self.endpoint(provider_config), json=data) as response:
+            request.mark_connected()
+            if response.status_code != 200:
+                text = (await response.aread()).decode("utf-8", "replace")
+                logging.error(f"{self.name} API Error: {text}")
+                raise ProviderError(f"API Error: {text}", response.status_code, response.headers)
+            async for line in response.aiter_lines():
+                text, done = self.parse_line(request, line)
+                if text:
+                    yield text
+                if done:
+                    return
+
+class XAIAdapter(HTTPProviderAdapter):
+    """xAI Grok chat completions, streamed over SSE."""
+    default_max_tokens = 10000
+
+    def validate(self, provider_config):
+        url = provider_config.get("base_url", "")
+        if url and "https://api.x.ai" not in url:
+            return "Grok Base URL must point to https://api.x.ai."
+        return None
+
+    def endpoint(self, provider_config):
+        return provider_config.get("base_url", "https://api.x.ai/v1").rstrip("/") + "/chat/completions"
+
+    def payload(self, provider_config, converted_history):
+        return {
+            "model": provider_config.get("model", "grok-2-1212"),
+            "messages": converted_history,
+            "temperature": provider_config.get("temperature", 0.7),
+            "max_tokens": provider_config.get("max_tokens", self.default_max_tokens),
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+
+    def parse_line(self, request, line):
+        # Server-sent events: the JSON payload of each `data:` line, until `[DONE]`
+        if not line or not line.startswith("data:"):
+            return None, False
+        payload = line[len("data:"):].strip()
+        if payload == "[DONE]":
+            return None, True
         try:
-            with open("config.yaml", "w") as file:
-                yaml.dump(self.config, file)
-        except Exception as e:
-            logging.error(f"Error saving to config.yaml file: {e}")
+            event = json.loads(payload)
+        except json.JSONDecodeError:
+            logging.error(f"Invalid SSE payload: {payload}")
+            return None, False
+        if event.get("usage"):
+            details = event["usage"].get("prompt_tokens_details") or {}
+            request.usage = (event["usage"].get("prompt_tokens", 0), details.get("cached_tokens", 0))
+            request.completion_tokens = event["usage"].get("completion_tokens")
+        choices = event.get("choices") or [{}]
+        return choices[0].get("delta", {}).get("content"), False
 
-    def get_active_provider(self):
-        """Returns the active API provider."""
-        return self.config.get("active_provider", "")
+class OllamaAdapter(HTTPProviderAdapter):
+    """A local Ollama server's /api/chat endpoint, streamed as NDJSON."""
+    default_max_tokens = 1024
 
-    def get_provider_config(self, provider):
-        """Returns the configuration for a specific provider."""
-        return self.config.get(provider, {})
+    def endpoint(self, provider_config):
+        return (provider_config.get("base_url") or OLLAMA_DEFAULT_URL).rstrip("/") + "/api/chat"
 
-class ChatSessionManager:
-    """Manages chat sessions."""
-    def __init__(self):
-        self.sessions = {}  # {session_id: {"session_name": "", "chat_log": [], "conversation_history": [], "attached_files": {}}}
-        self.load_sessions()
+    def payload(self, provider_config, converted_history):
+        return {
+            "model": provider_config.get("ollama_model") or provider_config.get("model", "llama2"),
+            "messages": converted_history,
+            "stream": True,
+            # Keep the model resident between messages instead of reloading it every turn
+            "keep_alive": provider_config.get("keep_alive", "5m"),
+            "options": {"temperature": provider_config.get("temperature", 0.7)},
+        }
 
-    def load_sessions(self):
-        """Loads chat sessions from the chat_logs directory."""
-        for filename in os.listdir("chat_logs"):
-            if filename.endswith(".json"):
-                session_id = filename[:-5]
-                try:
-                    with open(os.path.join("chat_logs", filename), "r") as file:
-                        session_data = json.load(file)
-                        # Validate session data
-                        if not self.validate_session_data(session_data):
-                            logging.error(f"Invalid session data in file: {filename}")
-                            continue
-                        self.sessions[session_id] = session_data
-                except json.JSONDecodeError:
-                    logging.error(f"Invalid JSON in file: {filename}")
-                    continue
-                except Exception as e:
-                    logging.error(f"Error loading session file {filename}: {e}")
-                    continue
+    def parse_line(self, request, line):
+        if not line:
+            return None, False
+        event = json.loads(line)
+        if event.get("error"):
+            raise Exception(f"Ollama Error: {event['error']}")
+        if event.get("done"):
+            request.completion_tokens = event.get("eval_count")
+        return event.get("message", {}).get("content"), bool(event.get("done"))
 
-    def validate_session_data(self, session_data):
-        """Validates session data to ensure required fields exist."""
-        required_fields = ["session_name", "chat_log", "conversation_history", "attached_files"]
-        return all(field in session_data for field in required_fields)
+PROVIDER_ADAPTERS = {}  # {provider name: ProviderAdapter}, in the order providers are offered
 
-    def convert_conversation_history(self, conversation_history, provider, system_prompt):
-        """Converts conversation history to the format required by the selected provider."""
-        converted_history = []
-
-        if provider == "Google Gemini":
-            for message in conversation_history:
-                if message["role"] == "user":
-                    converted_history.append({"role": "user", "parts": [{"text": message["content"]}]})
-                elif message["role"] == "assistant" or message["role"] == "model":
-                    converted_history.append({"role": "model", "parts": [{"text": message["content"]}]})
-        elif provider in ["OpenAI", "Anthropic Claude", "xAI Grok", "Ollama"]:
-            # Add system prompt for other providers
-            converted_history.append({"role": "system", "content": system_prompt})
-            for message in conversation_history:
-                converted_history.append({"role": message["role"], "content": message["content"]})
-        return converted_history
+def register_adapter(adapter):
+    PROVIDER_ADAPTERS[adapter.name] = adapter
 
-    def new_session(self):
-        """Creates a new chat session."""
-        timestamp = datetime.now()
-        session_id = timestamp.strftime("Session_%Y%m%d_%H%M%S")
-        session_name = timestamp.strftime("Session %Y-%m-%d %H:%M:%S")
-        self.sessions[session_id] = {
-            "session_name": session_name,
-            "chat_log": [],
-            "conversation_history": [],
-            "attached_files": {}
-        }
-        return session_id, session_name
+def get_adapter(provider):
+    """Returns the adapter registered for a provider."""
+    adapter = PROVIDER_ADAPTERS.get(provider)
+    if adapter is None:
+        raise Exception("Unsupported API provider")
+    return adapter
 
-    def delete_session(self, session_id):
-        """Deletes a chat session."""
-        if session_id in self.sessions:
-            try:
-                log_file_path = os.path.join("chat_logs", f"{session_id}.json")
-                if os.path.exists(log_file_path):
-                    os.remove(log_file_path)
-                del self.sessions[session_id]
-            except Exception as e:
-                logging.error(f"Error deleting session {session_id} and it's log file: {e}")
+register_adapter(GeminiAdapter("Google Gemini"))
+register_adapter(OpenAIAdapter("OpenAI", prompt_cache_options=True))
+register_adapter(OpenAIAdapter("OpenAI Compatible"))
+register_adapter(AnthropicAdapter("Anthropic Claude"))
+register_adapter(OllamaAdapter("Ollama"))
+register_adapter(XAIAdapter("xAI Grok"))
 
-    def add_message(self, session_id, sender, message, timestamp, api_provider):
-        """Adds a message to a chat session."""
-        if session_id in self.sessions:
-            self.sessions[session_id]["chat_log"].append((sender, message, timestamp))
-            if sender == "You":
-                self.sessions[session_id]["conversation_history"].append({"role": "user", "content": message})
-            elif sender == "AI":
-                self.sessions[session_id]["conversation_history"].append({"role": "assistant", "content": message})
+class ApiWorkerSignals(QObject):
+    """Signals of an ApiWorker; each one carries the id of the session the request belongs to."""
+    chunk = pyqtSignal(str, str)
+    restarted = pyqtSignal(str)
+    finished = pyqtSignal(str, str, object)  # the response and its message metadata: the provider that answered
+    error = pyqtSignal(str, str)
+    cancelled = pyqtSignal(str, str, object)  # the text received before the request was stopped, and its metadata
+    context_trimmed = pyqtSignal(str, int)  # number of earlier messages left out of the request
+    cache_usage = pyqtSignal(str, int, int)  # input tokens and how many of them the provider served from its prompt cache
+    rate_limited = pyqtSignal(str, str, float)  # provider, and the seconds the request waits for its rate limit
 
-    def get_session_messages(self, session_id):
-        """Returns the messages for a specific session."""
-        return self.sessions.get(session_id, {}).get("chat_log", [])
+class ProviderAttempt:
+    """One provider's part in an ApiWorker request: the history converted for it and the state of its stream.
 
-    def attach_file(self, session_id, file_path):
-        """Attaches a file to a chat session."""
-        if session_id in self.sessions:
-            file_name = os.path.basename(file_path)
-            try:
-               with open(file_path, "rb") as file:
-                   file_content = file.read()
-               self.sessions[session_id]["attached_files"][file_name] = file_content
-               return file_name
-            except Exception as e:
-              logging.error(f"Failed to attach file {file_path}: {e}")
-              raise
+    Adapters read session_id, history and prompt_cache from it, set usage and register closers with add_closer.
+    """
+    def __init__(self, session_id, provider, provider_config, history, converted_history, prompt_cache, breaker,
+                 rate_limiter=None):
+        self.session_id = session_id
+        self.provider = provider
+        self.provider_config = provider_config
+        self.system_prompt = provider_config.get("system_prompt", "You are a helpful assistant.")
+        self.adapter = PROVIDER_ADAPTERS[provider]
+        self.history = history
+        self.converted_history = converted_history
+        self.prompt_cache = prompt_cache
+        self.breaker = breaker
+        self.rate_limiter = rate_limiter
+        self.estimated_tokens = history.tokens() + self.adapter.count_tokens(self.system_prompt)
+        self.tries = 0
+        self.cancelled = threading.Event()
+        self.closers = []  # closes the open response stream, so a blocked read returns at once
+        self.task = None  # the astream task, when the request runs on the AsyncEngine
+        self.in_flight = False
 
-    def get_attached_files(self, session_id):
-        """Returns the attached files for a specific session."""
-        return self.sessions.get(session_id, {}).get("attached_files", {})
+    def begin(self):
+        """Resets the stream state for a new try and reserves it with the rate limiter."""
+        self.tries += 1
+        # Seconds to wait before sending; the time to first token is counted from then
+        self.wait = self.rate_limiter.reserve(self.estimated_tokens) if self.rate_limiter else 0.0
+        self.started = time.monotonic() + self.wait
+        self.connected_at = None
+        self.first_token = None
+        self.usage = None  # (input tokens, cached input tokens), set by the stream if the provider reports it
+        self.completion_tokens = None  # likewise
+        self.closers = []
+        self.in_flight = True  # until the try reports its outcome to the circuit breaker
 
-    def save_session(self, session_id):
-        """Saves a chat session to a file."""
-        if session_id in self.sessions:
-            file_path = os.path.join("chat_logs", f"{session_id}.json")
-            try:
-                with open(file_path, "w") as file:
-                   json.dump({
-                       "session_name": self.sessions[session_id]["session_name"],
-                       "chat_log": self.sessions[session_id]["chat_log"],
-                       "conversation_history": self.sessions[session_id]["conversation_history"],
-                       "attached_files": self.sessions[session_id]["attached_files"]
-                        }, file, indent=4)
-            except Exception as e:
-                 logging.error(f"Error saving session {session_id} to file {file_path}: {e}")
+    def add_closer(self, close):
+        """Registers how to close the stream being read; called by adapters once the response is open."""
+        self.mark_connected()
+        self.closers.append(close)
+        if self.cancelled.is_set():
+            close()
 
-class MessageManager:
-    """Manages message formatting and display."""
-    def __init__(self, chat_display):
-        self.chat_display = chat_display
+    def mark_connected(self):
+        if self.connected_at is None:
+            self.connected_at = time.monotonic()
 
-    def add_formatted_message(self, sender, message, timestamp, bg_color):
-        """Adds a formatted message to the chat display."""
-        formatted_message = self.format_message(message)
-        self.chat_display.append(f"<div style='background-color:{bg_color}; padding:5px; border-radius:5px;'>"
-                                f"<b>{timestamp} {sender}:</b> {formatted_message}</div>")
+    def release(self):
+        """Gives back the rate limit reserved by a try cancelled before it was sent."""
+        if self.rate_limiter:
+            self.rate_limiter.release(self.estimated_tokens)
 
-    def format_message(self, message):
-        """Formats the message with bold, italic, underline, and code block."""
-        formatted_text = message.replace("*", "<b>").replace("*", "</b>")
-        formatted_text = formatted_text.replace("_", "<i>").replace("_", "</i>")
-        formatted_text = formatted_text.replace("~", "<u>").replace("~", "</u>")
-        formatted_text = formatted_text.replace("``````", "</pre>")
-        return formatted_text
+    def settle(self, response):
+        """Charges the rate limiter for the response tokens, correcting the input estimate by the reported usage."""
+        if self.rate_limiter:
+            tokens = self.adapter.count_tokens(response)
+            if self.usage:
+                tokens += self.usage[0] - self.estimated_tokens
+            self.rate_limiter.adjust(tokens=tokens)
+
+    def report(self, retryable=False):
+        """Reports the try's outcome to the circuit breaker: a retryable error counts as a failure, while a
+        response or any other error shows the provider is up."""
+        self.in_flight = False
+        if retryable:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
 
-class ApiWorker(QThread):
-    """Handles asynchronous API requests."""
-    finished = pyqtSignal(str)
-    error = pyqtSignal(str)
+    def cancel(self):
+        """Closes the attempt's stream; on the AsyncEngine, call it from the loop thread."""
+        if self.in_flight:
+            self.in_flight = False
+            self.breaker.release_trial()
+        self.cancelled.set()
+        for close in list(self.closers):
+            try:
+                close()
+            except Exception as e:
+                logging.error(f"Error closing a cancelled stream: {e}")
+        if self.task is not None:
+            self.task.cancel()
 
-    def __init__(self, session_id, user_message, parent, api_config_manager, chat_session_manager):
-        super().__init__(parent)
+class ApiWorker(QRunnable):
+    """Handles an API request on a RequestScheduler thread, streaming the response as it arrives.
+
+    The request goes to the active provider first and then along the session's fallback chain: a provider that fails
+    hands over to the next one at once, and with hedging on, the next one is also asked when no first token has
+    arrived within the provider's usual time to first token (a percentile of recent requests). The first provider
+    to stream text answers and the others are cancelled. Only the last provider left is retried under the
+    RetryPolicy.
+    """
+    def __init__(self, session_id, user_message, api_config_manager, chat_session_manager,
+                 response_cache=None, cache_mode="default"):
+        super().__init__()
+        self.setAutoDelete(False)  # the scheduler keeps running workers alive
+        self.signals = ApiWorkerSignals()
         self.session_id = session_id
         self.user_message = user_message
         self.api_config_manager = api_config_manager
         self.chat_session_manager = chat_session_manager
+        self.response_cache = response_cache
+        self.cache_mode = cache_mode  # "default", "bypass" or "force"; see ResponseCache.applies
+        self.cancelled = threading.Event()
+        self.submitted = time.monotonic()
+        self.events = queue.Queue()  # (kind, attempt, value) from the attempt threads, read by run()
+        self.attempts = []  # a ProviderAttempt per provider in the fallback chain, in order
+        self.live = []  # the attempts streaming
+        self.parts = []  # the text streamed by the answering attempt
+        self.winner = None
+        self.future = None  # the arun() task, when the request runs on the AsyncEngine
+        self.stream_pool = None  # the pool attempts stream on with run(), set by the RequestScheduler
+
+    def cancel(self):
+        """Stops the request from any thread: closes its response streams and ends the retry loop."""
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+            return
+        for attempt in list(self.attempts):
+            attempt.cancel()
+        self.events.put(("cancelled", None, None))
+
+    def stop(self, parts):
+        """Reports a cancelled request with the text received so far."""
+        meta = self.answer_meta(self.winner) if parts and self.winner else {}
+        self.signals.cancelled.emit(self.session_id, "".join(parts), meta)
+
+    @tracer.traced(category="network")
+    def prepare(self):
+        """Captures the provider settings and a snapshot of the conversation; called on the UI thread just before
+        the worker starts, so run() never reads state the UI thread may be changing."""
+        self.provider = self.api_config_manager.get_active_provider()
+        self.fallback_config = self.api_config_manager.config.get("fallback") or {}
+        retry_config = self.api_config_manager.config.get("retry", {})
+        rate_limits = self.api_config_manager.config.get("rate_limits") or {}
+        self.retry_policy = RetryPolicy(retry_config)
+        # The session's cache state is only touched by its single in-flight request
+        self.prompt_cache = self.chat_session_manager.prompt_cache(self.session_id)
+        self.attempts = []
+        dropped = 0
+        for provider in self.api_config_manager.provider_chain(self.session_id):
+            provider_config = dict(self.api_config_manager.get_provider_config(provider))
+            system_prompt = provider_config.get("system_prompt", "You are a helpful assistant.")
+            # Only the active provider's context window is remembered between requests
+            primary = provider == self.provider
+            history, start = self.chat_session_manager.get_context_history(
+                self.session_id, provider, provider_config, system_prompt, keep_window=primary)
+            if primary:
+                dropped = start
+            # Convert conversation history to the format required by the provider
+            converted_history = self.chat_session_manager.convert_conversation_history(
+                history, provider, system_prompt, self.session_id)
+            model = provider_config.get("ollama_model") or provider_config.get("model", "")
+            self.attempts.append(ProviderAttempt(self.session_id, provider, provider_config, history,
+                                                 converted_history, self.prompt_cache,
+                                                 circuit_breakers.get(provider, retry_config),
+                                                 rate_limiters.get(provider, model, rate_limits)))
+        self.hedge = self.fallback_config.get("hedge", True)
+        self.signals.context_trimmed.emit(self.session_id, dropped)
+
+    def answer_meta(self, attempt):
+        """Returns the message metadata naming the provider and model that answered."""
+        meta = {"provider": attempt.provider,
+                "model": attempt.provider_config.get("ollama_model") or attempt.provider_config.get("model", "")}
+        if attempt.provider != self.provider:
+            meta["fallback_from"] = self.provider
+        return meta
+
+    def cache_key(self, attempt):
+        """Returns the response cache key of an attempt's request, or None if the cache does not apply."""
+        temperature = attempt.provider_config.get("temperature", 0.7)
+        if not (self.response_cache and self.response_cache.applies(temperature, self.cache_mode)):
+            return None
+        model = attempt.provider_config.get("ollama_model") or attempt.provider_config.get("model", "")
+        return self.response_cache.key(attempt.provider, model, temperature, attempt.system_prompt,
+                                       attempt.converted_history)
+
+    def hedge_delay(self, attempt):
+        """Seconds to wait for an attempt's first token before asking the next provider as well."""
+        latency = first_token_latency.percentile(attempt.provider, self.fallback_config.get("hedge_percentile", 95))
+        if latency is None:
+            return self.fallback_config.get("hedge_delay", 10.0)
+        return max(latency, self.fallback_config.get("min_hedge_delay", 1.0))
+
+    def begin(self):
+        """Answers from the response cache or starts the first provider; returns True if the request is over."""
+        self.began = time.monotonic()
+        self.parts, self.live, self.winner = [], [], None
+        self.next_attempt, self.hedge_at, self.retry_at = 0, None, None
+        if not self.attempts:
+            self.signals.error.emit(self.session_id, "Unsupported API provider")
+            return True
+        cache_key = self.cache_key(self.attempts[0])
+        response = self.response_cache.get(cache_key) if cache_key else None
+        if response is not None:
+            meta = self.answer_meta(self.attempts[0])
+            meta["metrics"] = {"cached": True, "queue_wait": round(self.began - self.submitted, 3),
+                               "total": round(time.monotonic() - self.submitted, 3)}
+            self.signals.chunk.emit(self.session_id, response)
+            self.signals.finished.emit(self.session_id, response, meta)
+            return True
+        if not self.start_next():
+            logging.error(f"API call failed: {self.last_error}")
+            self.signals.error.emit(self.session_id, str(self.last_error))
+            return True
+        return False
+
+    def start_next(self):
+        """Starts the next provider in the chain that is not paused by its circuit breaker; False if none is left."""
+        while self.next_attempt < len(self.attempts):
+            attempt = self.attempts[self.next_attempt]
+            self.next_attempt += 1
+            if self.start_attempt(attempt):
+                return True
+        return False
+
+    def start_attempt(self, attempt):
+        """Starts a try of one provider; returns False if its circuit breaker is open."""
+        if not attempt.breaker.allow():
+            self.last_error = CircuitOpenError(f"{attempt.provider} is failing; requests are paused for "
+                                               f"{attempt.breaker.remaining():.0f} more seconds")
+            return False
+        attempt.begin()
+        if attempt.wait:
+            self.signals.rate_limited.emit(self.session_id, attempt.provider, attempt.wait)
+        self.live.append(attempt)
+        self.hedge_at = None
+        if self.hedge and self.winner is None and self.next_attempt < len(self.attempts):
+            self.hedge_at = attempt.started + self.hedge_delay(attempt)
+        self.launch(attempt)
+        return True
+
+    def next_timeout(self):
+        """Returns the seconds until the next hedge or retry is due, or None if none is scheduled."""
+        deadlines = [deadline for deadline in (self.hedge_at, self.retry_at and self.retry_at[0]) if deadline]
+        return max(min(deadlines) - time.monotonic(), 0) if deadlines else None
+
+    def handle_timeout(self):
+        """Starts the retry or hedge that is due; returns True if the request has failed."""
+        now = time.monotonic()
+        if self.retry_at and self.retry_at[0] <= now:
+            attempt = self.retry_at[1]
+            self.retry_at = None
+            if not self.start_attempt(attempt):
+                logging.error(f"API call failed: {self.last_error}")
+                self.signals.error.emit(self.session_id, str(self.last_error))
+                return True
+        if self.hedge_at and self.hedge_at <= now:
+            self.hedge_at = None
+            self.start_next()
+        return False
+
+    def handle(self, kind, attempt, value):
+        """Applies an event from an attempt's stream; returns True once the request is over."""
+        if kind == "cancelled":
+            self.stop(self.parts)
+            return True
+        if attempt not in self.live:
+            return False  # a cancelled attempt still winding down
+        if kind == "chunk":
+            if attempt.first_token is None:
+                attempt.first_token = time.monotonic()
+                first_token_latency.record(attempt.provider, attempt.first_token - attempt.started)
+                tracer.instant("first token", "network", provider=attempt.provider)
+            if self.winner is None:
+                self.win(attempt)
+            self.parts.append(value)
+            self.signals.chunk.emit(self.session_id, value)
+            return False
+        if kind == "done":
+            if self.winner is None:
+                self.win(attempt)  # an empty response
+            self.live.remove(attempt)
+            self.complete(attempt)
+            return True
+        self.live.remove(attempt)
+        return self.fail(attempt, value)
+
+    def win(self, attempt):
+        """Makes the attempt the one that answers, cancelling the others."""
+        self.winner = attempt
+        self.hedge_at = None
+        for other in self.live:
+            if other is not attempt:
+                other.cancel()
+        self.live = [attempt]
 
+    def complete(self, attempt):
+        response = "".join(self.parts)
+        attempt.report()
+        attempt.settle(response)
+        if attempt.usage:
+            self.signals.cache_usage.emit(self.session_id, *attempt.usage)
+        cache_key = self.cache_key(attempt)
+        if cache_key:
+            self.response_cache.put(cache_key, response)
+        meta = self.answer_meta(attempt)
+        meta["metrics"] = self.metrics(attempt, response)
+        self.signals.finished.emit(self.session_id, response, meta)
+
+    def metrics(self, attempt, response):
+        """Returns the timings (seconds) and token counts of a finished request, stored with its message.
+
+        queue_wait runs from Send until the answering provider was sent the request (scheduler queue, concurrency
+        limit and rate limit); connect, ttft and duration run from then to the response opening, its first token
+        and its last; total runs from Send to the answer. tokens_per_second is the completion tokens over the
+        duration. Token counts the provider did not report are estimated.
+        """
+        now = time.monotonic()
+        prompt_tokens = attempt.usage[0] if attempt.usage else attempt.estimated_tokens
+        completion_tokens = attempt.completion_tokens or attempt.adapter.count_tokens(response)
+        duration = now - attempt.started
+        return {
+            "queue_wait": round(self.began - self.submitted + attempt.wait, 3),
+            "connect": round(attempt.connected_at - attempt.started, 3) if attempt.connected_at else None,
+            "ttft": round(attempt.first_token - attempt.started, 3) if attempt.first_token else None,
+            "duration": round(duration, 3),
+            "total": round(now - self.submitted, 3),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "tokens_estimated": not (attempt.usage and attempt.completion_tokens),
+            "tokens_per_second": round(completion_tokens / duration, 1) if duration > 0 else None,
+            "retries": sum(max(other.tries - 1, 0) for other in self.attempts),  # not hedges or failovers
+        }
+
+    def fail(self, attempt, error):
+        """Handles a failed try: leaves the request to the providers still streaming, fails over to the next one,
+        schedules a retry or reports the error. Returns True if the request has failed.
+
+        Only retryable errors (rate limits, overload, server and connection errors) count against the provider's
+        circuit breaker and are retried.
+        """
+        retryable, retry_after = classify_error(error)
+        attempt.report(retryable)
+        if retry_after and attempt.rate_limiter:
+            attempt.rate_limiter.hold(retry_after)
+        if self.winner is attempt:
+            self.winner = None
+            if self.parts:
+                # Discard the partial answer already shown before another provider or try answers
+                self.parts = []
+                self.signals.restarted.emit(self.session_id)
+        if self.live or self.start_next():
+            logging.error(f"{attempt.provider} failed, failing over: {error}")
+            return False
+        delay = self.retry_policy.delay(attempt.tries - 1, retry_after) if retryable else None
+        if delay is not None:
+            self.retry_at = (time.monotonic() + delay, attempt)
+            return False
+        logging.error(f"API call failed: {error}")
+        self.signals.error.emit(self.session_id, str(error))
+        return True
+
+    @tracer.traced(category="network")
     def run(self):
-        """Generates the AI response."""
-        max_retries = 3
-        retry_delay = 2
-        ai_message = ""
-        for attempt in range(max_retries):
+        """Generates the AI response on a pool thread, emitting a chunk signal for every piece of text received.
+
+        Each attempt streams on a thread of the stream pool and posts its text to self.events; this thread picks
+        the answer, cancels the others and starts hedges and retries when they are due.
+        """
+        if self.cancelled.is_set():
+            self.stop([])
+            return
+        self.launch = self.start_pooled
+        if self.stream_pool is None:
+            # Run without a scheduler: a stream thread for each provider in the chain
+            self.stream_pool = QThreadPool()
+            self.stream_pool.setMaxThreadCount(max(len(self.attempts), 1))
+        if self.begin():
+            return
+        while True:
             try:
-                provider = self.api_config_manager.get_active_provider()
-                provider_config = self.api_config_manager.get_provider_config(provider)
-                conversation_history = self.chat_session_manager.sessions[self.session_id]["conversation_history"]
-                system_prompt = provider_config.get("system_prompt", "You are a helpful assistant.")
-
-                # Convert conversation history to the format required by the selected provider
-                converted_history = self.chat_session_manager.convert_conversation_history(conversation_history, provider, system_prompt)
-
-                if provider == "Google Gemini":
-                    genai.configure(api_key=provider_config.get("api_key", ""))
-                    model = genai.GenerativeModel(provider_config.get("model", "gemini-pro"))
-                    response = model.generate_content(converted_history)
-                    ai_message = response.text
-
-                elif provider == "OpenAI":
-                    client = OpenAI(api_key=provider_config.get("api_key", ""))
-                    response = client.chat.completions.create(
-                        model=provider_config.get("model", "gpt-4"),
-                        messages=converted_history,
-                        temperature=0.7,
-                        max_tokens=10000
-                    )
-                    ai_message = response.choices[0].message.content
-
-                elif provider == "Anthropic Claude":
-                    client = anthropic.Anthropic(api_key=provider_config.get("api_key", ""))
-                    response = client.messages.create(
-                        model=provider_config.get("model", "claude-3-sonnet-20240229"),
-                        messages=converted_history,
-                        temperature=0.7,
-                        max_tokens=1000
-                    )
-                    ai_message = next(content.text for content in response.content if content.type == "text")
-
-                elif provider == "xAI Grok":
-                    url = "https://api.x.ai/v1/chat/completions"
-                    headers = {
-                        "Authorization": f"Bearer {provider_config.get('api_key', '')}",
-                        "Content-Type": "application/json"
-                    }
-                    data = {
-                        "model": "grok-2-1212",  # Updated model name
-                        "messages": converted_history,
-                        "temperature": 0.7,
-                        "max_tokens": 10000,
-                    }
-                    response = requests.post(url, headers=headers, json=data)
-                    if response.status_code != 200:
-                        if response.status_code == 429 and attempt < max_retries - 1:
-                            time.sleep(retry_delay)
-                            continue
-                        logging.error(f"xAI API Error: {response.text}")
-                        raise Exception(f"API Error: {response.text}")
-                    ai_message = response.json()['choices'][0]['message']['content']
-
-                elif provider == "Ollama":
-                    process = subprocess.Popen(
-                        ["ollama", "run", provider_config.get("ollama_model", "llama2")],
-                        stdin=subprocess.PIPE,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True
-                    )
-                    stdout, stderr = process.communicate(input=self.user_message)
-                    if stderr:
-                        raise Exception(stderr)
-                    ai_message = stdout
+                event = self.events.get(timeout=self.next_timeout())
+            except queue.Empty:
+                if self.handle_timeout():
+                    return
+                continue
+            if self.handle(*event):
+                return
 
-                else:
-                    raise Exception("Unsupported API provider")
-                self.finished.emit(ai_message)
+    def start_pooled(self, attempt):
+        self.stream_pool.start(lambda: self.stream_attempt(attempt))
+
+    def stream_attempt(self, attempt):
+        if attempt.cancelled.is_set():
+            attempt.release()  # cancelled while waiting for a pool thread
+            return
+        if attempt.wait:
+            with tracer.span("rate limit wait", "network", provider=attempt.provider, seconds=attempt.wait):
+                cancelled = attempt.cancelled.wait(attempt.wait)
+            if cancelled:
+                attempt.release()
                 return
+        with tracer.span("stream", "network", provider=attempt.provider, attempt=attempt.tries):
+            try:
+                for text in attempt.adapter.stream(attempt, attempt.provider_config, attempt.converted_history):
+                    if attempt.cancelled.is_set():
+                        return
+                    if text:
+                        self.events.put(("chunk", attempt, text))
+                if not attempt.cancelled.is_set():
+                    self.events.put(("done", attempt, None))
             except Exception as e:
-                if attempt < max_retries - 1:
-                    time.sleep(retry_delay)
-                else:
-                    logging.error(f"API call failed: {e}")
-                    self.error.emit(str(e))
+                # Closing the stream of a cancelled attempt makes the read fail
+                if not attempt.cancelled.is_set():
+                    self.events.put(("error", attempt, e))
+
+    @tracer.traced(category="network")
+    async def arun(self):
+        """Generates the AI response as a coroutine on the AsyncEngine loop; the same steps as run(), with each
+        attempt streaming in a task of its own."""
+        events = asyncio.Queue()
+        self.launch = lambda attempt: self.start_task(attempt, events)
+        try:
+            if self.begin():
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), self.next_timeout())
+                except asyncio.TimeoutError:
+                    if self.handle_timeout():
+                        return
+                    continue
+                if self.handle(*event):
+                    return
+        except asyncio.CancelledError:
+            # Cancelling the tasks closes their streams (leaving their `async with`) wherever they were waiting
+            self.stop(self.parts)
+        finally:
+            for attempt in self.live:
+                attempt.cancel()
+
+    def start_task(self, attempt, events):
+        attempt.task = asyncio.get_running_loop().create_task(self.astream_attempt(attempt, events))
+
+    async def astream_attempt(self, attempt, events):
+        if attempt.wait:
+            try:
+                with tracer.span("rate limit wait", "network", provider=attempt.provider, seconds=attempt.wait):
+                    await asyncio.sleep(attempt.wait)
+            except asyncio.CancelledError:
+                attempt.release()
+                raise
+        with tracer.span("stream", "network", provider=attempt.provider, attempt=attempt.tries):
+            try:
+                async for text in attempt.adapter.astream(attempt, attempt.provider_config, attempt.converted_history):
+                    if text:
+                        events.put_nowait(("chunk", attempt, text))
+                events.put_nowait(("done", attempt, None))
+            except Exception as e:
+                events.put_nowait(("error", attempt, e))
+
+class RequestScheduler(QObject):
+    """Runs ApiWorkers on a bounded thread pool.
+
+    Requests for different sessions run concurrently (up to max_concurrent); requests for the same session run
+    one after another, so each one sees the answer to the previous. The provider streams of the requests (more than
+    one per request while hedging or failing over) share a second pool of max_concurrent threads.
+    """
+    in_flight_changed = pyqtSignal(str, bool)  # session id, whether it has requests running or queued
+
+    def __init__(self, max_concurrent=4, parent=None, engine=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_concurrent)
+        # A pool of its own, so streams never wait for a thread held by a request waiting on them
+        self.stream_pool = QThreadPool(self)
+        self.stream_pool.setMaxThreadCount(max_concurrent)
+        # With an AsyncEngine, requests run as coroutines on its loop thread instead of one pool thread each
+        self.engine = engine
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.running = {}  # {session_id: ApiWorker}
+        self.queued = {}  # {session_id: [ApiWorker]}
+
+    def submit(self, worker):
+        """Queues a request; connect to the worker's signals before submitting it."""
+        worker.signals.finished.connect(self.handle_done)
+        worker.signals.error.connect(self.handle_done)
+        worker.signals.cancelled.connect(self.handle_done)
+        if worker.session_id in self.running:
+            self.queued.setdefault(worker.session_id, []).append(worker)
+        else:
+            self.start(worker)
+            self.in_flight_changed.emit(worker.session_id, True)
+
+    def start(self, worker):
+        self.running[worker.session_id] = worker
+        worker.prepare()
+        if self.engine:
+            worker.future = self.engine.submit(self.run_async(worker))
+        else:
+            worker.stream_pool = self.stream_pool
+            self.pool.start(worker)
+
+    async def run_async(self, worker):
+        try:
+            async with self.slots:
+                await worker.arun()
+        except asyncio.CancelledError:
+            worker.stop([])  # cancelled while waiting for a slot or between retries
+
+    def cancel(self, session_id):
+        """Stops a session's running request and drops the ones queued behind it."""
+        self.queued.pop(session_id, None)
+        worker = self.running.get(session_id)
+        if worker is None:
+            return
+        if not self.engine and self.pool.tryTake(worker):
+            worker.stop([])  # still waiting for a pool thread
+        else:
+            worker.cancel()
+
+    def shutdown(self, timeout=2.0):
+        """Cancels every request and waits up to timeout seconds for them to stop."""
+        workers = list(self.running.values())
+        for session_id in list(self.running):
+            self.cancel(session_id)
+        if self.engine:
+            futures = [worker.future for worker in workers if worker.future is not None]
+            concurrent.futures.wait(futures, timeout)
+        else:
+            deadline = time.monotonic() + timeout
+            self.pool.waitForDone(int(timeout * 1000))
+            self.stream_pool.waitForDone(max(int((deadline - time.monotonic()) * 1000), 0))
+
+    def handle_done(self, session_id, *args):
+        self.running.pop(session_id, None)
+        queued = self.queued.get(session_id)
+        if queued:
+            self.start(queued.pop(0))
+        else:
+            self.queued.pop(session_id, None)
+            self.in_flight_changed.emit(session_id, False)
+
+    def is_busy(self, session_id):
+        return session_id in self.running
 
 class APIConfigDialog(QDialog):
     """Dialog for configuring API settings."""
@@ -299,7 +3216,7 @@ class APIConfigDialog(QDialog):
         layout = QVBoxLayout()
 
         self.provider_combo = QComboBox()
-        self.provider_combo.addItems(["Google Gemini", "OpenAI", "Anthropic Claude", "Ollama", "xAI Grok"])
+        self.provider_combo.addItems(list(PROVIDER_ADAPTERS))
         layout.addWidget(QLabel("API Provider:"))
         layout.addWidget(self.provider_combo)
 
@@ -338,25 +3255,24 @@ class APIConfigDialog(QDialog):
         self.update_fields()
 
     def update_ollama_models(self):
-        """Fetches Ollama models and updates the combo box."""
+        """Fetches the locally installed Ollama models and updates the combo box."""
         try:
-            process = subprocess.run(["ollama", "list"],
-                                   capture_output=True,
-                                   text=True,
-                                   check=True)
-
-            models = [line.split()[0] for line in process.stdout.strip().split("\n")
-                     if line.strip()]
+            provider_config = self.api_config_manager.get_provider_config("Ollama")
+            session = client_pool.get_client("Ollama", provider_config)
+            url = (provider_config.get("base_url") or OLLAMA_DEFAULT_URL).rstrip("/") + "/api/tags"
+            response = session.get(url, timeout=5)
+            response.raise_for_status()
+            models = [model["name"] for model in response.json().get("models", [])]
 
             self.ollama_model_combo.clear()
             self.ollama_model_combo.addItems(models)
 
             # Select currently configured model if it exists
-            current_model = self.api_config_manager.config.get("Ollama", {}).get("ollama_model")
+            current_model = provider_config.get("ollama_model")
             if current_model in models:
                 self.ollama_model_combo.setCurrentText(current_model)
 
-        except subprocess.CalledProcessError as e:
+        except requests.exceptions.RequestException as e:
             QMessageBox.warning(self, "Warning",
                               f"Failed to fetch Ollama models: {str(e)}")
         except Exception as e:
@@ -401,6 +3317,7 @@ class APIConfigDialog(QDialog):
         
         if provider == "Ollama":
             config["ollama_model"] = self.ollama_model_combo.currentText()
+            config["keep_alive"] = self.api_config_manager.get_provider_config("Ollama").get("keep_alive", "5m")
             
         self.api_config_manager.config[provider] = config
         self.api_config_manager.config["active_provider"] = provider
@@ -413,6 +3330,164 @@ class APIConfigDialog(QDialog):
         """Validates the xAI Grok base URL."""
         return url.startswith("https://api.x.ai")
 
+class FallbackConfigDialog(QDialog):
+    """Dialog for choosing the providers a request fails over to, in order, for all sessions or the current one."""
+    def __init__(self, api_config_manager, session_id=None, parent=None):
+        super().__init__(parent)
+        self.api_config_manager = api_config_manager
+        self.session_id = session_id
+        self.setWindowTitle("Fallback Providers")
+        self.setGeometry(300, 300, 400, 300)
+        layout = QVBoxLayout()
+
+        layout.addWidget(QLabel("Providers to try after the active one, in order (drag to reorder):"))
+        self.provider_list = QListWidget()
+        self.provider_list.setDragDropMode(QAbstractItemView.InternalMove)
+        layout.addWidget(self.provider_list)
+
+        self.session_only_checkbox = QCheckBox("Only for the current session")
+        sessions = (self.api_config_manager.config.get("fallback") or {}).get("sessions") or {}
+        self.session_only_checkbox.setChecked(session_id in sessions)
+        self.session_only_checkbox.setEnabled(session_id is not None)
+        self.session_only_checkbox.toggled.connect(self.update_providers)
+        layout.addWidget(self.session_only_checkbox)
+
+        self.hedge_checkbox = QCheckBox("Also ask the next provider when the first token is late")
+        self.hedge_checkbox.setChecked((self.api_config_manager.config.get("fallback") or {}).get("hedge", True))
+        layout.addWidget(self.hedge_checkbox)
+
+        self.save_button = QPushButton("Save")
+        self.save_button.clicked.connect(self.save_config)
+        layout.addWidget(self.save_button)
+
+        self.setLayout(layout)
+        self.update_providers()
+
+    def update_providers(self):
+        """Lists the chain being edited first, checked, followed by the other providers."""
+        session_id = self.session_id if self.session_only_checkbox.isChecked() else None
+        chain = self.api_config_manager.get_fallback_providers(session_id)
+        self.provider_list.clear()
+        for provider in chain + [provider for provider in PROVIDER_ADAPTERS if provider not in chain]:
+            item = QListWidgetItem(provider)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked if provider in chain else Qt.Unchecked)
+            self.provider_list.addItem(item)
+
+    def save_config(self):
+        """Saves the checked providers, in list order, as the fallback chain."""
+        providers = [self.provider_list.item(row).text() for row in range(self.provider_list.count())
+                     if self.provider_list.item(row).checkState() == Qt.Checked]
+        self.api_config_manager.config.setdefault("fallback", {})["hedge"] = self.hedge_checkbox.isChecked()
+        if self.session_only_checkbox.isChecked():
+            self.api_config_manager.set_fallback_providers(providers, self.session_id)
+        else:
+            if self.session_id is not None:
+                self.api_config_manager.set_fallback_providers(None, self.session_id)
+            self.api_config_manager.set_fallback_providers(providers)
+        self.accept()
+
+class MetricsLoaderSignals(QObject):
+    loaded = pyqtSignal(int, object)  # the load's number and the metadata of the responses with request metrics
+
+class MetricsLoader(QRunnable):
+    """Reads the request metrics of every saved session on a pool thread."""
+    def __init__(self, chat_session_manager, number):
+        super().__init__()
+        self.chat_session_manager = chat_session_manager
+        self.number = number
+        self.signals = MetricsLoaderSignals()
+
+    def run(self):
+        try:
+            metas = self.chat_session_manager.request_metrics()
+        except Exception as e:
+            logging.error(f"Error reading request metrics: {e}")
+            metas = []
+        self.signals.loaded.emit(self.number, metas)
+
+class MetricsDialog(QDialog):
+    """Dialog summarizing the request metrics of the current session or of all sessions, per provider and model.
+
+    Latencies and throughput are shown as p50 / p95; stopped responses are left out, and cache hits are only
+    counted.
+    """
+    columns = ["Provider / model", "Requests", "TTFT (s)", "Duration (s)", "Tokens/s", "Queue wait (s)",
+               "Connect (s)", "Retries", "Prompt / completion tokens"]
+
+    def __init__(self, chat_session_manager, session_id=None, parent=None):
+        super().__init__(parent)
+        self.chat_session_manager = chat_session_manager
+        self.setWindowTitle("Request Metrics")
+        self.setGeometry(200, 200, 900, 300)
+        layout = QVBoxLayout()
+
+        self.scope_combo = QComboBox()
+        if session_id is not None:
+            self.scope_combo.addItem("Current session", session_id)
+        self.scope_combo.addItem("All sessions", None)
+        self.scope_combo.currentIndexChanged.connect(self.update_table)
+        layout.addWidget(self.scope_combo)
+
+        self.table = QTableWidget(0, len(self.columns))
+        self.table.setHorizontalHeaderLabels(self.columns)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().hide()
+        layout.addWidget(self.table)
+
+        self.setLayout(layout)
+        self.loads = 0
+        self.update_table()
+
+    def update_table(self):
+        """Shows the current session's metrics at once; those of all sessions are read by a MetricsLoader."""
+        self.loads += 1
+        session_id = self.scope_combo.currentData()
+        if session_id is not None:
+            self.show_metrics(self.loads, self.chat_session_manager.request_metrics(session_id))
+            return
+        self.table.setRowCount(1)
+        self.table.setItem(0, 0, QTableWidgetItem("Loading..."))
+        loader = MetricsLoader(self.chat_session_manager, self.loads)
+        loader.signals.loaded.connect(self.show_metrics)
+        QThreadPool.globalInstance().start(loader)
+
+    def show_metrics(self, number, metas):
+        """Groups the responses in scope by provider and model, after a row for all of them; results of a load the
+        scope has changed since are dropped."""
+        if number != self.loads:
+            return
+        groups = {"All providers": []}
+        for meta in metas:
+            if meta.get("truncated"):
+                continue
+            groups["All providers"].append(meta["metrics"])
+            groups.setdefault(f"{meta.get('provider')} / {meta.get('model')}", []).append(meta["metrics"])
+        rows = [self.summary_row(name, metrics) for name, metrics in groups.items()]
+        self.table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                self.table.setItem(row, column, QTableWidgetItem(value))
+        self.table.resizeColumnsToContents()
+
+    @staticmethod
+    def summary_row(name, metrics):
+        requests = [m for m in metrics if not m.get("cached")]
+
+        def spread(key, digits=2):
+            values = [m[key] for m in requests if m.get(key) is not None]
+            if not values:
+                return "-"
+            return f"{percentile(values, 50):.{digits}f} / {percentile(values, 95):.{digits}f}"
+
+        cached = len(metrics) - len(requests)
+        retries = sum(m.get("retries", 0) for m in requests)
+        prompt_tokens = sum(m.get("prompt_tokens", 0) for m in requests)
+        completion_tokens = sum(m.get("completion_tokens", 0) for m in requests)
+        return [name, f"{len(requests)}" + (f" (+{cached} cached)" if cached else ""), spread("ttft"),
+                spread("duration"), spread("tokens_per_second", 1), spread("queue_wait"), spread("connect"),
+                str(retries), f"{prompt_tokens:,} / {completion_tokens:,}"]
+
 class MainWindow(QMainWindow):
     """Main application window."""
     def __init__(self):
@@ -432,18 +3507,35 @@ class MainWindow(QMainWindow):
         self.highlight_color = "#FF6F61"
         self.setStyleSheet(f"""
             QMainWindow {{ background-color: {self.right_bg};}}
-            QListWidget {{ background-color: {self.left_bg}; color: {self.left_text}; selection-background-color: {self.highlight_color}; selection-color: {self.left_text};}}
+            QListView#sessionList, QListWidget#searchResults {{ background-color: {self.left_bg}; color: {self.left_text}; selection-background-color: {self.highlight_color}; selection-color: {self.left_text};}}
             QLabel {{ color: {self.right_text}; }}
-            QTextBrowser {{ background-color: {self.right_bg}; color: {self.right_text}; }}
+            QListView#chatDisplay {{ background-color: {self.right_bg}; color: {self.right_text}; border: none; }}
             QTextEdit {{ background-color: {self.right_bg}; color: {self.right_text}; }}
             QPushButton {{ background-color: {self.button_bg}; color: {self.button_text}; }}
         """)
 
         # Initialize API Config Manager and Chat Session Manager
         self.api_config_manager = APIConfigManager()
-        self.chat_session_manager = ChatSessionManager()
+        self.chat_session_manager = ChatSessionManager(create_session_store(self.api_config_manager.config),
+                                                       search_index=create_search_index(self.api_config_manager.config))
+        self.response_cache = create_response_cache(self.api_config_manager.config)
         self.current_session_id = None
 
+        # The session the transcript model currently shows
+        self.rendered_session_id = None
+
+        # Requests run concurrently across sessions
+        config = self.api_config_manager.config
+        self.request_scheduler = RequestScheduler(config.get("max_concurrent_requests", 4), self,
+                                                  async_engine if config.get("request_engine", "async") == "async" else None)
+
+        # Streaming state of the responses being received: {session_id: {"parts": [], "pending": [], "timestamp": ""}};
+        # only the current session's pending chunks are flushed to the display
+        self.streams = {}
+        self.stream_timer = QTimer(self)
+        self.stream_timer.setInterval(50)
+        self.stream_timer.timeout.connect(self.flush_pending_chunks)
+
         # Initialize UI Elements
         self.create_menu_bar()
         self.create_main_layout()
@@ -452,11 +3544,7 @@ class MainWindow(QMainWindow):
             self.new_session()
         else:
             try:
-                sessions = sorted(
-                    self.chat_session_manager.sessions.items(),
-                    key=lambda x: os.path.getmtime(os.path.join("chat_logs", f"{x[0]}.json")),
-                    reverse=True
-                )
+                sessions = self.chat_session_manager.list_sessions(limit=1)
                 if sessions:
                     self.load_session(sessions[0][0])
             except Exception as e:
@@ -464,24 +3552,28 @@ class MainWindow(QMainWindow):
         self.initialize_api()
         self.update_api_label()
 
-        # Initialize Message Manager
-        self.initialize_message_manager()
-
-    def initialize_message_manager(self):
-        """Initializes the message manager."""
-        self.message_manager = MessageManager(self.chat_display)
 
     def create_menu_bar(self):
         """Creates the menu bar."""
         menu_bar = self.menuBar()
         file_menu = menu_bar.addMenu("File")
         file_menu.addAction("New Session", self.new_session)
+        file_menu.addAction("Rename Session", self.rename_session)
         file_menu.addAction("Export Chat", self.export_chat)
+        file_menu.addAction("Import JSON Sessions", self.import_json_sessions)
         file_menu.addSeparator()
         file_menu.addAction("Exit", self.close)
 
         settings_menu = menu_bar.addMenu("Settings")
         settings_menu.addAction("API Configuration", self.show_api_config)
+        settings_menu.addAction("Fallback Providers", self.show_fallback_config)
+        settings_menu.addAction("Request Metrics", self.show_request_metrics)
+        trace_action = settings_menu.addAction("Trace Performance")
+        trace_action.setCheckable(True)
+        trace_action.setChecked(tracer.enabled)
+        trace_action.toggled.connect(self.toggle_tracing)
+        settings_menu.addAction("Response Cache Statistics", self.show_response_cache_statistics)
+        settings_menu.addAction("Clear Response Cache", self.clear_response_cache)
 
     def create_main_layout(self):
         """Creates the main layout."""
@@ -495,14 +3587,30 @@ class MainWindow(QMainWindow):
         session_layout = QVBoxLayout(self.session_frame)
         self.session_label = QLabel("Sessions")
         self.session_label.setStyleSheet(f"color: {self.left_text}; font-weight: bold;")
-        self.session_list_widget = QListWidget()
-        self.session_list_widget.itemDoubleClicked.connect(self.load_selected_session)
-        self.session_list_widget.currentItemChanged.connect(self.handle_session_selection)
+        self.session_list_model = SessionListModel(self.chat_session_manager, self)
+        self.request_scheduler.in_flight_changed.connect(self.session_list_model.set_in_flight)
+        self.session_list_widget = QListView()
+        self.session_list_widget.setObjectName("sessionList")
+        self.session_list_widget.setModel(self.session_list_model)
+        self.session_list_widget.setUniformItemSizes(True)
+        self.session_list_widget.doubleClicked.connect(self.load_selected_session)
+        self.session_list_widget.selectionModel().currentChanged.connect(self.handle_session_selection)
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search messages...")
+        self.search_input.setStyleSheet(f"color: {self.left_text};")
+        self.search_input.returnPressed.connect(self.search_messages)
+        self.search_results = QListWidget()
+        self.search_results.setObjectName("searchResults")
+        self.search_results.itemActivated.connect(self.open_search_result)
+        self.search_results.itemClicked.connect(self.open_search_result)
+        self.search_results.hide()
         self.new_session_button = QPushButton("New Session")
         self.new_session_button.clicked.connect(self.new_session)
         self.delete_session_button = QPushButton("Delete Session")
         self.delete_session_button.clicked.connect(self.delete_session)
         session_layout.addWidget(self.session_label)
+        session_layout.addWidget(self.search_input)
+        session_layout.addWidget(self.search_results)
         session_layout.addWidget(self.session_list_widget)
         session_layout.addWidget(self.new_session_button)
         session_layout.addWidget(self.delete_session_button)
@@ -514,8 +3622,27 @@ class MainWindow(QMainWindow):
         chat_layout = QVBoxLayout(self.chat_frame)
         self.api_label = QLabel("Current API: None")
         self.api_label.setStyleSheet(f"color: {self.right_text}; font-style: italic;")
-        self.chat_display = QTextBrowser()
-        self.chat_display.setOpenExternalLinks(True)
+        self.context_label = QLabel()
+        self.context_label.setStyleSheet(f"color: {self.right_text}; font-style: italic;")
+        self.context_label.hide()
+        self.message_manager = MessageManager()
+        self.transcript_model = TranscriptModel(parent=self)
+        self.chat_display = QListView()
+        self.chat_display.setObjectName("chatDisplay")
+        self.chat_display.setModel(self.transcript_model)
+        self.message_delegate = MessageDelegate(self.message_manager, {
+            "You": self.user_msg_bg, "AI": self.ai_msg_bg, "System": self.right_bg,
+            "highlight": self.highlight_color
+        }, self.chat_display)
+        self.chat_display.setItemDelegate(self.message_delegate)
+        self.chat_display.setResizeMode(QListView.Adjust)
+        self.chat_display.setLayoutMode(QListView.Batched)
+        self.chat_display.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.chat_display.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.chat_display.setWordWrap(True)
+        self.chat_display.verticalScrollBar().valueChanged.connect(self.handle_chat_scroll)
+        self.chat_display.doubleClicked.connect(self.handle_message_activated)
+        QShortcut(QKeySequence.Copy, self.chat_display, self.copy_selected_messages)
         self.message_input = QTextEdit()
         self.message_input.setFixedHeight(70)
         self.message_input.keyPressEvent = self.handle_key_press
@@ -533,21 +3660,33 @@ class MainWindow(QMainWindow):
             }}
         """
         self.send_button = QPushButton("Send")
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.setEnabled(False)
         self.attach_button = QPushButton("Attach File")
         self.emoji_button = QPushButton("😊 Emoji")
-        for button in [self.send_button, self.attach_button, self.emoji_button]:
+        for button in [self.send_button, self.stop_button, self.attach_button, self.emoji_button]:
             button.setStyleSheet(button_style)
+        # Per-request use of the response cache: auto only reuses answers at temperature 0
+        self.cache_mode_input = QComboBox()
+        for label, mode in [("Cache: auto", "default"), ("Cache: bypass", "bypass"), ("Cache: force", "force")]:
+            self.cache_mode_input.addItem(label, mode)
+        self.cache_mode_input.setVisible(self.response_cache is not None)
         button_layout = QHBoxLayout()
         button_layout.addWidget(self.send_button)
+        button_layout.addWidget(self.stop_button)
         button_layout.addWidget(self.attach_button)
         button_layout.addWidget(self.emoji_button)
+        button_layout.addWidget(self.cache_mode_input)
         button_layout.setSpacing(10)
         chat_layout.addWidget(self.api_label)
+        chat_layout.addWidget(self.context_label)
         chat_layout.addWidget(self.chat_display)
         chat_layout.addWidget(self.message_input)
         chat_layout.addLayout(button_layout)
         main_layout.addWidget(self.chat_frame, 3)
         self.send_button.clicked.connect(self.send_message)
+        self.stop_button.clicked.connect(self.stop_request)
+        self.request_scheduler.in_flight_changed.connect(self.update_stop_button)
         self.attach_button.clicked.connect(self.attach_file)
         self.emoji_button.clicked.connect(self.insert_emoji)
 
@@ -634,6 +3773,52 @@ class MainWindow(QMainWindow):
         self.initialize_api()
         self.update_api_label()
 
+    def show_fallback_config(self):
+        """Opens the fallback chain window for all sessions or the current one."""
+        dialog = FallbackConfigDialog(self.api_config_manager, self.current_session_id, self)
+        dialog.exec_()
+
+    def show_request_metrics(self):
+        """Opens the request metrics summary."""
+        dialog = MetricsDialog(self.chat_session_manager, self.current_session_id, self)
+        dialog.exec_()
+
+    def toggle_tracing(self, enabled):
+        """Starts recording trace spans, or stops and saves them as a Chrome trace."""
+        if enabled:
+            tracer.start()
+            self.statusBar().showMessage("Tracing started", 3000)
+            return
+        tracer.stop()
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Trace", "mychat-trace.json",
+                                                   "Trace Files (*.json);;All Files (*)")
+        if file_path:
+            try:
+                tracer.export(file_path)
+                self.statusBar().showMessage(f"Trace saved to {file_path}; open it in chrome://tracing or Perfetto", 5000)
+            except Exception as e:
+                logging.error(f"Failed to save trace: {e}")
+                QMessageBox.critical(self, "Error", f"Failed to save trace: {str(e)}")
+
+    def show_response_cache_statistics(self):
+        """Shows the response cache hit/miss statistics."""
+        if not self.response_cache:
+            QMessageBox.information(self, "Response Cache", "The response cache is disabled. Set response_cache: {enabled: true} in config.yaml to enable it.")
+            return
+        stats = self.response_cache.statistics()
+        QMessageBox.information(self, "Response Cache",
+            f"Entries: {stats['entries']} ({stats['bytes'] / 1024:.1f} KB)\n"
+            f"Hits: {stats['memory_hits']} in memory, {stats['disk_hits']} on disk\n"
+            f"Misses: {stats['misses']}\n"
+            f"Hit rate: {stats['hit_rate']:.0%}\n"
+            f"Stored: {stats['stores']}, evicted: {stats['evictions']}")
+
+    def clear_response_cache(self):
+        """Deletes every cached response."""
+        if self.response_cache:
+            self.response_cache.clear()
+            QMessageBox.information(self, "Response Cache", "Response cache cleared.")
+
     def initialize_api(self):
         """Initializes the API based on the active provider."""
         provider = self.api_config_manager.get_active_provider()
@@ -641,26 +3826,27 @@ class MainWindow(QMainWindow):
             return
         provider_config = self.api_config_manager.get_provider_config(provider)
         try:
-            if provider == "Google Gemini":
-                genai.configure(api_key=provider_config.get("api_key", ""))
-                self.model_instance = genai.GenerativeModel(provider_config.get("model", "gemini-pro"))
-            elif provider in ["OpenAI", "OpenAI Compatible"]:
-                self.openai_client = OpenAI(api_key=provider_config.get("api_key", ""))
-                if provider == "OpenAI Compatible":
-                    self.openai_client.base_url = provider_config.get("base_url", "")
-            elif provider == "Anthropic Claude":
-                self.anthropic_client = anthropic.Anthropic(api_key=provider_config.get("api_key", ""))
-            elif provider == "xAI Grok":
-                url = provider_config.get("base_url", "")
-                if url and "https://api.x.ai" not in url:
-                    QMessageBox.critical(self, "Error", "Grok Base URL must point to https://api.x.ai.")
-                    return
-            elif provider == "Ollama":
-                self.ollama_model_name = provider_config.get("ollama_model", "llama2")
-                self.ollama_command = ["ollama", "run", self.ollama_model_name]
+            adapter = get_adapter(provider)
+            error = adapter.validate(provider_config)
+            if error:
+                QMessageBox.critical(self, "Error", error)
+                return
+            # Warm the shared client pool so the first message does not pay for client construction
+            adapter.warm(provider_config)
         except Exception as e:
             QMessageBox.critical(self, "API Initialization Error", str(e))
 
+    def closeEvent(self, event):
+        """Stops in-flight requests before the window closes, keeping their partial responses."""
+        self.request_scheduler.shutdown()
+        QApplication.processEvents()  # deliver the cancelled signals, which commit and save the partial text
+        if tracer.enabled and tracer.path:
+            try:
+                tracer.export(tracer.path)
+            except Exception as e:
+                logging.error(f"Failed to write trace to {tracer.path}: {e}")
+        super().closeEvent(event)
+
     def update_api_label(self):
         """Updates the API label in the chat window."""
         provider = self.api_config_manager.get_active_provider()
@@ -696,14 +3882,28 @@ class MainWindow(QMainWindow):
         self.update_chat_display()
         QMessageBox.information(self, "New Session", f"Session '{session_name}' created.")
 
+    def rename_session(self):
+        """Renames the current chat session."""
+        if not self.current_session_id:
+            QMessageBox.warning(self, "Error", "Please select a session to rename.")
+            return
+        current_name = self.chat_session_manager.sessions[self.current_session_id]["session_name"]
+        session_name, ok = QInputDialog.getText(self, "Rename Session", "Session name:", text=current_name)
+        if ok and session_name.strip():
+            self.chat_session_manager.rename_session(self.current_session_id, session_name.strip())
+            self.chat_session_manager.save_session(self.current_session_id)
+            self.update_session_list()
+
     def delete_session(self):
         """Deletes the selected chat session."""
-        selected_item = self.session_list_widget.currentItem()
-        if not selected_item:
+        selected_index = self.session_list_widget.currentIndex()
+        if not selected_index.isValid():
             QMessageBox.warning(self, "Error", "Please select a session to delete.")
             return
-        session_id = selected_item.data(Qt.UserRole)
+        session_id = selected_index.data(Qt.UserRole)
+        self.session_list_widget.setCurrentIndex(QModelIndex())
         self.chat_session_manager.delete_session(session_id)
+        self.api_config_manager.set_fallback_providers(None, session_id)
         self.current_session_id = None
         self.update_session_list()
         self.update_chat_display()
@@ -727,99 +3927,259 @@ class MainWindow(QMainWindow):
        self.start_api_worker(message)
 
     def start_api_worker(self, user_message):
-        """Starts a new API worker thread to handle the AI request."""
-        self.api_worker = ApiWorker(self.current_session_id, user_message, self, self.api_config_manager, self.chat_session_manager)
-        self.api_worker.finished.connect(self.handle_ai_response)
-        self.api_worker.error.connect(self.handle_api_error)
-        self.api_worker.start()
-
-    def handle_ai_response(self, ai_message):
-        """Handles the AI's response and updates the chat display."""
+        """Schedules the AI request for the current session."""
+        session_id = self.current_session_id
+        self.reset_streaming_state(session_id)
+        worker = ApiWorker(session_id, user_message, self.api_config_manager, self.chat_session_manager,
+                           self.response_cache, self.cache_mode_input.currentData())
+        worker.signals.chunk.connect(self.handle_ai_chunk)
+        worker.signals.restarted.connect(self.handle_stream_restart)
+        worker.signals.finished.connect(self.handle_ai_response)
+        worker.signals.error.connect(self.handle_api_error)
+        worker.signals.cancelled.connect(self.handle_ai_cancelled)
+        worker.signals.context_trimmed.connect(self.handle_context_trimmed)
+        worker.signals.cache_usage.connect(self.handle_cache_usage)
+        worker.signals.rate_limited.connect(self.handle_rate_limited)
+        self.request_scheduler.submit(worker)
+
+    def handle_context_trimmed(self, session_id, dropped):
+        """Shows how many earlier messages were left out to fit the model's context window."""
+        if session_id != self.current_session_id:
+            return
+        if dropped:
+            self.context_label.setText(f"{dropped} earlier messages not sent (context window limit)")
+            self.context_label.show()
+        else:
+            self.context_label.hide()
+
+    def handle_cache_usage(self, session_id, input_tokens, cached_tokens):
+        """Records and shows how much of the last request's input the provider served from its prompt cache."""
+        self.chat_session_manager.record_cache_usage(session_id, input_tokens, cached_tokens)
+        prompt_cache = self.chat_session_manager.prompt_cache(session_id)
+        session_rate = prompt_cache["cached_tokens"] / max(prompt_cache["input_tokens"], 1)
+        self.statusBar().showMessage(
+            f"Prompt cache: {cached_tokens:,} of {input_tokens:,} input tokens cached ({session_rate:.0%} this session)")
+
+    def handle_rate_limited(self, session_id, provider, seconds):
+        """Shows how long the current session's request waits for the provider's rate limit."""
+        if session_id == self.current_session_id:
+            self.statusBar().showMessage(f"Waiting {seconds:.1f}s for the {provider} rate limit",
+                                         int(seconds * 1000) + 2000)
+
+    def reset_streaming_state(self, session_id):
+        """Forgets a session's partially streamed response."""
+        self.streams.pop(session_id, None)
+        if session_id == self.rendered_session_id:
+            self.stream_timer.stop()
+            self.transcript_model.clear_streaming()
+
+    def handle_ai_chunk(self, session_id, chunk):
+        """Queues a streamed chunk; the current session's chunks are flushed to the display on a short timer."""
+        if session_id not in self.streams:
+            self.streams[session_id] = {"parts": [], "pending": [],
+                                        "timestamp": datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")}
+        self.streams[session_id]["pending"].append(chunk)
+        if session_id == self.rendered_session_id and not self.stream_timer.isActive():
+            self.stream_timer.start()
+
+    @tracer.traced(category="ui")
+    def flush_pending_chunks(self):
+        """Updates the streaming row of the transcript with the current session's queued chunks."""
+        stream = self.streams.get(self.rendered_session_id)
+        if not stream or not stream["pending"]:
+            self.stream_timer.stop()
+            return
+        stream["parts"].append("".join(stream["pending"]))
+        stream["pending"] = []
+        at_bottom = self.chat_display.verticalScrollBar().value() == self.chat_display.verticalScrollBar().maximum()
+        self.transcript_model.set_streaming("AI", "".join(stream["parts"]), stream["timestamp"])
+        if at_bottom:
+            self.chat_display.scrollToBottom()
+
+    def handle_stream_restart(self, session_id):
+        """Drops the partial response shown before the worker retries the request."""
+        self.reset_streaming_state(session_id)
+
+    def handle_ai_response(self, session_id, ai_message, meta=None):
+        """Commits the complete AI response to the session that asked for it."""
+        self.reset_streaming_state(session_id)
         timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-        provider = self.api_config_manager.get_active_provider()
-        self.chat_session_manager.add_message(self.current_session_id, "AI", ai_message, timestamp, provider)
-        self.update_chat_display()
+        # The provider that answered, which is not the active one after a failover
+        provider = (meta or {}).get("provider") or self.api_config_manager.get_active_provider()
+        self.chat_session_manager.add_message(session_id, "AI", ai_message, timestamp, provider, meta=meta)
+        self.chat_session_manager.save_session(session_id)
+        if session_id == self.current_session_id:
+            self.update_chat_display()
+
+    def update_stop_button(self, *args):
+        """Enables Stop while the current session has a request in flight."""
+        self.stop_button.setEnabled(self.request_scheduler.is_busy(self.current_session_id))
+
+    def stop_request(self):
+        """Stops the current session's response, keeping what has arrived so far."""
+        if self.current_session_id:
+            self.request_scheduler.cancel(self.current_session_id)
+
+    def handle_ai_cancelled(self, session_id, partial_message, meta=None):
+        """Commits the part of a stopped response that was received, marked as truncated."""
+        self.reset_streaming_state(session_id)
+        if partial_message and session_id in self.chat_session_manager.sessions:
+            self.handle_ai_response(session_id, partial_message, dict(meta or {}, truncated=True))
 
-    def handle_api_error(self, error_message):
+    def handle_api_error(self, session_id, error_message):
         """Handles API errors and displays error messages."""
-        QMessageBox.critical(self, "API Error", error_message)
+        self.reset_streaming_state(session_id)
+        session = self.chat_session_manager.sessions.get(session_id)
+        session_name = session["session_name"] if session else session_id
+        QMessageBox.critical(self, "API Error", f"{session_name}: {error_message}")
 
+    @tracer.traced(category="ui")
     def update_session_list(self):
-        """Updates the list of sessions in the left panel."""
-        current_selection = self.session_list_widget.currentItem()
-        current_session_id = current_selection.data(Qt.UserRole) if current_selection else None
-        
-        self.session_list_widget.clear()
-        
+        """Selects the current session in the left panel; the list itself follows the session manager."""
+        row = self.session_list_model.row_of(self.current_session_id)
+        if row is None:
+            self.session_list_widget.setCurrentIndex(QModelIndex())
+        elif self.session_list_widget.currentIndex().row() != row:
+            self.session_list_widget.setCurrentIndex(self.session_list_model.index(row))
+
+    def import_json_sessions(self):
+        """Imports the sessions stored as chat_logs/*.json into the SQLite session store."""
+        if not isinstance(self.chat_session_manager.store, SQLiteSessionStore):
+            QMessageBox.warning(self, "Warning", "Set session_store: sqlite in config.yaml to import JSON sessions.")
+            return
         try:
-            sessions = sorted(
-                self.chat_session_manager.sessions.items(),
-                key=lambda x: os.path.getmtime(os.path.join("chat_logs", f"{x[0]}.json")),
-                reverse=True
-            )
-            
-            for session_id, session_data in sessions:
-                item = QListWidgetItem(session_data["session_name"])
-                item.setData(Qt.UserRole, session_id)
-                self.session_list_widget.addItem(item)
-                
-                # Restore selection if applicable
-                if session_id == current_session_id:
-                    self.session_list_widget.setCurrentItem(item)
-                
-        except OSError as e:
-            logging.error(f"Error updating session list: {e}")
-            QMessageBox.warning(self, "Warning", "Error updating session list")
+            count = ChatSessionManager(JournalSessionStore()).export_sessions(self.chat_session_manager.store)
+            self.chat_session_manager.load_sessions()
+            self.update_session_list()
+            QMessageBox.information(self, "Import", f"Imported {count} sessions.")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to import sessions: {str(e)}")
+
+    def search_messages(self):
+        """Lists the messages, session names and attachments matching the search box, best first."""
+        query = self.search_input.text().strip()
+        self.search_results.clear()
+        if not query:
+            self.search_results.hide()
+            return
+        try:
+            matches, truncated = self.chat_session_manager.search(query)
+        except sqlite3.Error as e:
+            logging.error(f"Search failed for {query!r}: {e}")
+            QMessageBox.warning(self, "Search", f"Invalid search: {str(e)}")
+            return
+        for session_id, kind, message_index, snippet in matches:
+            session_name = self.chat_session_manager.sessions[session_id]["session_name"]
+            label = snippet if kind == "message" else f"{kind.capitalize()}: {snippet}"
+            item = QListWidgetItem(f"{session_name}\n{label}")
+            item.setData(Qt.UserRole, (session_id, message_index))
+            self.search_results.addItem(item)
+        if not matches:
+            self.search_results.addItem("No matches")
+        if truncated:
+            self.search_results.addItem(f"Only the newest {self.chat_session_manager.search_index.rank_window} matches "
+                                        "were ranked; refine the search to find older messages.")
+        self.search_results.show()
+
+    def open_search_result(self, item):
+        """Opens the session of a search result and scrolls to the matching message."""
+        result = item.data(Qt.UserRole)
+        if not result:
+            return
+        session_id, message_index = result
+        self.load_session(session_id)
+        self.update_session_list()
+        if message_index is not None:
+            row = self.transcript_model.ensure_loaded(message_index)
+            index = self.transcript_model.index(row)
+            self.chat_display.setCurrentIndex(index)
+            self.chat_display.scrollTo(index, QAbstractItemView.PositionAtCenter)
 
     def handle_session_selection(self, current, previous):
         """Handles session selection changes."""
-        if current:
+        if current.isValid():
             session_id = current.data(Qt.UserRole)
-            self.load_session(session_id)
+            if session_id != self.current_session_id:
+                self.load_session(session_id)
 
+    @tracer.traced(category="ui")
     def load_session(self, session_id):
         """Loads a session by ID."""
         if session_id in self.chat_session_manager.sessions:
             self.current_session_id = session_id
-            self.initialize_message_manager()  # Reinitialize message manager
             self.update_chat_display()
 
-    def load_selected_session(self, item):
+    def load_selected_session(self, index):
         """Handles double-click on session items."""
-        if item:
-            session_id = item.data(Qt.UserRole)
+        if index.isValid():
+            session_id = index.data(Qt.UserRole)
             self.load_session(session_id)
 
-    def update_chat_display(self):
-        """Updates the chat display with the latest messages."""
-        self.chat_display.clear()
-
-        if not self.current_session_id:
-            return
+    @tracer.traced(category="ui")
+    def update_chat_display(self, full=False):
+        """Updates the transcript, exposing only the messages added since the last update.
 
+        The model is reset only when the session changes (or `full` is set); it then shows the newest page of
+        messages and older pages are fetched as the user scrolls up.
+        """
         try:
-            messages = self.chat_session_manager.get_session_messages(self.current_session_id)
+            at_bottom = self.chat_display.verticalScrollBar().value() == self.chat_display.verticalScrollBar().maximum()
+            if not self.current_session_id:
+                self.update_stop_button()
+                self.rendered_session_id = None
+                self.message_delegate.clear()
+                self.transcript_model.set_messages([])
+                return
 
-            for sender, message, timestamp in messages:
-                bg_color = self.user_msg_bg if sender == "You" else self.ai_msg_bg
-                self.message_manager.add_formatted_message(sender, message, timestamp, bg_color)
-
-            # Display attachments if any
-            attachments = self.chat_session_manager.get_attached_files(self.current_session_id)
-            if attachments:
-                self.chat_display.append("<br><br><b>Attached Files:</b><br>")
-                for file_name in attachments:
-                    self.chat_display.append(
-                        f"  <a href='file://{os.path.abspath(os.path.join('chat_logs', f'{self.current_session_id}.json'))}'>"
-                        f"{file_name}</a><br>"
-                    )
+            messages = self.chat_session_manager.get_session_messages(self.current_session_id)
+            if full or self.rendered_session_id != self.current_session_id:
+                self.update_stop_button()
+                self.rendered_session_id = self.current_session_id
+                self.message_delegate.clear()
+                self.transcript_model.set_messages(
+                    messages, self.chat_session_manager.get_message_meta(self.current_session_id))
+                stream = self.streams.get(self.current_session_id)
+                if stream:
+                    # A response for this session is still arriving; show what was received so far
+                    stream["pending"] = stream["parts"] + stream["pending"]
+                    stream["parts"] = []
+                    self.stream_timer.start()
+                at_bottom = True
+            else:
+                self.transcript_model.sync()
+            if at_bottom:
+                self.chat_display.scrollToBottom()
         except Exception as e:
             logging.error(f"Error updating chat display: {e}")
             QMessageBox.warning(self, "Warning", "Error updating chat display")
 
+    def handle_chat_scroll(self, value):
+        """Fetches the previous page of messages when the transcript is scrolled to the top."""
+        if value == self.chat_display.verticalScrollBar().minimum() and self.transcript_model.first > 0:
+            added = self.transcript_model.fetch_older()
+            # Keep the message that was at the top in view
+            self.chat_display.scrollTo(self.transcript_model.index(added), QAbstractItemView.PositionAtTop)
+
+    def handle_message_activated(self, index):
+        """Expands or collapses a large message, or opens the file named by an attachment message."""
+        message = index.data(Qt.DisplayRole)
+        if index.data(TranscriptModel.SenderRole) == "System" and message.startswith("File attached: "):
+            file_name = message[len("File attached: "):]
+            if file_name in self.chat_session_manager.get_attached_files(self.current_session_id):
+                file_path = self.chat_session_manager.get_attachment_path(self.current_session_id, file_name)
+                QDesktopServices.openUrl(QUrl.fromLocalFile(os.path.abspath(file_path)))
+        elif len(message) > self.message_delegate.collapse_chars and index.data(TranscriptModel.MessageIndexRole) >= 0:
+            self.transcript_model.toggle_expanded(index.row())
+
+    def copy_selected_messages(self):
+        """Copies the selected messages to the clipboard."""
+        rows = sorted(self.chat_display.selectionModel().selectedRows(), key=lambda index: index.row())
+        QApplication.clipboard().setText("\n".join(
+            f"{index.data(TranscriptModel.TimestampRole)} {index.data(TranscriptModel.SenderRole)}: {index.data(Qt.DisplayRole)}"
+            for index in rows))
+
     def load_previous_sessions(self):
-       """Loads the previously saved sessions."""
-       self.chat_session_manager.load_sessions()
+       """Shows the previously saved sessions; ChatSessionManager has already read their index."""
        self.update_session_list()
 
     def attach_file(self):
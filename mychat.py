@@ -10,11 +10,458 @@ import time
 import json
 import glob
 import requests
-import subprocess
 import anthropic
+import bisect
+import re
+import random
+import email.utils
+import socket
 import threading
 from queue import Queue
 
+# Context window sizes in tokens, by model name prefix (the longest matching prefix wins); a provider's
+# `context_window` setting overrides them. The history of other models is sent untrimmed.
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4o": 128000, "gpt-4-turbo": 128000, "gpt-4": 8192, "gpt-3.5-turbo": 16385,
+    "claude": 200000, "gemini": 1048576, "grok": 131072, "llama3": 8192, "granite3.1": 128000,
+}
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+def parse_duration(value):
+    """Parses a rate-limit reset duration such as "1s", "250ms" or "6m0s" into seconds."""
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|h|m|s)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+def retry_after_seconds(headers, status_code):
+    """Returns how long a provider asked the client to wait, from its Retry-After or rate-limit headers.
+
+    The rate-limit headers describe the client's quotas rather than this error, so they are read only for a 429
+    without Retry-After, and only for the buckets that are exhausted.
+    """
+    headers = {key.lower(): value for key, value in (headers or {}).items()}
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            value = headers["retry-after"]
+            if value.replace(".", "", 1).isdigit():
+                return float(value)
+            return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+        if status_code != 429:
+            return None
+        resets = []
+        for key, value in headers.items():
+            if key.startswith("x-ratelimit-remaining-"):
+                # OpenAI and xAI report how long until a request or token budget resets
+                reset = headers.get(key.replace("-remaining-", "-reset-"))
+                if reset and float(value) <= 0:
+                    resets.append(parse_duration(reset))
+            elif key.startswith("anthropic-ratelimit-") and key.endswith("-remaining"):
+                # Anthropic reports the reset time as a timestamp
+                reset = headers.get(key[:-len("remaining")] + "reset")
+                if reset and float(value) <= 0:
+                    resets.append(max(datetime.fromisoformat(reset.replace("Z", "+00:00")).timestamp() - time.time(),
+                                      0.0))
+        return max(resets) if resets else None
+    except (ValueError, TypeError):
+        return None
+
+def classify_error(error):
+    """Returns (retryable, retry_after) for an exception raised by a provider call.
+
+    Rate limits, overload, server errors and dropped connections are retryable; authentication, bad requests and
+    anything unrecognised are not.
+    """
+    response = getattr(error, "response", None)
+    status_code = getattr(error, "status_code", None) or getattr(response, "status_code", None)
+    if status_code is None and isinstance(getattr(error, "code", None), int):
+        status_code = error.code  # google.api_core errors carry the HTTP status as `code`
+    if status_code is not None:
+        headers = getattr(error, "headers", None) or getattr(response, "headers", None)
+        retryable = status_code in RETRYABLE_STATUS_CODES
+        return retryable, retry_after_seconds(headers, status_code) if retryable else None
+    if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                          requests.exceptions.ChunkedEncodingError, openai.APIConnectionError,
+                          anthropic.APIConnectionError, ConnectionError, TimeoutError)):
+        return True, None
+    return False, None
+
+class RetryPolicy:
+    """Exponential backoff with full jitter, from the `retry` section of config.yaml.
+
+    A provider's Retry-After is honoured as the minimum wait; a request is not retried if that would exceed
+    `max_retry_after` seconds.
+    """
+    def __init__(self, config=None):
+        config = config or {}
+        self.max_retries = config.get("max_retries", 3)
+        self.base_delay = config.get("base_delay", 1.0)
+        self.max_delay = config.get("max_delay", 30.0)
+        self.max_retry_after = config.get("max_retry_after", 60.0)
+
+    def delay(self, attempt, retry_after=None):
+        """Returns the seconds to wait before retry number attempt + 1, or None if it should not be retried."""
+        if attempt >= self.max_retries - 1:
+            return None
+        if retry_after is not None and retry_after > self.max_retry_after:
+            return None
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(backoff, retry_after or 0)
+
+class CircuitBreaker:
+    """Fails requests to a provider fast after `failure_threshold` consecutive retryable failures.
+
+    The breaker stays open for `reset_timeout` seconds, then lets one trial request through (half-open); its
+    success closes the breaker and its failure opens it again. Every request that was let through reports back:
+    record_success for a response (including a non-retryable error, which shows the provider is up),
+    record_failure for a retryable error, and release_trial when it was cancelled.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """Returns True if a request may be sent now."""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            # Half-open: one trial at a time; a trial that never reported back is replaced after a timeout
+            if self.trial_started is None or now - self.trial_started >= self.reset_timeout:
+                self.trial_started = now
+                return True
+            return False
+
+    def remaining(self):
+        """Returns the seconds until the breaker lets a trial request through."""
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_started = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_started is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self.trial_started = None
+
+    def release_trial(self):
+        """Ends the trial of a request cancelled before it had an outcome, so the next request can be the trial."""
+        with self.lock:
+            self.trial_started = None
+
+class TokenBucket:
+    """Refills `rate` units per second up to `capacity`.
+
+    Reservations may overdraw the bucket: each caller takes its share at once and waits until the bucket is back to
+    zero, so callers are served in the order they reserved and each knows its wait up front.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """Takes amount (at most a full bucket); returns the seconds until the bucket has covered it."""
+        self.refill(now)
+        self.level -= min(amount, self.capacity)
+        return max(-self.level / self.rate, 0.0)
+
+    def adjust(self, amount, now):
+        """Takes amount more, or gives it back when negative."""
+        self.refill(now)
+        self.level = min(self.capacity, self.level - amount)
+
+    def hold(self, seconds, now):
+        """Empties the bucket for at least the given seconds, e.g. after the provider asked to retry later."""
+        self.refill(now)
+        self.level = min(self.level, -seconds * self.rate)
+
+class RateLimiter:
+    """A provider model's request and token quotas, shared by every session using the same key."""
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.settings = (requests_per_minute, tokens_per_minute)
+        self.buckets = {}  # {"requests" or "tokens": TokenBucket}
+        if requests_per_minute:
+            self.buckets["requests"] = TokenBucket(requests_per_minute / 60, requests_per_minute)
+        if tokens_per_minute:
+            self.buckets["tokens"] = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens):
+        """Reserves a request of about `tokens` input tokens; returns the seconds to wait before sending it."""
+        amounts = {"requests": 1, "tokens": tokens}
+        now = time.monotonic()
+        with self.lock:
+            return max([bucket.reserve(amounts[name], now) for name, bucket in self.buckets.items()] + [0.0])
+
+    def release(self, tokens):
+        """Gives back the reservation of a request that was cancelled before it was sent."""
+        self.adjust(-1, -tokens)
+
+    def adjust(self, requests=0, tokens=0):
+        """Corrects the reserved amounts, e.g. by the response tokens once they are known."""
+        amounts = {"requests": requests, "tokens": tokens}
+        now = time.monotonic()
+        with self.lock:
+            for name, bucket in self.buckets.items():
+                bucket.adjust(amounts[name], now)
+
+    def hold(self, seconds):
+        """Makes every request wait at least the given seconds; used when the provider answers 429 with a
+        Retry-After, so the other sessions sharing the key wait instead of adding to the burst."""
+        now = time.monotonic()
+        with self.lock:
+            for bucket in self.buckets.values():
+                bucket.hold(seconds, now)
+
+class ProviderAdapter:
+    """
+    A provider integration: initializes the client, formats the conversation, sends requests and counts tokens.
+
+    Adapters are registered by provider name in PROVIDER_ADAPTERS. Each keeps the messages it has already converted
+    per session and converts only the ones appended since, so preparing a request is O(new messages).
+    """
+    default_max_tokens = 1024  # tokens reserved for the response when the provider has no `max_tokens` setting
+
+    def __init__(self, name):
+        self.name = name
+        self.conversions = {}  # {session_name: (conversation_history list, [converted message])}
+
+    def count_tokens(self, text):
+        """Estimates the tokens in a text (about four bytes per token)."""
+        return (len(text.encode("utf-8")) + 3) // 4
+
+    def initialize(self, provider_config):
+        """Sets up the provider's client; returns an error message if the settings cannot work, otherwise None."""
+        return None
+
+    def format_message(self, msg):
+        return {"role": "user" if msg["role"] == "user" else "assistant", "content": msg["parts"][0]}
+
+    def header(self, provider_config):
+        return [{"role": "system", "content": provider_config.get("system_prompt", "You are a helpful assistant.")}]
+
+    def assemble(self, header, messages):
+        return header + messages
+
+    def format(self, session, history, start, stop, provider_config):
+        """Converts messages start to stop of a session's conversation history to the provider's request format,
+        reusing the session's earlier conversions; called on the Tk thread."""
+        cached_history, converted = self.conversions.get(session, (None, None))
+        if cached_history is not history:
+            # The history list is replaced whenever the session is reloaded
+            converted = []
+            self.conversions[session] = (history, converted)
+        for msg in history[len(converted):stop]:
+            converted.append(self.format_message(msg))
+        return self.assemble(self.header(provider_config), converted[start:stop])
+
+    def forget(self, session):
+        self.conversions.pop(session, None)
+
+    def send(self, provider_config, payload, request):
+        """Sends a formatted request and returns the response text; called on the worker thread.
+
+        Adapters stream the response, adding the text received so far to request["parts"] and a way to close the
+        stream to request["closers"], so a stopped request ends at once and keeps its partial answer.
+        """
+        raise NotImplementedError
+
+    def read_stream(self, stream, request, text_of):
+        """Reads a response stream into request["parts"] until it ends or the request is stopped."""
+        parts = request["parts"]
+        for chunk in stream:
+            parts.append(text_of(chunk) or "")
+            if request["cancelled"].is_set():
+                break
+        return "".join(parts)
+
+    @staticmethod
+    def close_response(response):
+        """Closes a streaming requests response from another thread; shutting the socket down wakes the blocked
+        read."""
+        sock = getattr(getattr(response.raw, "_connection", None), "sock", None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        response.close()
+
+    @staticmethod
+    def add_closer(request, close):
+        """Registers how to close the open stream, closing it at once if the request was already stopped."""
+        request["closers"].append(close)
+        if request["cancelled"].is_set():
+            close()
+
+class GeminiAdapter(ProviderAdapter):
+    def initialize(self, provider_config):
+        genai.configure(api_key=provider_config.get("api_key", ""))
+        self.model_instance = genai.GenerativeModel(provider_config.get("model", "gemini-pro"))
+
+    def format_message(self, msg):
+        return {"role": msg["role"], "parts": msg["parts"]}
+
+    def header(self, provider_config):
+        return []
+
+    def send(self, provider_config, payload, request):
+        response = self.model_instance.generate_content(payload, stream=True)
+        # The SDK exposes no close; cancelling its underlying gRPC/REST stream ends the blocked read
+        cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+        if cancel:
+            self.add_closer(request, cancel)
+        return self.read_stream(response, request, lambda chunk: chunk.text)
+
+class OpenAIAdapter(ProviderAdapter):
+    def __init__(self, name, use_base_url=False):
+        super().__init__(name)
+        self.use_base_url = use_base_url
+
+    def initialize(self, provider_config):
+        openai.api_key = provider_config.get("api_key", "")
+        openai.max_retries = 0  # retried by generate_ai_response
+        if self.use_base_url:
+            openai.base_url = provider_config.get("base_url", "")
+
+    def send(self, provider_config, payload, request):
+        stream = openai.chat.completions.create(
+            model=provider_config.get("model", "gpt-3.5-turbo"),
+            messages=payload,
+            temperature=provider_config.get("temperature", 0.7),
+            stream=True
+        )
+        self.add_closer(request, stream.close)
+        return self.read_stream(stream, request, lambda chunk: chunk.choices[0].delta.content if chunk.choices else "")
+
+class AnthropicAdapter(ProviderAdapter):
+    """Anthropic's text completions API, which takes the conversation as a single prompt string."""
+    default_max_tokens = 10000
+
+    def initialize(self, provider_config):
+        anthropic.api_key = provider_config.get("api_key", "")
+        self.model_instance = anthropic.Client(max_retries=0)
+
+    def format_message(self, msg):
+        return f"Human: {msg['parts'][0]}\n" if msg["role"] == "user" else f"Assistant: {msg['parts'][0]}\n"
+
+    def header(self, provider_config):
+        return [f"{provider_config.get('system_prompt', 'You are a helpful assistant.')}\n\n"]
+
+    def assemble(self, header, messages):
+        return "".join(header + messages)
+
+    def send(self, provider_config, payload, request):
+        stream = self.model_instance.completions.create(
+            model=provider_config.get("model", "claude-3-opus-20240229"),
+            max_tokens=self.default_max_tokens,
+            prompt=payload,
+            stream=True,
+        )
+        self.add_closer(request, stream.close)
+        return self.read_stream(stream, request, lambda chunk: chunk.completion)
+
+class XAIAdapter(ProviderAdapter):
+    def initialize(self, provider_config):
+        url = provider_config.get("base_url", "")
+        if url and "https://api.x.ai" not in url:
+            return "Grok Base URL must point to https://api.x.ai."
+        return None
+
+    def send(self, provider_config, payload, request):
+        url = provider_config.get("base_url", "") + "/chat/completions"
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {provider_config.get('api_key', '')}"
+        }
+        data = {
+            "messages": payload,
+            "model": provider_config.get("model", "grok-1"),
+            "temperature": provider_config.get("temperature", 0.7),
+            "stream": True
+        }
+        with requests.post(url, headers=headers, json=data, stream=True) as response:
+            self.add_closer(request, lambda: self.close_response(response))
+            if request["cancelled"].is_set():
+                return ""
+            response.raise_for_status() # Raise an exception for bad responses
+            return self.read_stream(self.events(response), request, lambda event: event)
+
+    @staticmethod
+    def events(response):
+        """Yields the text of each server-sent event of a streamed chat completion."""
+        for line in response.iter_lines():
+            if not line.startswith(b"data:"):
+                continue
+            data = line[len(b"data:"):].strip()
+            if data == b"[DONE]":
+                break
+            choices = json.loads(data).get("choices") or [{}]
+            yield choices[0].get("delta", {}).get("content")
+
+class OllamaAdapter(ProviderAdapter):
+    """A local Ollama server's /api/chat endpoint, streamed as NDJSON."""
+    def __init__(self, name):
+        super().__init__(name)
+        # One pooled HTTP session, reused by every request to the local Ollama server
+        self.session = requests.Session()
+
+    def send(self, provider_config, payload, request):
+        url = provider_config.get("base_url", "http://127.0.0.1:11434").rstrip("/") + "/api/chat"
+        data = {
+            "model": provider_config.get("ollama_model", "llama3.1:latest"),
+            "messages": payload,
+            "stream": True,
+            "keep_alive": provider_config.get("keep_alive", "5m"),
+            "options": {"temperature": provider_config.get("temperature", 0.7)}
+        }
+        parts = request["parts"]
+        with self.session.post(url, json=data, stream=True) as response:
+            # Dropping the connection also stops the model generating
+            self.add_closer(request, lambda: self.close_response(response))
+            if request["cancelled"].is_set():
+                return ""
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event.get("error"):
+                    raise Exception(f"Ollama Error: {event['error']}")
+                parts.append(event.get("message", {}).get("content", ""))
+                if event.get("done") or request["cancelled"].is_set():
+                    break
+        return "".join(parts)
+
+# {provider name: ProviderAdapter}, in the order providers are offered
+PROVIDER_ADAPTERS = {adapter.name: adapter for adapter in [
+    GeminiAdapter("Google Gemini"), OpenAIAdapter("OpenAI"), OllamaAdapter("Ollama"),
+    OpenAIAdapter("OpenAI Compatible", use_base_url=True), XAIAdapter("xAI Grok"), AnthropicAdapter("Anthropic Claude"),
+]}
+
 class APIConfig:
     """
     A class to create a configuration window for API settings.
@@ -30,7 +477,7 @@ class APIConfig:
         self.provider_frame = ttk.LabelFrame(self.window, text="API Provider")
         self.provider_frame.pack(padx=10, pady=5, fill="x")
 
-        self.providers = ["Google Gemini", "OpenAI", "Ollama", "OpenAI Compatible", "xAI Grok", "Anthropic Claude"]
+        self.providers = list(PROVIDER_ADAPTERS)
         self.selected_provider = tk.StringVar(value=self.config_data.get("active_provider", "Google Gemini"))
 
         self.provider_dropdown = ttk.Combobox(self.provider_frame, textvariable=self.selected_provider, values=self.providers, state="readonly", width=40)
@@ -149,9 +596,28 @@ class ChatApplication:
         self.sessions = {}
         self.current_session = None
         self.conversation_history = []
+        self.message_meta = {}  # {session_name: {chat_log index: meta}}, e.g. {"truncated": True} for a stopped response
         self.log_dir = "chat_logs"
         os.makedirs(self.log_dir, exist_ok=True)
 
+        # What the chat display currently shows
+        self.rendered_session = None
+        self.rendered_count = 0
+
+        # Append-only journal bookkeeping: what each session file already holds
+        self.compact_every = 200
+        self.saved_counts = {}  # {session_name: number of chat_log entries on disk}
+        self.saved_attachments = {}  # {session_name: set of attachment indexes on disk}
+        self.journal_lengths = {}  # {session_name: number of records in the journal}
+
+        # Prefix sums of the token counts cached on each conversation_history message
+        self.context_history = None  # the conversation_history list the sums belong to
+        self.context_prefix_sums = [0]
+
+        # File Attachments Variables
+        self.attached_files = {} # Dictionary to store file attachments for session {session_name: {"file_path": <file_path>, "file_name":<file_name>, "file_content":<bytes>}}
+        self.file_counter = 0 # A counter for each attachment
+
         self.load_previous_sessions()
         if not self.sessions:
             self.new_session()
@@ -163,10 +629,6 @@ class ChatApplication:
         self.context_menu = tk.Menu(self.root, tearoff=0)
         self.context_menu.add_command(label="Copy", command=self.copy_text)
 
-        # File Attachments Variables
-        self.attached_files = {} # Dictionary to store file attachments for session {session_name: {"file_path": <file_path>, "file_name":<file_name>, "file_content":<bytes>}}
-        self.file_counter = 0 # A counter for each attachment
-
         # Font styles for message formatting
         self.bold_font = Font(weight="bold")
         self.italic_font = Font(slant="italic")
@@ -174,6 +636,9 @@ class ChatApplication:
 
         # Message Queue
         self.message_queue = Queue()
+        self.active_requests = []  # requests queued or running, until their response is committed
+        self.circuit_breakers = {}  # {provider: CircuitBreaker}, used by the worker thread
+        self.rate_limiters = {}  # {(provider, model): RateLimiter}, used by the worker thread
         self.processing_thread = threading.Thread(target=self.process_messages, daemon=True)
         self.processing_thread.start()
 
@@ -215,6 +680,11 @@ class ChatApplication:
 
         self.api_label = tk.Label(self.chat_frame, text="Current API: None", bg=self.right_bg, fg=self.right_text, font=("Arial", 10, "italic"))
         self.api_label.pack(pady=5)
+        self.context_label = tk.Label(self.chat_frame, text="", bg=self.right_bg, fg=self.right_text, font=("Arial", 10, "italic"))
+        self.context_label.pack()
+        self.status_label = tk.Label(self.chat_frame, text="", bg=self.right_bg, fg=self.right_text, font=("Arial", 10, "italic"))
+        self.status_label.pack(side=tk.BOTTOM, fill=tk.X)
+        self.status_timer = None
 
         self.chat_display = scrolledtext.ScrolledText(self.chat_frame, wrap=tk.WORD, font=("Arial", 10), bg=self.right_bg, fg=self.right_text)
         self.chat_display.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -237,6 +707,9 @@ class ChatApplication:
         self.send_button = tk.Button(self.button_frame, text="Send", bg=self.button_bg, fg=self.button_text, command=self.send_message)
         self.send_button.pack(side=tk.LEFT, padx=5)
 
+        self.stop_button = tk.Button(self.button_frame, text="Stop", bg=self.button_bg, fg=self.button_text, command=self.stop_request)
+        self.stop_button.pack(side=tk.LEFT, padx=5)
+
         self.attach_button = tk.Button(self.button_frame, text="Attach", bg=self.button_bg, fg=self.button_text, command=self.attach_file)
         self.attach_button.pack(side=tk.LEFT, padx=5)
 
@@ -249,7 +722,7 @@ class ChatApplication:
              "active_provider": "Google Gemini",
              "Google Gemini": {"api_key": "", "model": "gemini-pro", "system_prompt": "You are a helpful assistant.", "temperature": 0.7},
              "OpenAI": {"api_key": "", "model": "gpt-3.5-turbo", "system_prompt": "You are a helpful assistant.", "temperature": 0.7},
-             "Ollama": {"ollama_model": "llama3.1:latest"},
+             "Ollama": {"base_url": "http://127.0.0.1:11434", "ollama_model": "llama3.1:latest", "keep_alive": "5m"},
              "OpenAI Compatible": {"api_key": "", "base_url": "", "model": "gpt-3.5-turbo", "system_prompt": "You are a helpful assistant.", "temperature": 0.7},
              "xAI Grok": {"api_key": "", "base_url": "https://api.x.ai", "model": "grok-1", "system_prompt": "You are a helpful assistant.", "temperature": 0.7},
              "Anthropic Claude": {"api_key": "", "model": "claude-3-opus-20240229", "system_prompt": "You are a helpful assistant.", "temperature": 0.7}
@@ -290,24 +763,11 @@ class ChatApplication:
              return
          provider_config = self.config.get(provider, {})
          try:
-             if provider == "Google Gemini":
-                 genai.configure(api_key=provider_config.get("api_key", ""))
-                 self.model_instance = genai.GenerativeModel(provider_config.get("model", "gemini-pro"))
-             elif provider in ["OpenAI", "OpenAI Compatible"]:
-                 openai.api_key = provider_config.get("api_key", "")
-                 if provider == "OpenAI Compatible":
-                     openai.base_url = provider_config.get("base_url", "")
-             elif provider == "Anthropic Claude":
-                  anthropic.api_key = provider_config.get("api_key", "")
-                  self.model_instance = anthropic.Client()
-             elif provider == "xAI Grok":
-                   url = provider_config.get("base_url", "")
-                   if url and "https://api.x.ai" not in url:
-                      messagebox.showerror("Error", "Grok Base URL must point to https://api.x.ai.")
-                      return
-             elif provider == "Ollama":
-                  self.ollama_model_name = provider_config.get("ollama_model", "llama3.1:latest")
-                  self.ollama_command = ["ollama", "run", self.ollama_model_name]
+             adapter = PROVIDER_ADAPTERS.get(provider)
+             error = adapter.initialize(provider_config) if adapter else None
+             if error:
+                 messagebox.showerror("Error", error)
+                 return
              self.update_api_label()
          except Exception as e:
              messagebox.showerror("API Initialization Error", str(e))
@@ -336,9 +796,10 @@ class ChatApplication:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         session_name = f"Session_{timestamp}"
         self.sessions[session_name] = []
+        self.message_meta[session_name] = {}
         self.current_session = session_name
         self.conversation_history = []
-        self.update_session_list()
+        self.move_session_to_top(session_name)
         messagebox.showinfo("New Session", f"Session '{session_name}' created.")
         self.update_chat_display()
         self.attached_files[self.current_session] = {} #clear existing attachments
@@ -351,13 +812,17 @@ class ChatApplication:
             return
         if selected_session in self.sessions:
             del self.sessions[selected_session]
+            for adapter in PROVIDER_ADAPTERS.values():
+                adapter.forget(selected_session)
             if self.attached_files.get(selected_session):
                 del self.attached_files[selected_session]
-        log_file = os.path.join(self.log_dir, f"{selected_session}.json")
-        if os.path.exists(log_file):
-            os.remove(log_file)
+            self.message_meta.pop(selected_session, None)
+        for log_file in [os.path.join(self.log_dir, f"{selected_session}.json"), self.journal_path(selected_session),
+                         self.journal_path(selected_session) + ".old"]:
+            if os.path.exists(log_file):
+                os.remove(log_file)
         self.current_session = None
-        self.update_session_list()
+        self.remove_session_row(selected_session)
         self.conversation_history = []
         self.update_chat_display()
         messagebox.showinfo("Session Deleted", f"Session '{selected_session}' deleted.")
@@ -373,140 +838,192 @@ class ChatApplication:
          timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
          self.sessions[self.current_session].append(("You", message, timestamp))
          self.conversation_history.append({"role": "user", "parts": [message]})
+         self.move_session_to_top(self.current_session)
          self.message_entry.delete("1.0", tk.END)
          self.update_chat_display()
-         self.message_queue.put(("generate_response", {"user_message": message}))
+         # The request is formatted here on the Tk thread; the adapter only converts the messages added since the
+         # session's previous request
+         provider = self.config.get("active_provider", "")
+         provider_config = dict(self.config.get(provider, {}))
+         start = self.fit_context_history(provider, provider_config)
+         adapter = PROVIDER_ADAPTERS.get(provider)
+         payload = adapter.format(self.current_session, self.conversation_history, start,
+                                  len(self.conversation_history), provider_config) if adapter else None
+         # Estimated input tokens, reserved with the provider's rate limiter
+         tokens = self.context_prefix_sums[len(self.conversation_history)] - self.context_prefix_sums[start]
+         if adapter:
+             tokens += adapter.count_tokens(provider_config.get("system_prompt", ""))
+         request = {"session": self.current_session, "adapter": adapter, "payload": payload, "tokens": tokens,
+                    "provider_config": provider_config, "retry": self.config.get("retry", {}),
+                    "cancelled": threading.Event(), "closers": [], "parts": []}
+         self.active_requests.append(request)
+         self.message_queue.put(("generate_response", request))
+
+    def stop_request(self):
+        """Stops the current session's queued and running requests, keeping any partial answer."""
+        for request in self.active_requests:
+            if request["session"] == self.current_session:
+                self.cancel_request(request)
+
+    def cancel_request(self, request):
+        request["cancelled"].set()
+        for close in list(request["closers"]):
+            try:
+                close()
+            except Exception:
+                pass
+
+    def on_close(self):
+        """Stops every request before the window closes."""
+        for request in self.active_requests:
+            self.cancel_request(request)
+        self.root.destroy()
 
     def process_messages(self):
         while True:
             try:
                 task, data = self.message_queue.get()
                 if task == "generate_response":
-                    self.generate_ai_response(data["user_message"])
+                    self.generate_ai_response(data)
                 self.message_queue.task_done()
             except Exception as e:
-                messagebox.showerror("Message Processing Error", f"Error processing message queue: {e}")
+                self.root.after(0, messagebox.showerror, "Message Processing Error", f"Error processing message queue: {e}")
 
-    def generate_ai_response(self, user_message):
-         """Generates the AI's response based on the active API provider."""
-         max_retries = 3
-         retry_delay = 2
+    def generate_ai_response(self, request):
+         """Generates the AI's response on the worker thread; the result is committed on the Tk thread."""
          ai_message = ""
-         for attempt in range(max_retries):
+         adapter = request["adapter"]
+         provider_config = request["provider_config"]
+         cancelled = request["cancelled"]
+         retry_policy = RetryPolicy(request["retry"])
+         breaker = self.circuit_breaker(adapter.name if adapter else "", request["retry"])
+         model = provider_config.get("ollama_model") or provider_config.get("model", "")
+         limiter = self.rate_limiter(adapter.name, model) if adapter else None
+         for attempt in range(retry_policy.max_retries):
+             if cancelled.is_set():
+                 break
+             request["parts"].clear()
+             request["closers"].clear()
              try:
-                 provider = self.config.get("active_provider", "")
-                 provider_config = self.config.get(provider, {})
-                 if provider == "Google Gemini":
-                      response = self.model_instance.generate_content(self.conversation_history)
-                      ai_message = response.text.strip()
-                 elif provider in ["OpenAI", "OpenAI Compatible"]:
-                      messages = []
-                      system_prompt = provider_config.get("system_prompt", "You are a helpful assistant.")
-                      messages.append({"role": "system", "content": system_prompt})
-
-                      for msg in self.conversation_history:
-                          if msg["role"] == "user":
-                             messages.append({"role": "user", "content": msg["parts"][0]})
-                          elif msg["role"] == "model":
-                             messages.append({"role":"assistant", "content": msg["parts"][0]})
-                      response = openai.chat.completions.create(
-                         model=provider_config.get("model", "gpt-3.5-turbo"),
-                         messages=messages,
-                         temperature=provider_config.get("temperature", 0.7)
-                     )
-                      ai_message = response.choices[0].message.content.strip()
-
-                 elif provider == "Anthropic Claude":
-                     response = self.model_instance.completions.create(
-                          model=provider_config.get("model", "claude-3-opus-20240229"),
-                          max_tokens=10000,
-                          prompt=self.construct_prompt(),
-                     )
-                     ai_message = response.completion.strip()
-                 elif provider == "xAI Grok":
-                      url = provider_config.get("base_url", "") + "/chat/completions"
-                      headers = {
-                         "Content-Type": "application/json",
-                         "Authorization": f"Bearer {provider_config.get('api_key', '')}"
-                      }
-                      messages = []
-                      system_prompt = provider_config.get("system_prompt", "You are a helpful assistant.")
-                      messages.append({"role": "system", "content": system_prompt})
-                      for msg in self.conversation_history:
-                          if msg["role"] == "user":
-                             messages.append({"role": "user", "content": msg["parts"][0]})
-                          elif msg["role"] == "model":
-                             messages.append({"role":"assistant", "content": msg["parts"][0]})
-
-                      data = {
-                         "messages": messages,
-                         "model": provider_config.get("model", "grok-1"),
-                         "temperature": provider_config.get("temperature", 0.7)
-                      }
-                      response = requests.post(url, headers=headers, json=data)
-                      response.raise_for_status() # Raise an exception for bad responses
-                      ai_message = response.json()['choices'][0]['message']['content'].strip()
-                 elif provider == "Ollama":
-                    process = subprocess.Popen(self.ollama_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                    stdout, stderr = process.communicate(input=self.construct_prompt())
-                    if stderr:
-                        raise Exception(f"Ollama Error:{stderr}")
-                    ai_message = stdout.strip()
+                 if adapter is None:
+                     raise Exception("Unsupported API provider")
+                 if not breaker.allow():
+                     ai_message = f"Error generating response: {adapter.name} is failing; requests are paused for " \
+                                  f"{breaker.remaining():.0f} more seconds"
+                     break
+                 wait = limiter.reserve(request["tokens"]) if limiter else 0.0
+                 if wait:
+                     self.root.after(0, self.show_status, f"Waiting {wait:.1f}s for the {adapter.name} rate limit", wait + 2)
+                     if cancelled.wait(wait):
+                         limiter.release(request["tokens"])
+                         breaker.release_trial()
+                         break
+                 ai_message = adapter.send(provider_config, request["payload"], request).strip()
+                 breaker.record_success()
+                 if limiter:
+                     limiter.adjust(tokens=adapter.count_tokens(ai_message))
                  break
-             except requests.exceptions.RequestException as e:
-                if attempt < max_retries -1 and "429" in str(e):
-                    time.sleep(retry_delay)
-                else:
-                    ai_message = f"API request failed: {e}"
-
              except Exception as e:
-                  if attempt < max_retries - 1:
-                      time.sleep(retry_delay)
-                  else:
-                     ai_message = f"Error generating response: {str(e)}"
-
-         timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-         self.sessions[self.current_session].append(("AI", ai_message, timestamp))
-         self.conversation_history.append({"role": "model", "parts": [ai_message]})
-         self.root.after(0, self.update_chat_display) # Use root.after to update the UI
-         self.save_session()
-
-    def construct_prompt(self):
-        prompt = ""
-        provider = self.config.get("active_provider", "")
-        provider_config = self.config.get(provider, {})
-
-        if provider in ["OpenAI", "OpenAI Compatible", "xAI Grok"]:
-            system_prompt = provider_config.get("system_prompt", "You are a helpful assistant.")
-            prompt += f"System: {system_prompt}\n"
-            for msg in self.conversation_history:
-               if msg["role"] == "user":
-                  prompt += f"User: {msg['parts'][0]}\n"
-               elif msg["role"] == "model":
-                  prompt += f"Assistant: {msg['parts'][0]}\n"
-        elif provider == "Anthropic Claude":
-           system_prompt = provider_config.get("system_prompt", "You are a helpful assistant.")
-           prompt += f"{system_prompt}\n\n"
-           for msg in self.conversation_history:
-              if msg["role"] == "user":
-                 prompt += f"Human: {msg['parts'][0]}\n"
-              elif msg["role"] == "model":
-                 prompt += f"Assistant: {msg['parts'][0]}\n"
-        elif provider == "Ollama":
-            system_prompt = provider_config.get("system_prompt", "You are a helpful assistant.")
-            prompt += f"{system_prompt}\n"
-            for msg in self.conversation_history:
-               if msg["role"] == "user":
-                  prompt += f"User: {msg['parts'][0]}\n"
-               elif msg["role"] == "model":
-                  prompt += f"Assistant: {msg['parts'][0]}\n"
-        else:
-            for msg in self.conversation_history:
-               if msg["role"] == "user":
-                   prompt += f"{msg['parts'][0]}\n"
-               elif msg["role"] == "model":
-                   prompt += f"{msg['parts'][0]}\n"
-        return prompt
+                 if cancelled.is_set():
+                     breaker.release_trial()
+                     break  # the stream was closed by Stop
+                 # Only rate limits, overload, server and connection errors are worth retrying
+                 retryable, retry_after = classify_error(e)
+                 if retry_after and limiter:
+                     limiter.hold(retry_after)  # other sessions sharing the key wait too
+                 delay = None
+                 if retryable:
+                     breaker.record_failure()
+                     delay = retry_policy.delay(attempt, retry_after)
+                 else:
+                     breaker.record_success()  # the provider answered; the request itself was at fault
+                 if delay is None:
+                     if isinstance(e, requests.exceptions.RequestException):
+                         ai_message = f"API request failed: {e}"
+                     else:
+                         ai_message = f"Error generating response: {str(e)}"
+                     break
+                 cancelled.wait(delay)
+
+         meta = None
+         if cancelled.is_set():
+             # Keep what arrived before Stop; it is marked as cut short in the display only, not in the history
+             ai_message = "".join(request["parts"]).strip() or None
+             meta = {"truncated": True}
+         self.root.after(0, self.handle_ai_response, request, ai_message, meta)
+
+    def circuit_breaker(self, provider, retry_config):
+        """Returns the provider's circuit breaker, created with the thresholds of the `retry` config section."""
+        if provider not in self.circuit_breakers:
+            self.circuit_breakers[provider] = CircuitBreaker(retry_config.get("breaker_threshold", 5),
+                                                             retry_config.get("breaker_reset", 30.0))
+        return self.circuit_breakers[provider]
+
+    def rate_limiter(self, provider, model):
+        """Returns the provider model's RateLimiter, from the `rate_limits` config section: requests_per_minute and
+        tokens_per_minute per provider, optionally overridden per model under `models`. None if it has no limits."""
+        limits = dict((self.config.get("rate_limits") or {}).get(provider) or {})
+        limits.update((limits.pop("models", None) or {}).get(model) or {})
+        settings = (limits.get("requests_per_minute"), limits.get("tokens_per_minute"))
+        if not any(settings):
+            return None
+        limiter = self.rate_limiters.get((provider, model))
+        if limiter is None or limiter.settings != settings:
+            limiter = self.rate_limiters[(provider, model)] = RateLimiter(*settings)
+        return limiter
+
+    def show_status(self, text, seconds=5):
+        """Shows a note in the status bar for a few seconds; runs on the Tk thread."""
+        self.status_label.config(text=text)
+        if self.status_timer:
+            self.root.after_cancel(self.status_timer)
+        self.status_timer = self.root.after(int(seconds * 1000), lambda: self.status_label.config(text=""))
+
+    def handle_ai_response(self, request, ai_message, meta=None):
+        """Commits a response, with its metadata, to the session that asked for it; runs on the Tk thread."""
+        self.active_requests.remove(request)
+        session = request["session"]
+        if session not in self.sessions or ai_message is None:
+            return  # deleted while the request was running, or stopped before any text arrived
+        timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
+        self.sessions[session].append(("AI", ai_message, timestamp))
+        if meta:
+            self.message_meta.setdefault(session, {})[len(self.sessions[session]) - 1] = meta
+        if session == self.current_session:
+            self.conversation_history.append({"role": "model", "parts": [ai_message]})
+            self.update_chat_display()
+        self.save_session(session)
+
+    def fit_context_history(self, provider, provider_config):
+        """Returns the index of the first of the most recent conversation messages that fit the model's context
+        window, leaving room for the response (at most a quarter of the window) and the system prompt; 0 if the
+        window is unknown. Token counts are cached on each message and summed once."""
+        history = self.conversation_history
+        if self.context_history is not history or len(history) < len(self.context_prefix_sums) - 1:
+            self.context_history = history
+            self.context_prefix_sums = [0]
+        for msg in history[len(self.context_prefix_sums) - 1:]:
+            if "tokens" not in msg:
+                msg["tokens"] = (len(msg["parts"][0].encode("utf-8")) + 3) // 4 + 4  # about four bytes per token
+            self.context_prefix_sums.append(self.context_prefix_sums[-1] + msg["tokens"])
+        context_window = provider_config.get("context_window")
+        if not context_window:
+            model = provider_config.get("ollama_model") or provider_config.get("model", "")
+            prefixes = [prefix for prefix in MODEL_CONTEXT_WINDOWS if model.startswith(prefix)]
+            if not prefixes:
+                self.context_label.config(text="")
+                return 0
+            context_window = MODEL_CONTEXT_WINDOWS[max(prefixes, key=len)]
+        adapter = PROVIDER_ADAPTERS.get(provider) or ProviderAdapter(provider)
+        response_tokens = min(provider_config.get("max_tokens", adapter.default_max_tokens), context_window // 4)
+        system_tokens = adapter.count_tokens(provider_config.get("system_prompt", "")) + 4
+        budget = max(context_window - response_tokens - system_tokens, 0)
+        count = len(history)
+        start = max(min(bisect.bisect_left(self.context_prefix_sums, self.context_prefix_sums[count] - budget, 0, count), count - 1), 0)
+        while start < count - 1 and history[start]["role"] != "user":
+            start += 1
+        self.context_label.config(text=f"{start} earlier messages not sent (context window limit)" if start else "")
+        return start
 
     def update_session_list(self):
         """Updates the list of sessions in the left panel."""
@@ -514,6 +1031,19 @@ class ChatApplication:
         for session in self.sessions:
             self.session_listbox.insert(tk.END, session)
 
+    def remove_session_row(self, session):
+        """Removes a session's row from the left panel, if it is listed."""
+        rows = self.session_listbox.get(0, tk.END)
+        if session in rows:
+            self.session_listbox.delete(rows.index(session))
+
+    def move_session_to_top(self, session):
+        """Moves (or inserts) a session at the top of the left panel, keeping it ordered by recent activity."""
+        if self.session_listbox.get(0) == session:
+            return
+        self.remove_session_row(session)
+        self.session_listbox.insert(0, session)
+
     def load_selected_session(self, event):
          """Loads the selected chat session into the chat display."""
          selected_session = self.session_listbox.get(tk.ACTIVE)
@@ -528,28 +1058,44 @@ class ChatApplication:
             self.update_chat_display()
             messagebox.showinfo("Session Loaded", f"Session '{selected_session}' loaded successfully.")
 
-    def update_chat_display(self):
-        """Updates the chat display with the latest messages."""
+    def update_chat_display(self, full=False):
+        """Updates the chat display, inserting only the messages not rendered yet.
+
+        The display is rebuilt from scratch only when the session changes (or `full` is set).
+        """
         self.chat_display.config(state=tk.NORMAL)
-        self.chat_display.delete("1.0", tk.END)
+        messages = self.sessions.get(self.current_session, []) if self.current_session else []
+        if full or not self.current_session or self.rendered_session != self.current_session or len(messages) < self.rendered_count:
+            self.chat_display.delete("1.0", tk.END)
+            self.rendered_session = self.current_session
+            self.rendered_count = 0
+        else:
+            # Remove the attachment list; it is re-inserted after the new messages
+            self.chat_display.delete("attachments_start", tk.END)
         if self.current_session:
-            for sender, message, timestamp in self.sessions[self.current_session]:
+            message_meta = self.message_meta.get(self.current_session, {})
+            for index, (sender, message, timestamp) in enumerate(messages[self.rendered_count:], self.rendered_count):
                  if sender == "You":
                       self.add_formatted_message(sender, message, timestamp, self.user_msg_bg)
                  elif sender == "AI":
-                      self.add_formatted_message(sender, message, timestamp, self.ai_msg_bg)
+                      self.add_formatted_message(sender, message, timestamp, self.ai_msg_bg, message_meta.get(index))
+            self.rendered_count = len(messages)
 
+            self.chat_display.config(state=tk.NORMAL)
+            self.chat_display.mark_set("attachments_start", "end-1c")
             if self.attached_files.get(self.current_session):
                  self.chat_display.insert(tk.END, "\n\nAttached Files:\n")
                  for file_index, file_info in self.attached_files[self.current_session].items():
                        self.chat_display.insert(tk.END, f"  {file_index}. {file_info['file_name']}\n")
         self.chat_display.config(state=tk.DISABLED)
 
-    def add_formatted_message(self, sender, message, timestamp, bg_color):
-        """Adds a formatted message to the chat display."""
+    def add_formatted_message(self, sender, message, timestamp, bg_color, meta=None):
+        """Adds a formatted message to the chat display, followed by notes from its metadata."""
         self.chat_display.config(state=tk.NORMAL)
         self.chat_display.insert(tk.END, f"{timestamp} {sender}: ", "bold")
         self.add_text_with_formatting(message)
+        if meta and meta.get("truncated"):
+            self.chat_display.insert(tk.END, " [stopped]", "italic")
         self.chat_display.insert(tk.END, "\n")
         self.chat_display.config(state=tk.DISABLED)
 
@@ -659,40 +1205,129 @@ class ChatApplication:
                 self.sessions[self.current_session].append(
                     ("System", f"File attached: {file_name}", timestamp)
                 )
+                self.move_session_to_top(self.current_session)
                 self.update_chat_display()
                 self.save_session()
                 
             except Exception as e:
                 messagebox.showerror("Error", f"Failed to attach file: {str(e)}")
 
-    def save_session(self):
-        """Saves the current session data."""
-        if self.current_session:
-            log_file = os.path.join(self.log_dir, f"{self.current_session}.json")
-            with open(log_file, "w") as f:
-                json.dump({
-                   "chat_log": self.sessions[self.current_session],
-                   "conversation_history": self.conversation_history,
-                   "attached_files": self.attached_files.get(self.current_session, {})
-                     }, f, indent=4)
+    def journal_path(self, session_name):
+        """Returns the path of a session's append-only journal."""
+        return os.path.join(self.log_dir, f"{session_name}.journal.jsonl")
+
+    def save_session(self, session=None):
+        """Appends a session's (by default the current one's) unsaved changes to its journal, compacting it into
+        the snapshot when it grows long."""
+        session = session or self.current_session
+        if session:
+            log_file = os.path.join(self.log_dir, f"{session}.json")
+            attachments = self.attached_files.get(session, {})
+            if not os.path.exists(log_file) or self.journal_lengths.get(session, 0) >= self.compact_every:
+                self.write_session_snapshot(session)
+            else:
+                saved_count = self.saved_counts.get(session, 0)
+                message_meta = self.message_meta.get(session, {})
+                records = [{"type": "message", "sender": sender, "message": message, "timestamp": timestamp}
+                           for sender, message, timestamp in self.sessions[session][saved_count:]]
+                for index, record in enumerate(records, saved_count):
+                    if index in message_meta:
+                        record["meta"] = message_meta[index]
+                saved_attachments = self.saved_attachments.get(session, set())
+                records += [{"type": "attachment", "file_index": str(file_index), "file_path": file_info["file_path"],
+                             "file_name": file_info["file_name"]}
+                            for file_index, file_info in attachments.items() if str(file_index) not in saved_attachments]
+                if records:
+                    with open(self.journal_path(session), "a", encoding="utf-8") as f:
+                        for record in records:
+                            f.write(json.dumps(record) + "\n")
+                    self.journal_lengths[session] = self.journal_lengths.get(session, 0) + len(records)
+            self.saved_counts[session] = len(self.sessions[session])
+            self.saved_attachments[session] = {str(file_index) for file_index in attachments}
+
+    def write_session_snapshot(self, session):
+        """Rewrites a session's snapshot file and truncates its journal."""
+        log_file = os.path.join(self.log_dir, f"{session}.json")
+        with open(log_file + ".tmp", "w") as f:
+            json.dump({
+               "chat_log": self.sessions[session],
+               "conversation_history": self.conversation_history if session == self.current_session else [
+                   {"role": "user" if sender == "You" else "model", "parts": [message]}
+                   for sender, message, timestamp in self.sessions[session] if sender in ["You", "AI"]],
+               "message_meta": {str(index): meta for index, meta in self.message_meta.get(session, {}).items()},
+               # File contents stay on disk at file_path; only references are persisted
+               "attached_files": {file_index: {"file_path": file_info["file_path"], "file_name": file_info["file_name"]}
+                                  for file_index, file_info in self.attached_files.get(session, {}).items()}
+                 }, f)
+        # The journal is set aside while the snapshot is replaced, so recover_journal can tell after a crash
+        # whether the snapshot on disk already contains it
+        if os.path.exists(self.journal_path(session)):
+            os.replace(self.journal_path(session), self.journal_path(session) + ".old")
+        os.replace(log_file + ".tmp", log_file)
+        if os.path.exists(self.journal_path(session) + ".old"):
+            os.remove(self.journal_path(session) + ".old")
+        self.journal_lengths[session] = 0
+
+    def recover_journal(self, session_name):
+        """Finishes a snapshot write interrupted by a crash: a journal set aside goes back if the new snapshot never
+        replaced the old one (its temporary file is still there), and is dropped if it did."""
+        aside_path = self.journal_path(session_name) + ".old"
+        if not os.path.exists(aside_path):
+            return
+        temp_path = os.path.join(self.log_dir, f"{session_name}.json.tmp")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+            os.replace(aside_path, self.journal_path(session_name))
+        else:
+            os.remove(aside_path)
+
+    def last_activity(self, log_file):
+        """Returns when a session was last written: its snapshot, or its journal when messages were appended since."""
+        journal_file = log_file[:-len(".json")] + ".journal.jsonl"
+        return max(os.path.getmtime(log_file), os.path.getmtime(journal_file) if os.path.exists(journal_file) else 0)
 
     def load_previous_sessions(self):
-         """Loads the previously saved sessions."""
+         """Loads the previously saved sessions, replaying each journal on top of its snapshot."""
          log_files = glob.glob(os.path.join(self.log_dir, "*.json"))
-         log_files.sort(key=os.path.getmtime, reverse=True)
+         log_files.sort(key=self.last_activity, reverse=True)
          for log_file in log_files:
              session_name = os.path.splitext(os.path.basename(log_file))[0]
              try:
                  with open(log_file, "r") as f:
                       data = json.load(f)
                       self.sessions[session_name] = data["chat_log"]
+                      self.message_meta[session_name] = {int(index): meta for index, meta in data.get("message_meta", {}).items()}
                       if "attached_files" in data:
                           self.attached_files[session_name] = data["attached_files"]
+                 self.replay_journal(session_name)
              except:
                  print(f"Failed to load log file {log_file}")
 
          self.update_session_list()
 
+    def replay_journal(self, session_name):
+        """Applies the journal records written since the last snapshot."""
+        records = 0
+        self.recover_journal(session_name)
+        if os.path.exists(self.journal_path(session_name)):
+            with open(self.journal_path(session_name), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn final write
+                    records += 1
+                    if record["type"] == "message":
+                        self.sessions[session_name].append((record["sender"], record["message"], record["timestamp"]))
+                        if record.get("meta"):
+                            self.message_meta.setdefault(session_name, {})[len(self.sessions[session_name]) - 1] = record["meta"]
+                    elif record["type"] == "attachment":
+                        self.attached_files.setdefault(session_name, {})[record["file_index"]] = {
+                            "file_path": record["file_path"], "file_name": record["file_name"]}
+        self.journal_lengths[session_name] = records
+        self.saved_counts[session_name] = len(self.sessions[session_name])
+        self.saved_attachments[session_name] = {str(file_index) for file_index in self.attached_files.get(session_name, {})}
+
     def on_select(self, event):
         """Handles the selection of text in the chat display."""
         try:
@@ -729,6 +1364,7 @@ class ChatApplication:
 if __name__ == "__main__":
     root = tk.Tk()
     app = ChatApplication(root)
+    root.protocol("WM_DELETE_WINDOW", app.on_close)
     root.geometry("800x600")
     root.config(bg=app.right_bg)
     root.mainloop()
@@ -0,0 +1,40 @@
+"""Shared fixtures: the PyQt app imported as a module, run from a scratch directory."""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_DIR, "mychat-pyqt-updated.py")
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))  # for the stub provider server
+
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("app"))  # the module creates chat_logs and mychat.log in the working directory
+    try:
+        spec = importlib.util.spec_from_file_location("mychat_pyqt_updated", APP_PATH)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
+
+@pytest.fixture(scope="session")
+def qt_app(app):
+    """The QApplication that delivers the workers' signals across threads."""
+    return app.QApplication.instance() or app.QApplication([])
+
+@pytest.fixture
+def stub_server():
+    """A local stub of the provider HTTP APIs; yields its base URL."""
+    from stub_server import StubHandler, start_stub_server
+    server, base_url = start_stub_server()
+    try:
+        yield base_url
+    finally:
+        StubHandler.delay = 0.0
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,69 @@
+"""Tests for trimming the conversation history to the provider's context window."""
+import pytest
+
+@pytest.fixture
+def manager(app, tmp_path):
+    manager = app.ChatSessionManager(app.JournalSessionStore(str(tmp_path)), app.BlobStore(str(tmp_path / "blobs")))
+    session_id, _ = manager.new_session()
+    for number in range(200):
+        manager.add_message(session_id, "You" if number % 2 == 0 else "AI", "word " * 100, "[test]", "test")
+    return manager, session_id
+
+def test_unknown_model_sends_whole_history(manager):
+    manager, session_id = manager
+    provider_config = {"model": "qwen2.5-72b-instruct"}
+    assert manager.context_budget("OpenAI Compatible", provider_config, "You are a helpful assistant.") is None
+    history, start = manager.get_context_history(session_id, "OpenAI Compatible", provider_config,
+                                                 "You are a helpful assistant.")
+    assert start == 0
+    assert len(history) == 200
+
+def test_small_window_caps_response_reserve(manager):
+    manager, session_id = manager
+    provider_config = {"model": "gpt-4"}  # an 8192-token window, smaller than the default max_tokens
+    budget = manager.context_budget("OpenAI", provider_config, "You are a helpful assistant.")
+    assert budget == 8192 - 8192 // 4 - (7 + 4)
+    history, start = manager.get_context_history(session_id, "OpenAI", provider_config, "You are a helpful assistant.")
+    assert start > 0
+    assert 1 < len(history) < 200
+    assert history.tokens() <= budget
+
+def test_explicit_context_window(manager):
+    manager, session_id = manager
+    provider_config = {"model": "qwen2.5-72b-instruct", "context_window": 4000, "max_tokens": 500}
+    budget = manager.context_budget("OpenAI Compatible", provider_config, "")
+    assert budget == 4000 - 500 - 4
+    history, start = manager.get_context_history(session_id, "OpenAI Compatible", provider_config, "")
+    assert 1 < len(history) < 200
+
+def test_trim_fills_budget(app):
+    log = app.MessageLog({"role": "user" if number % 2 == 0 else "assistant", "content": "word " * 100}
+                         for number in range(20))
+    history = log.snapshot()
+    tokens = history.tokens(0, 1)
+    start = app.ContextWindow.fit(history, 10 * tokens)
+    assert start == 10  # the budget holds exactly the last ten messages
+    assert app.ContextWindow.fit(history, 10 * tokens, previous_start=12) == 12
+    # With slack, a quarter of the budget more is freed when the window moves: seven messages fit, and the window
+    # then opens at the next user turn
+    assert app.ContextWindow.fit(history, 10 * tokens, slack=0.25) == 14
+
+def test_trim_slack_setting(manager):
+    manager, session_id = manager
+    provider_config = {"model": "qwen2.5-72b-instruct", "context_window": 4000, "max_tokens": 500}
+    history, start = manager.get_context_history(session_id, "OpenAI Compatible", provider_config, "", keep_window=False)
+    provider_config["context_trim_slack"] = 0.5
+    trimmed, trimmed_start = manager.get_context_history(session_id, "OpenAI Compatible", provider_config, "",
+                                                         keep_window=False)
+    assert trimmed_start > start
+    assert trimmed.tokens() <= (4000 - 500 - 4) // 2 < history.tokens()
+
+def test_message_log_adopts_loaded_list(app):
+    loaded = [{"role": "user", "content": "hello", "tokens": 6}, {"role": "assistant", "content": "word " * 8}]
+    log = app.MessageLog(loaded)
+    assert log.messages is loaded and loaded[0] == {"role": "user", "content": "hello", "tokens": 6}
+    assert loaded[1]["tokens"] == 10 + app.ContextWindow.message_overhead
+    assert log.prefix_sums == [0, 6, 20]
+    snapshot = log.snapshot()
+    log.append({"role": "user", "content": "more"})
+    assert log.prefix_sums[-1] == 25 and snapshot.tokens() == 20
@@ -0,0 +1,170 @@
+"""Tests for the Ollama adapter and the request scheduler, against the local stub provider server."""
+import threading
+import time
+
+import pytest
+from stub_server import StubHandler
+
+REPLY = StubHandler.reply.split()
+
+class Request:
+    """The parts of a ProviderAttempt an adapter's stream uses."""
+    completion_tokens = None
+
+    def add_closer(self, close):
+        pass
+
+@pytest.fixture
+def manager(app, tmp_path):
+    return app.ChatSessionManager(app.JournalSessionStore(str(tmp_path)), app.BlobStore(str(tmp_path / "blobs")))
+
+@pytest.fixture
+def config_manager(app, stub_server):
+    config_manager = app.APIConfigManager()
+    config_manager.config = {"active_provider": "Ollama", "Ollama": {"base_url": stub_server, "ollama_model": "stub"}}
+    return config_manager
+
+def add_session(app, manager, session_id, message="hello"):
+    manager.sessions[session_id] = {"session_name": session_id, "last_activity": time.time(), "message_count": 0,
+                                    "byte_size": 0, "chat_log": [], "conversation_history": app.MessageLog(),
+                                    "message_meta": {}, "attached_files": {}}
+    manager.add_message(session_id, "You", message, "[test]", "Ollama")
+
+def test_ollama_stream(app, stub_server):
+    adapter = app.get_adapter("Ollama")
+    request = Request()
+    history = [{"role": "user", "content": "hello"}]
+    chunks = list(adapter.stream(request, {"base_url": stub_server, "ollama_model": "stub"}, history))
+    assert "".join(chunks).split() == REPLY
+    assert adapter.payload({"ollama_model": "stub"}, history)["keep_alive"] == "5m"
+    with pytest.raises(Exception, match="Ollama Error: messages are required"):
+        list(adapter.stream(request, {"base_url": stub_server}, []))
+
+def test_ollama_worker(app, manager, config_manager):
+    add_session(app, manager, "s1")
+    worker = app.ApiWorker("s1", "hello", config_manager, manager)
+    chunks, finished = [], []
+    worker.signals.chunk.connect(lambda session_id, text: chunks.append(text))
+    worker.signals.finished.connect(lambda session_id, response, meta: finished.append((response, meta)))
+    worker.prepare()
+    worker.run()
+    response, meta = finished[0]
+    assert response.split() == REPLY and "".join(chunks) == response
+    assert (meta["provider"], meta["model"]) == ("Ollama", "stub")
+    assert meta["metrics"]["retries"] == 0
+    assert meta["metrics"]["completion_tokens"] > 0
+
+def test_ollama_worker_unreachable(app, manager, config_manager):
+    config_manager.config["Ollama"]["base_url"] = "http://127.0.0.1:9"  # nothing listens on the discard port
+    config_manager.config["retry"] = {"max_retries": 1}
+    add_session(app, manager, "s1")
+    worker = app.ApiWorker("s1", "hello", config_manager, manager)
+    errors = []
+    worker.signals.error.connect(lambda session_id, error: errors.append(error))
+    worker.prepare()
+    worker.run()
+    assert errors
+
+def wait_for(qt_app, condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        qt_app.processEvents()
+        time.sleep(0.01)
+    assert condition()
+
+@pytest.fixture
+def concurrency(monkeypatch):
+    """Makes the stub server take 0.2s per chat request and counts the requests it is answering at once; returns
+    [current, peak]."""
+    counts = [0, 0]
+    lock = threading.Lock()
+
+    def counting(handle):
+        def handle_counted(self, request):
+            with lock:
+                counts[0] += 1
+                counts[1] = max(counts)
+            try:
+                time.sleep(0.2)
+                handle(self, request)
+            finally:
+                with lock:
+                    counts[0] -= 1
+        return handle_counted
+
+    for name in ["handle_ollama_chat", "handle_chat_completions"]:
+        monkeypatch.setattr(StubHandler, name, counting(getattr(StubHandler, name)))
+    return counts
+
+def test_scheduler_limits_concurrency_and_orders_sessions(app, qt_app, manager, config_manager, concurrency):
+    scheduler = app.RequestScheduler(max_concurrent=2)
+    busy, done = [], []
+    scheduler.in_flight_changed.connect(lambda session_id, in_flight: busy.append((session_id, in_flight)))
+    for session_id in ["s1", "s2", "s3"]:
+        add_session(app, manager, session_id)
+    for session_id, message in [("s1", "first"), ("s1", "second"), ("s2", "hello"), ("s3", "hello")]:
+        worker = app.ApiWorker(session_id, message, config_manager, manager)
+        worker.signals.finished.connect(lambda session_id, response, meta, message=message:
+                                        done.append((session_id, message, time.monotonic())))
+        scheduler.submit(worker)
+    assert scheduler.is_busy("s1") and len(scheduler.queued["s1"]) == 1
+    wait_for(qt_app, lambda: len(done) == 4)
+    assert concurrency[1] == 2
+    assert [message for session_id, message, _ in done if session_id == "s1"] == ["first", "second"]
+    wait_for(qt_app, lambda: len(busy) == 6)
+    assert sorted(busy) == sorted((session_id, in_flight) for session_id in ["s1", "s2", "s3"]
+                                  for in_flight in [True, False])
+    assert not scheduler.running and not scheduler.queued
+
+def test_scheduler_cancel_drops_queued(app, qt_app, manager, config_manager, concurrency):
+    scheduler = app.RequestScheduler(max_concurrent=1)
+    add_session(app, manager, "s1")
+    add_session(app, manager, "s2")
+    outcomes = []
+    for session_id in ["s1", "s1", "s2"]:
+        worker = app.ApiWorker(session_id, "hello", config_manager, manager)
+        worker.signals.finished.connect(lambda session_id, *args: outcomes.append((session_id, "finished")))
+        worker.signals.cancelled.connect(lambda session_id, *args: outcomes.append((session_id, "cancelled")))
+        scheduler.submit(worker)
+    scheduler.cancel("s2")  # still waiting for the pool thread s1 holds
+    scheduler.cancel("s1")
+    wait_for(qt_app, lambda: len(outcomes) == 2 and not scheduler.running)
+    assert sorted(outcomes) == [("s1", "cancelled"), ("s2", "cancelled")]
+    scheduler.shutdown()
+
+@pytest.mark.parametrize("max_concurrent", [1, 2])
+def test_scheduler_limits_hedged_streams(app, qt_app, manager, config_manager, stub_server, concurrency,
+                                         monkeypatch, max_concurrent):
+    config_manager.config["OpenAI Compatible"] = {"api_key": "key", "base_url": stub_server + "/v1", "model": "stub"}
+    config_manager.config["fallback"] = {"providers": ["OpenAI Compatible"], "hedge_delay": 0.05}
+    monkeypatch.setattr(app, "first_token_latency", app.LatencyTracker())  # no earlier samples to hedge by
+    scheduler = app.RequestScheduler(max_concurrent=max_concurrent)
+    add_session(app, manager, "s1")
+    finished = []
+    worker = app.ApiWorker("s1", "hello", config_manager, manager)
+    worker.signals.finished.connect(lambda session_id, response, meta: finished.append(meta))
+    scheduler.submit(worker)
+    wait_for(qt_app, lambda: finished and not scheduler.running)
+    scheduler.shutdown()
+    # The hedge waits for a stream thread, so with one it never runs alongside the first provider
+    assert concurrency[1] == max_concurrent
+    assert finished[0]["metrics"]["retries"] == 0  # a hedge is not a retry
+    if max_concurrent == 1:
+        assert finished[0]["provider"] == "Ollama"
+
+def test_percentile_nearest_rank(app):
+    assert app.percentile([2, 1], 50) == 1
+    assert app.percentile(range(1, 101), 95) == 95
+    assert app.percentile([3], 0) == 3
+    assert app.percentile([], 50) is None
+
+def test_metrics_dialog_loads_all_sessions_in_background(app, qt_app, manager):
+    for session_id, ttft in [("s1", 1.0), ("s2", 3.0)]:
+        add_session(app, manager, session_id)
+        manager.add_message(session_id, "AI", "answer", "[test]", "Ollama",
+                            meta={"provider": "Ollama", "model": "stub", "metrics": {"ttft": ttft, "retries": 1}})
+        manager.save_session(session_id)
+    dialog = app.MetricsDialog(manager)
+    assert dialog.table.item(0, 0).text() == "Loading..."
+    wait_for(qt_app, lambda: dialog.table.rowCount() == 2)
+    assert [dialog.table.item(0, column).text() for column in [1, 2, 7]] == ["2", "1.00 / 3.00", "2"]
@@ -0,0 +1,124 @@
+"""Tests for rate limiting, circuit breaking, retry backoff and the classification of provider errors."""
+import pytest
+
+def test_token_bucket_serves_reservations_in_order(app):
+    bucket = app.TokenBucket(rate=1.0, capacity=2)
+    now = bucket.updated
+    assert bucket.reserve(1, now) == 0.0
+    assert bucket.reserve(1, now) == 0.0
+    assert bucket.reserve(1, now) == pytest.approx(1.0)
+    assert bucket.reserve(1, now) == pytest.approx(2.0)  # queued behind the previous reservation
+    assert bucket.reserve(1, now + 3) == pytest.approx(0.0)
+
+def test_token_bucket_caps_amount_and_refill(app):
+    bucket = app.TokenBucket(rate=10.0, capacity=100)
+    now = bucket.updated
+    assert bucket.reserve(500, now) == 0.0  # a request larger than the bucket waits for a full bucket only
+    assert bucket.reserve(10, now) == pytest.approx(1.0)
+    bucket.refill(now + 1000)
+    assert bucket.level == 100
+
+def test_token_bucket_adjust_and_hold(app):
+    bucket = app.TokenBucket(rate=1.0, capacity=5)
+    now = bucket.updated
+    bucket.reserve(5, now)
+    bucket.adjust(-5, now)  # a cancelled reservation is given back
+    assert bucket.level == 5
+    bucket.hold(3, now)
+    assert bucket.reserve(1, now) == pytest.approx(4.0)
+    bucket.hold(1, now)  # a shorter hold never shortens the wait
+    assert bucket.level == pytest.approx(-4.0)
+
+def test_rate_limiter_waits_for_the_tighter_quota(app):
+    limiter = app.RateLimiter(requests_per_minute=60, tokens_per_minute=600)
+    assert limiter.reserve(600) == 0.0
+    assert limiter.reserve(60) == pytest.approx(6.0, abs=0.05)  # tokens run out first
+    limiter.release(60)
+    limiter.release(600)
+    assert limiter.reserve(10) == pytest.approx(0.0, abs=0.05)
+    limiter.hold(30)
+    assert limiter.reserve(1) == pytest.approx(31.0, abs=0.05)  # the bucket is empty for 30s, then refills
+
+def test_rate_limiters_per_model(app):
+    limiters = app.RateLimiters()
+    config = {"OpenAI": {"requests_per_minute": 10, "models": {"gpt-4o": {"tokens_per_minute": 1000}}}}
+    assert limiters.get("Ollama", "llama3", config) is None
+    assert limiters.get("OpenAI", "gpt-4o-mini", config).settings == (10, None)
+    limiter = limiters.get("OpenAI", "gpt-4o", config)
+    assert limiter.settings == (10, 1000)
+    assert limiters.get("OpenAI", "gpt-4o", config) is limiter
+    config["OpenAI"]["requests_per_minute"] = 20
+    assert limiters.get("OpenAI", "gpt-4o", config) is not limiter  # changed settings take effect
+
+def test_circuit_breaker_opens_and_recovers(app, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: now[0])
+    breaker = app.CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    assert breaker.remaining() == 10
+    now[0] += 10
+    assert breaker.allow()  # the half-open trial
+    assert not breaker.allow()  # one trial at a time
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+def test_circuit_breaker_failed_trial_reopens(app, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: now[0])
+    breaker = app.CircuitBreaker(failure_threshold=3, reset_timeout=10)
+    for _ in range(3):
+        breaker.record_failure()
+    now[0] += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+    now[0] += 10
+    assert breaker.allow()
+    breaker.release_trial()  # the trial was cancelled before it had an outcome
+    assert breaker.allow()
+
+def test_retry_policy(app, monkeypatch):
+    monkeypatch.setattr(app.random, "uniform", lambda low, high: high)
+    policy = app.RetryPolicy({"max_retries": 3, "base_delay": 1.0, "max_delay": 1.5, "max_retry_after": 20})
+    assert policy.delay(0) == 1.0
+    assert policy.delay(1) == 1.5  # capped at max_delay
+    assert policy.delay(2) is None  # out of retries
+    assert policy.delay(0, retry_after=5) == 5  # the provider's Retry-After is the minimum wait
+    assert policy.delay(0, retry_after=30) is None  # too long to wait
+
+def test_classify_error(app):
+    assert app.classify_error(app.ProviderError("overloaded", 529, {"retry-after": "2"})) == (True, 2.0)
+    assert app.classify_error(app.ProviderError("bad request", 400, {"retry-after": "2"})) == (False, None)
+    assert app.classify_error(app.requests.exceptions.ConnectionError()) == (True, None)
+    assert app.classify_error(app.CircuitOpenError("paused")) == (False, None)
+    assert app.classify_error(ValueError("bug")) == (False, None)
+
+def test_retry_after_seconds(app):
+    assert app.retry_after_seconds({"Retry-After-Ms": "1500"}, 503) == 1.5
+    assert app.retry_after_seconds({"retry-after": "3"}, 429) == 3.0
+    assert app.retry_after_seconds({"retry-after": "soon"}, 429) is None
+    assert app.retry_after_seconds({}, 429) is None
+    assert app.parse_duration("6m0s") == 360
+    assert app.parse_duration("250ms") == 0.25
+
+def test_retry_after_reads_only_exhausted_buckets(app):
+    headers = {"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "1s",
+               "x-ratelimit-remaining-tokens": "1200", "x-ratelimit-reset-tokens": "6m0s"}
+    assert app.retry_after_seconds(headers, 429) == 1.0
+    headers["x-ratelimit-remaining-tokens"] = "0"
+    assert app.retry_after_seconds(headers, 429) == 360
+    headers["retry-after"] = "2"
+    assert app.retry_after_seconds(headers, 429) == 2.0  # the provider's own answer wins
+    assert app.retry_after_seconds({"x-ratelimit-reset-tokens": "6m0s"}, 429) is None
+
+def test_overload_ignores_rate_limit_resets(app):
+    reset = (app.datetime.utcnow() + app.timedelta(seconds=90)).isoformat() + "Z"
+    headers = {"anthropic-ratelimit-tokens-remaining": "0", "anthropic-ratelimit-tokens-reset": reset,
+               "anthropic-ratelimit-requests-remaining": "49", "anthropic-ratelimit-requests-reset": reset}
+    assert app.classify_error(app.ProviderError("overloaded", 529, headers)) == (True, None)
+    assert app.RetryPolicy({"max_retry_after": 60}).delay(0, retry_after=None) is not None
+    retryable, retry_after = app.classify_error(app.ProviderError("rate limited", 429, headers))
+    assert retryable and retry_after == pytest.approx(90, abs=2)
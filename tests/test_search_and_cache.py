@@ -0,0 +1,103 @@
+"""Tests for the full-text search index and the response cache."""
+import time
+
+import pytest
+
+@pytest.fixture
+def search_index(app, tmp_path):
+    return app.SearchIndex(str(tmp_path / "search.db"))
+
+def test_search_finds_messages_names_and_attachments(search_index):
+    search_index.set_session_name("s1", "Holiday plans")
+    search_index.add_messages("s1", 0, [("You", "Which trains go to Lisbon?", "[t]"), ("AI", "Several do.", "[t]")])
+    search_index.add_attachment("s1", "itinerary.pdf")
+    matches, truncated = search_index.search("lisbon")
+    assert not truncated
+    assert [(session_id, kind, index) for session_id, kind, index, _ in matches] == [("s1", "message", 0)]
+    assert "[Lisbon]" in matches[0][3]
+    assert search_index.search("holiday")[0][0][:2] == ("s1", "name")
+    assert search_index.search("itinerary")[0][0][:2] == ("s1", "attachment")
+    assert search_index.indexed_sessions() == {"s1": ("Holiday plans", 2)}
+
+def test_search_query_syntax(search_index):
+    search_index.set_session_name("s1", "Session")
+    search_index.add_messages("s1", 0, [("You", "red apple pie", "[t]"), ("You", "apple red", "[t]"),
+                                        ("You", "applesauce", "[t]")])
+    assert {match[2] for match in search_index.search("red apple")[0]} == {0, 1}
+    assert {match[2] for match in search_index.search('"red apple"')[0]} == {0}
+    assert {match[2] for match in search_index.search("apple*")[0]} == {0, 1, 2}
+    assert search_index.search('"unbalanced')[0] == []  # quotes in the query never break the FTS5 syntax
+    assert search_index.search("   ") == ([], False)
+
+def test_search_rank_window(app, tmp_path):
+    search_index = app.SearchIndex(str(tmp_path / "search.db"), rank_window=3)
+    search_index.set_session_name("s1", "Session")
+    search_index.add_messages("s1", 0, [("You", f"match {number}", "[t]") for number in range(5)])
+    matches, truncated = search_index.search("match")
+    assert truncated
+    assert {match[2] for match in matches} == {2, 3, 4}  # only the newest rank_window matches are ranked
+    search_index.rank_window = 5
+    matches, truncated = search_index.search("match")
+    assert not truncated and len(matches) == 5
+
+def test_search_rename_and_delete(search_index):
+    search_index.set_session_name("s1", "Old name")
+    search_index.set_session_name("s1", "New name")
+    assert search_index.search("old") == ([], False)
+    assert search_index.search("new")[0][0][0] == "s1"
+    search_index.delete_session("s1")
+    assert search_index.search("new") == ([], False)
+    assert search_index.indexed_sessions() == {}
+
+def test_manager_indexes_existing_sessions(app, tmp_path):
+    store = app.JournalSessionStore(str(tmp_path))
+    manager = app.ChatSessionManager(store, app.BlobStore(str(tmp_path / "blobs")))
+    session_id, _ = manager.new_session()
+    manager.add_message(session_id, "You", "indexed later", "[t]", "test")
+    manager.save_session(session_id)
+    search_index = app.SearchIndex(str(tmp_path / "search.db"))
+    manager = app.ChatSessionManager(store, app.BlobStore(str(tmp_path / "blobs")), search_index)
+    assert manager.search("indexed")[0][0][:3] == (session_id, "message", 0)
+
+@pytest.fixture
+def cache(app, tmp_path):
+    return app.ResponseCache(str(tmp_path / "cache.db"), memory_entries=2)
+
+def test_cache_round_trip(app, cache, tmp_path):
+    key = cache.key("OpenAI", "gpt-4o", 0, "system", [{"role": "user", "content": "hi"}])
+    assert key != cache.key("OpenAI", "gpt-4o", 0, "system", [{"role": "user", "content": "hello"}])
+    assert cache.get(key) is None
+    cache.put(key, "answer")
+    assert cache.get(key) == "answer"
+    assert app.ResponseCache(str(tmp_path / "cache.db")).get(key) == "answer"  # persisted
+    stats = cache.statistics()
+    assert (stats["memory_hits"], stats["misses"], stats["stores"], stats["entries"]) == (1, 1, 1, 1)
+    assert stats["hit_rate"] == 0.5
+
+def test_cache_applies(cache):
+    assert cache.applies(0)
+    assert not cache.applies(0.7)
+    assert cache.applies(0.7, "force")
+    assert not cache.applies(0, "bypass")
+
+def test_cache_memory_lru_falls_back_to_disk(cache):
+    for key in ["a", "b", "c"]:
+        cache.put(key, key.upper())
+    assert list(cache.memory) == ["b", "c"]
+    assert cache.get("a") == "A"
+    assert cache.statistics()["disk_hits"] == 1
+    assert list(cache.memory) == ["c", "a"]
+
+def test_cache_expiry_and_size_limit(app, tmp_path):
+    cache = app.ResponseCache(str(tmp_path / "cache.db"), ttl=60, max_bytes=10)
+    cache.put("old", "12345")
+    cache.put("new", "67890")
+    cache.get("old")  # makes "new" the least recently used
+    cache.put("newest", "abc")
+    assert cache.get("new") is None
+    assert cache.get("old") == "12345" and cache.get("newest") == "abc"
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.get("old") is None
+    cache.clear()
+    assert cache.statistics()["entries"] == 0
@@ -0,0 +1,238 @@
+"""Tests for the session stores (JSON snapshot plus journal, SQLite) and the attachment blob store."""
+import json
+import os
+import time
+
+import pytest
+
+def make_manager(app, store, tmp_path):
+    return app.ChatSessionManager(store, app.BlobStore(str(tmp_path / "blobs")))
+
+def fill_session(manager, session_id, count):
+    for number in range(count):
+        manager.add_message(session_id, "You" if number % 2 == 0 else "AI", f"message {number}", "[test]", "test",
+                            meta={"provider": "test"} if number % 2 else None)
+
+@pytest.fixture(params=["json", "sqlite"])
+def store_factory(app, tmp_path, request):
+    """Returns a function opening the store under test on the same files each time it is called."""
+    def open_store():
+        if request.param == "sqlite":
+            return app.SQLiteSessionStore(str(tmp_path / "sessions.db"))
+        return app.JournalSessionStore(str(tmp_path))
+    return open_store
+
+def test_round_trip(app, tmp_path, store_factory):
+    manager = make_manager(app, store_factory(), tmp_path)
+    session_id, _ = manager.new_session()
+    fill_session(manager, session_id, 5)
+    attachment = tmp_path / "notes.txt"
+    attachment.write_text("attached text")
+    manager.attach_file(session_id, str(attachment))
+    manager.rename_session(session_id, "Renamed")
+    manager.save_session(session_id)
+
+    reloaded = make_manager(app, store_factory(), tmp_path)
+    assert reloaded.sessions[session_id]["session_name"] == "Renamed"
+    assert reloaded.sessions[session_id]["message_count"] == 5
+    messages = reloaded.get_session_messages(session_id)
+    assert [message for _, message, _ in messages] == [f"message {number}" for number in range(5)]
+    assert [message["role"] for message in reloaded.get_conversation_history(session_id)] == ["user", "assistant"] * 2 + ["user"]
+    assert reloaded.get_message_meta(session_id) == {1: {"provider": "test"}, 3: {"provider": "test"}}
+    with open(reloaded.get_attachment_path(session_id, "notes.txt")) as file:
+        assert file.read() == "attached text"
+
+def test_appends_after_reload(app, tmp_path, store_factory):
+    manager = make_manager(app, store_factory(), tmp_path)
+    session_id, _ = manager.new_session()
+    fill_session(manager, session_id, 3)
+    manager.save_session(session_id)
+    reloaded = make_manager(app, store_factory(), tmp_path)
+    reloaded.add_message(session_id, "You", "later", "[test]", "test")
+    reloaded.save_session(session_id)
+    messages = make_manager(app, store_factory(), tmp_path).get_session_messages(session_id)
+    assert [message for _, message, _ in messages][-2:] == ["message 2", "later"]
+
+def test_delete(app, tmp_path, store_factory):
+    manager = make_manager(app, store_factory(), tmp_path)
+    session_id, _ = manager.new_session()
+    fill_session(manager, session_id, 2)
+    manager.save_session(session_id)
+    manager.delete_session(session_id)
+    assert session_id not in make_manager(app, store_factory(), tmp_path).sessions
+
+def test_journal_appends_until_compaction(app, tmp_path):
+    store = app.JournalSessionStore(str(tmp_path), compact_every=4)
+    manager = make_manager(app, store, tmp_path)
+    session_id, _ = manager.new_session()
+    manager.add_message(session_id, "You", "first", "[test]", "test")
+    manager.save_session(session_id)  # the first save writes the snapshot
+    assert not os.path.exists(store.journal_path(session_id))
+    for number in range(3):
+        manager.add_message(session_id, "You", f"more {number}", "[test]", "test")
+        manager.save_session(session_id)
+    assert len(store.read_journal(session_id)) == 3
+    manager.add_message(session_id, "You", "last", "[test]", "test")
+    manager.save_session(session_id)
+    manager.add_message(session_id, "You", "compacts", "[test]", "test")
+    manager.save_session(session_id)
+    assert not os.path.exists(store.journal_path(session_id))
+    assert len(make_manager(app, app.JournalSessionStore(str(tmp_path)), tmp_path).get_session_messages(session_id)) == 6
+
+def test_journal_skips_torn_record(app, tmp_path):
+    store = app.JournalSessionStore(str(tmp_path))
+    manager = make_manager(app, store, tmp_path)
+    session_id, _ = manager.new_session()
+    fill_session(manager, session_id, 2)
+    manager.save_session(session_id)
+    manager.add_message(session_id, "You", "kept", "[test]", "test")
+    manager.save_session(session_id)
+    with open(store.journal_path(session_id), "a", encoding="utf-8") as file:
+        file.write('{"type":"message","sender":"AI","mess')  # a write cut short by a crash
+    messages = make_manager(app, app.JournalSessionStore(str(tmp_path)), tmp_path).get_session_messages(session_id)
+    assert [message for _, message, _ in messages] == ["message 0", "message 1", "kept"]
+
+def test_journal_rebuilds_missing_index(app, tmp_path):
+    manager = make_manager(app, app.JournalSessionStore(str(tmp_path)), tmp_path)
+    session_id, _ = manager.new_session()
+    fill_session(manager, session_id, 3)
+    manager.save_session(session_id)
+    manager.add_message(session_id, "You", "journalled", "[test]", "test")
+    manager.save_session(session_id)
+    os.remove(os.path.join(str(tmp_path), "index.jsonl"))
+    index = app.JournalSessionStore(str(tmp_path)).load_index()
+    assert index[session_id]["message_count"] == 4
+    assert index[session_id]["byte_size"] == len("message 0message 1message 2journalled")
+
+def test_export_to_sqlite(app, tmp_path):
+    manager = make_manager(app, app.JournalSessionStore(str(tmp_path)), tmp_path)
+    session_id, _ = manager.new_session()
+    fill_session(manager, session_id, 4)
+    manager.save_session(session_id)
+    target = app.SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    assert manager.export_sessions(target) == 1
+    exported = make_manager(app, target, tmp_path)
+    assert exported.get_session_messages(session_id) == manager.get_session_messages(session_id)
+    assert exported.sessions[session_id]["last_activity"] == pytest.approx(manager.sessions[session_id]["last_activity"])
+
+def test_blob_store_deduplicates(app, tmp_path):
+    blob_store = app.BlobStore(str(tmp_path / "blobs"), chunk_size=3)
+    first = blob_store.put_bytes(b"same content", "a.txt")
+    second = blob_store.put_bytes(b"same content", "b.png")
+    assert first["sha256"] == second["sha256"]
+    assert (first["name"], first["size"], first["mime"]) == ("a.txt", 12, "text/plain")
+    assert second["mime"] == "image/png"
+    with open(blob_store.blob_path(first["sha256"]), "rb") as file:
+        assert file.read() == b"same content"
+    blobs = [name for _, _, names in os.walk(blob_store.root) for name in names]
+    assert blobs == [first["sha256"]]  # one copy, and no temporary files left behind
+
+def test_blob_store_empty_file(app, tmp_path):
+    blob_store = app.BlobStore(str(tmp_path / "blobs"))
+    path = tmp_path / "empty.bin"
+    path.write_bytes(b"")
+    ref = blob_store.put_file(str(path))
+    assert ref["size"] == 0
+    assert os.path.getsize(blob_store.blob_path(ref["sha256"])) == 0
+
+@pytest.mark.parametrize("crash_at", ["replace snapshot", "remove journal"])
+def test_journal_survives_crash_during_compaction(app, tmp_path, monkeypatch, crash_at):
+    store = app.JournalSessionStore(str(tmp_path))
+    manager = make_manager(app, store, tmp_path)
+    session_id, _ = manager.new_session()
+    fill_session(manager, session_id, 2)
+    manager.save_session(session_id)
+    manager.add_message(session_id, "You", "message 2", "[test]", "test")
+    manager.add_message(session_id, "AI", "message 3", "[test]", "test")
+    manager.save_session(session_id)
+
+    def crash(*args):
+        raise SystemExit("crashed")
+
+    # Crash just before the new snapshot replaces the old one, or just after
+    if crash_at == "replace snapshot":
+        replace = os.replace
+        monkeypatch.setattr(app.os, "replace", lambda source, target: crash() if target == store.snapshot_path(session_id)
+                            else replace(source, target))
+    else:
+        monkeypatch.setattr(app.os, "remove", crash)
+    with pytest.raises(SystemExit):
+        manager.compact_session(session_id)
+    monkeypatch.undo()
+
+    reloaded = make_manager(app, app.JournalSessionStore(str(tmp_path)), tmp_path)
+    messages = reloaded.get_session_messages(session_id)
+    assert [message for _, message, _ in messages] == [f"message {number}" for number in range(4)]
+    assert len(reloaded.get_conversation_history(session_id)) == 4
+    reloaded.add_message(session_id, "You", "message 4", "[test]", "test")
+    reloaded.save_session(session_id)
+    messages = make_manager(app, app.JournalSessionStore(str(tmp_path)), tmp_path).get_session_messages(session_id)
+    assert len(messages) == 5
+    assert sorted(os.listdir(str(tmp_path))) == sorted(["blobs", "index.jsonl", f"{session_id}.json",
+                                                        f"{session_id}.journal.jsonl"])
+
+def test_sqlite_index_is_most_recent_first(app, tmp_path):
+    store = app.SQLiteSessionStore(str(tmp_path / "sessions.db"))
+    for number, last_activity in enumerate([200.0, 100.0, 300.0]):
+        store.write_snapshot(f"s{number}", {"session_name": f"Session {number}", "chat_log": [], "attached_files": {}},
+                             last_activity=last_activity)
+    assert list(store.load_index()) == ["s2", "s0", "s1"]
+    manager = make_manager(app, store, tmp_path)
+    assert manager.list_sessions(limit=2, offset=1) == [("s0", "Session 0"), ("s1", "Session 1")]
+
+def write_tk_session(tmp_path, session_id, attachment):
+    """Writes a session the way the Tk frontend saves one."""
+    snapshot = {"chat_log": [["You", "hi", "[t]"], ["AI", "hello", "[t]"]],
+                "conversation_history": [{"role": "user", "parts": ["hi"]}, {"role": "model", "parts": ["hello"]}],
+                "message_meta": {}, "attached_files": {"1": {"file_path": str(attachment), "file_name": "tk.txt"}}}
+    with open(tmp_path / f"{session_id}.json", "w") as file:
+        json.dump(snapshot, file)
+
+def append_tk_records(store, session_id, records):
+    with open(store.journal_path(session_id), "a", encoding="utf-8") as file:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+    later = time.time() + 10
+    os.utime(store.journal_path(session_id), (later, later))
+
+def test_index_picks_up_sessions_written_elsewhere(app, tmp_path, monkeypatch):
+    store = app.JournalSessionStore(str(tmp_path))
+    manager = make_manager(app, store, tmp_path)
+    kept, _ = manager.new_session()
+    fill_session(manager, kept, 2)
+    manager.save_session(kept)
+    for session_id in ["Session_tk_new", "Session_tk_gone"]:
+        write_tk_session(tmp_path, session_id, tmp_path / "missing.txt")
+    make_manager(app, app.JournalSessionStore(str(tmp_path)), tmp_path)
+    os.remove(tmp_path / "Session_tk_gone.json")
+    append_tk_records(store, kept, [{"type": "message", "sender": "You", "message": "from tk", "timestamp": "[t]"}])
+
+    reloaded = make_manager(app, app.JournalSessionStore(str(tmp_path)), tmp_path)
+    assert set(reloaded.sessions) == {kept, "Session_tk_new"}
+    assert reloaded.sessions[kept]["message_count"] == 3
+    assert reloaded.sessions[kept]["last_activity"] == pytest.approx(os.path.getmtime(store.journal_path(kept)))
+    assert reloaded.sessions["Session_tk_new"]["session_name"] == "Session_tk_new"
+    assert reloaded.sessions["Session_tk_new"]["message_count"] == 2
+    assert [message["role"] for message in reloaded.get_conversation_history("Session_tk_new")] == ["user", "assistant"]
+    assert reloaded.get_attached_files("Session_tk_new") == {}  # the attached file no longer exists
+
+    # Once indexed, sessions are not read again at startup
+    store = app.JournalSessionStore(str(tmp_path))
+    monkeypatch.setattr(store, "load_session", lambda session_id: pytest.fail(f"{session_id} read again"))
+    assert set(make_manager(app, store, tmp_path).sessions) == {kept, "Session_tk_new"}
+
+def test_tk_attachment_records(app, tmp_path):
+    store = app.JournalSessionStore(str(tmp_path))
+    manager = make_manager(app, store, tmp_path)
+    session_id, _ = manager.new_session()
+    fill_session(manager, session_id, 2)
+    manager.save_session(session_id)
+    attachment = tmp_path / "report.txt"
+    attachment.write_text("report")
+    append_tk_records(store, session_id, [
+        {"type": "attachment", "file_index": "1", "file_path": str(attachment), "file_name": "report.txt"},
+        {"type": "attachment", "file_index": "2", "file_path": str(tmp_path / "gone.txt"), "file_name": "gone.txt"}])
+    reloaded = make_manager(app, app.JournalSessionStore(str(tmp_path)), tmp_path)
+    assert list(reloaded.get_attached_files(session_id)) == ["report.txt"]
+    with open(reloaded.get_attachment_path(session_id, "report.txt")) as file:
+        assert file.read() == "report"